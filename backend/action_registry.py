@@ -0,0 +1,159 @@
+# backend/action_registry.py
+"""
+Declarative registry of the system actions.
+Each action names its permission, the command it runs (a key of the commands table for the
+built-in ones, a template of its own for the ones defined by users), its parameter schema,
+its timeout, whether it is idempotent (safe to retry) and whether it coalesces. One dispatch
+route looks actions up by name; the registry is built once per version of the actions table,
+so a request never rebuilds it.
+Coalescing actions are submitted latest-wins: a burst only applies the newest request.
+"""
+import json
+import re
+from types import MappingProxyType
+
+from permissions import PERMISSION_BITS
+
+ACTION_NAME = re.compile(r"[a-z][a-z0-9_]{0,31}")
+RESERVED_NAMES = ("batch",) # Static routes under /api/actions/
+PARAMETER_TYPES = ("number", "integer", "string")
+MAX_STRING_PARAMETER = 256
+MAX_TIMEOUT = 300
+
+
+class Action:
+    """One registry entry; immutable once built."""
+
+    def __init__(self, name, label, permission, command_key=None, command=None, params=None, timeout=None,
+                 idempotent=False, coalesce=False, builtin=True):
+        self.name = name
+        self.label = label
+        self.permission = permission
+        self.command_key = command_key
+        self.command = command
+        self.params = dict(params or {})
+        self.timeout = timeout
+        self.idempotent = idempotent # Safe to run again, e.g. when a fleet broadcast retries it
+        self.coalesce = coalesce # Only the newest of a burst of requests needs to run
+        self.builtin = builtin
+        # Jobs and coalescing slots are named after the command key (custom actions get their own)
+        self.job_name = command_key or f"action_{name}"
+
+    def parse_params(self, data):
+        """Returns (value for the "{}" placeholder or None, error message or None)."""
+        if not self.params:
+            return None, None
+        (param, spec), = self.params.items()
+        value = data.get(param) if isinstance(data, dict) else None
+        kind = spec["type"]
+        if kind == "string":
+            if not isinstance(value, str) or not value or len(value) > MAX_STRING_PARAMETER:
+                return None, f"Invalid {param}. Must be a non-empty string."
+            if spec.get("choices") and value not in spec["choices"]:
+                return None, f"Invalid {param}. Must be one of: {', '.join(spec['choices'])}."
+            return value, None
+        if isinstance(value, bool) or not isinstance(value, int if kind == "integer" else (int, float)):
+            return None, f"Invalid {param}. Must be {'an integer' if kind == 'integer' else 'a number'}."
+        low, high = spec.get("min"), spec.get("max")
+        if (low is not None and value < low) or (high is not None and value > high):
+            return None, f"Invalid {param}. Must be between {low} and {high}."
+        return value, None
+
+    def describe(self):
+        """Public description for the API (no command)."""
+        return {
+            "name": self.name, "label": self.label, "permission": self.permission, "params": self.params,
+            "timeout": self.timeout, "idempotent": self.idempotent, "coalesce": self.coalesce, "builtin": self.builtin,
+        }
+
+
+# idempotent=True only where running the request twice is harmless (never shutdown or restart);
+# coalesce=True only where every request supersedes the previous ones (the volume slider)
+BUILTIN_ACTIONS = (
+    Action("shutdown", "Shutdown", "shutdown", "shutdown_cmd", timeout=30),
+    Action("restart", "Restart", "restart", "restart_cmd", timeout=30),
+    Action("lock", "Lock", "lock", "lock_cmd", idempotent=True),
+    Action("play_pause", "Play/Pause", "play_pause", "play_pause_cmd", timeout=5),
+    Action("media_next", "Media Next", "media_next", "media_next_cmd", timeout=5),
+    Action("media_previous", "Media Previous", "media_previous", "media_previous_cmd", timeout=5),
+    Action("set_volume", "Set volume", "volume", "set_volume_cmd",
+           params={"level": {"type": "number", "min": 0, "max": 100}}, timeout=5, idempotent=True, coalesce=True),
+    Action("volume_mute", "Volume Mute", "volume_mute", "volume_mute_cmd", timeout=5),
+)
+BUILTIN_NAMES = frozenset(action.name for action in BUILTIN_ACTIONS)
+
+
+def validate_definition(name, data):
+    """
+    Checks a user-defined action (as sent to the API) and returns its normalized fields:
+    label, permission, command, params (JSON text), timeout, idempotent. Raises ValueError.
+    """
+    if not ACTION_NAME.fullmatch(name):
+        raise ValueError("Action names must be 1-32 lowercase letters, digits or underscores.")
+    if name in RESERVED_NAMES:
+        raise ValueError(f'"{name}" is a reserved name.')
+    if name in BUILTIN_NAMES:
+        raise ValueError(f'"{name}" is a built-in action; change its command instead.')
+    if not isinstance(data, dict):
+        raise ValueError("Invalid data format for the action.")
+
+    label = data.get("label") or name
+    command = data.get("command")
+    permission = data.get("permission")
+    if not isinstance(label, str) or len(label) > 64:
+        raise ValueError("The label must be a string of at most 64 characters.")
+    if not isinstance(command, str) or not command.strip():
+        raise ValueError("The command can't be empty.")
+    if permission not in PERMISSION_BITS:
+        raise ValueError(f"Unknown permission: {permission}.")
+
+    params = data.get("params") or {}
+    if not isinstance(params, dict) or len(params) > 1:
+        raise ValueError("An action takes at most one parameter (the {} placeholder of its command).")
+    for param, spec in params.items():
+        if not ACTION_NAME.fullmatch(param) or not isinstance(spec, dict) or spec.get("type") not in PARAMETER_TYPES:
+            raise ValueError(f"Invalid schema for parameter {param}: type must be one of {', '.join(PARAMETER_TYPES)}.")
+        for bound in ("min", "max"):
+            if spec.get(bound) is not None and (isinstance(spec[bound], bool) or not isinstance(spec[bound], (int, float))):
+                raise ValueError(f"Invalid {bound} for parameter {param}.")
+        choices = spec.get("choices")
+        if choices is not None and (not isinstance(choices, list) or not all(isinstance(choice, str) for choice in choices)):
+            raise ValueError(f"Invalid choices for parameter {param}.")
+    if params and "{}" not in command:
+        raise ValueError("A command with a parameter must contain the {} placeholder.")
+
+    timeout = data.get("timeout")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not 0 < timeout <= MAX_TIMEOUT):
+        raise ValueError(f"The timeout must be between 0 and {MAX_TIMEOUT} seconds.")
+    idempotent = data.get("idempotent", False)
+    if not isinstance(idempotent, bool):
+        raise ValueError("idempotent must be true or false.")
+
+    return {
+        "label": label, "permission": permission, "command": command,
+        "params": json.dumps(params), "timeout": timeout, "idempotent": idempotent,
+    }
+
+
+def build_registry(rows):
+    """
+    Builds the read-only {name: Action} map from the built-in actions and the rows of the
+    actions table. Rows that don't validate (e.g. edited by hand) are skipped with a warning.
+    """
+    registry = {action.name: action for action in BUILTIN_ACTIONS}
+    for row in rows:
+        try:
+            fields = validate_definition(row["name"], {
+                "label": row["label"], "permission": row["permission"], "command": row["command"],
+                "params": json.loads(row["params"] or "{}"), "timeout": row["timeout"],
+                "idempotent": bool(row["idempotent"]),
+            })
+        except ValueError as e:
+            print(f"Warning: Skipping stored action '{row['name']}': {e}")
+            continue
+        registry[row["name"]] = Action(
+            row["name"], fields["label"], fields["permission"], command=fields["command"],
+            params=json.loads(fields["params"]), timeout=fields["timeout"],
+            idempotent=fields["idempotent"], builtin=False
+        )
+    return MappingProxyType(registry)
@@ -2,18 +2,53 @@ import platform
 from dotenv import load_dotenv
 import os
 import sqlite3
-from flask import Flask, request, jsonify, make_response, render_template, send_from_directory, redirect, url_for
+from flask import Flask, request, jsonify, make_response, render_template, send_from_directory, redirect, url_for, Response, g
 from flask_cors import CORS
 import jwt
 import datetime
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 import json
+import hmac
+import ipaddress
+import math
+import threading
+import time
+import atexit
+from types import MappingProxyType
+
+from event_stream import StreamSlots, stream_state, stream_state_async, request_budget, ASYNC_BODY_KEY, STREAM_MAX_LIFETIME, STREAM_MAX_CONNECTIONS
+from shared_metrics import default_region_path
+from shared_versions import SharedVersions
+from worker_counters import WorkerCounters
+from db_pool import ConnectionPool, DatabaseBusy, DB_STATS
+from query_cache import QueryCache
+import migrations
+from action_registry import build_registry, validate_definition, ACTION_NAME
+from fleet import FleetAggregator, parse_node_url, FLEET_BROADCAST_CONCURRENCY
+from static_assets import StaticAssets
+from fleet_push import PushAgent, PushCollector, IDLE_TIMEOUT as FLEET_PUSH_STALE_SECONDS
+from job_engine import JobEngine, JobStore, JobQueueFull, FINAL_STATUSES
+from permissions import (
+    ALL_PERMISSIONS, ADMIN_PERMISSION, ADMIN_FILTER,
+    has_permission, permissions_to_mask, mask_to_permissions
+)
 
 supported_system = False
 sys_actions = None
+metrics_sampler = None
 if platform.system() == "Linux":
     from system_actions import linux_actions as sys_actions
+    from system_actions import linux_metrics
+    from shared_metrics import SharedMetrics
+    from shared_state import SharedState
+    from system_actions.media_monitor import MediaMonitor
+    from metrics_history import MetricsHistory, HISTORY_COLUMNS, MAX_BUCKETS
+    from metrics_archive import MetricsArchive
+    from metrics_sampler import MetricsSampler, PROCESS_TOP_LIMIT, PROCESS_SCAN_INTERVAL
+    from http_metrics import HTTPMetrics, UNMATCHED_ROUTE
+    import prometheus_exporter
+    metrics_sampler = MetricsSampler()
     print("Running on Linux. Using linux_actions.")
     supported_system = True
 else:
@@ -31,101 +66,323 @@ app = Flask(
 
 CORS(app)
 
+# CSS/JS of the frontend, hashed and precompressed once; templates link them with asset_url()
+static_assets = StaticAssets(frontend_path)
+app.jinja_env.globals['asset_url'] = static_assets.url
+
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
+# Open live-update streams allowed across all workers; asgi.py raises it for the async mode
+app.config['STREAM_MAX_CONNECTIONS'] = STREAM_MAX_CONNECTIONS
+
+# Prometheus scraping: a static bearer token and/or a comma-separated list of allowed networks
+metrics_scrape_token = os.getenv("METRICS_SCRAPE_TOKEN")
+metrics_allowed_networks = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("METRICS_ALLOWED_NETWORKS", "").split(",") if network.strip()
+]
+
+# Fleet: FLEET_MODE=aggregator serves a view of the registered nodes; FLEET_TOKEN (a shared
+# secret) lets an aggregator query this instance as a node.
+# Push mode: FLEET_COLLECTOR=host:port makes this node push its status to an aggregator
+# listening on FLEET_COLLECTOR_PORT, as FLEET_NODE_NAME (its name in the aggregator's registry).
+fleet_mode = os.getenv("FLEET_MODE", "").strip().lower()
+fleet_token = os.getenv("FLEET_TOKEN")
+fleet_collector_address = os.getenv("FLEET_COLLECTOR")
+fleet_collector_port = int(os.getenv("FLEET_COLLECTOR_PORT", "0"))
+fleet_node_name = os.getenv("FLEET_NODE_NAME") or platform.node().split('.')[0].lower()
+FLEET_PUSH_STATE_BYTES = 4 * 1024 * 1024
 
 default_admin_username = os.getenv("DEFAULT_USERNAME")
 default_admin_password = os.getenv("DEFAULT_PASSWORD")
 database_filename = os.getenv("DATABASE_FILENAME", 'syspilot.db')
+metrics_archive_filename = os.getenv("METRICS_ARCHIVE_FILENAME", 'syspilot_metrics.db')
 
 # --- DATABASE CONFIGURATION ---
 DATABASE = os.path.join(os.path.dirname(__file__), database_filename)
+# Metrics live in their own file so archiving never contends with authentication lookups
+METRICS_ARCHIVE_DATABASE = os.path.join(os.path.dirname(__file__), metrics_archive_filename)
+
+# Version counters shared by all workers; bumping one invalidates the matching in-process caches
+shared_versions = SharedVersions(
+    os.getenv("SHARED_VERSIONS_PATH") or default_region_path(DATABASE) + ".versions",
+    ("permissions", "commands", "actions", "nodes")
+)
+shared_versions.attach()
+
+# Per-worker pool of WAL connections; its contention counters are summed over all workers
+db_counters = WorkerCounters(default_region_path(DATABASE) + ".db", len(DB_STATS), b"SPD1")
+db_counters.attach()
+db = ConnectionPool(DATABASE, counters=db_counters)
+
+def seed_defaults(conn, previous_defaults):
+    """
+    Creates the default administrator if there are no users and merges the default commands:
+    missing commands are added and a command still equal to its previous default follows the
+    new default, while commands customized by the user are kept.
+    """
+    if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+        print("No users found. Creating default administrator user...")
+        username_to_create = default_admin_username if default_admin_username else "admin"
+        password_to_create = default_admin_password if default_admin_password else "admin123" 
+
+        hashed_password = generate_password_hash(password_to_create)
+        conn.execute(
+            "INSERT INTO users (username, password_hash, permission_mask) VALUES (?, ?, ?)",
+            (username_to_create, hashed_password, ALL_PERMISSIONS) # El administrador tiene todos los permisos
+        )
+        print(f"Default administrator user '{username_to_create}' created with default password.")
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    if not (supported_system and sys_actions and hasattr(sys_actions, 'DEFAULT_COMMANDS')):
+        print("Cannot populate default commands: sys_actions.DEFAULT_COMMANDS not found or system not supported.")
+        return
+
+    previous_commands = json.loads(previous_defaults) if previous_defaults else {}
+    merged = migrations.merge_commands(conn, sys_actions.DEFAULT_COMMANDS, previous_commands)
+    print(f"Default commands merged ({merged} added or updated, customized commands kept).")
 
 def init_db():
     """
-    Initializes the database, creates the users and commands tables if they don't exist,
-    and populates them with default values if empty.
-    """
-    with app.app_context():
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                permissions TEXT NOT NULL
-            )
-        ''')
-        conn.commit()
-
-        # Create commands table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS commands (
-                command_key TEXT PRIMARY KEY NOT NULL,
-                command_value TEXT NOT NULL
-            )
-        ''')
-        conn.commit()
-
-        # Populate default admin user if none exists
-        cursor.execute("SELECT COUNT(*) FROM users")
-        if cursor.fetchone()[0] == 0:
-            print("No users found. Creating default administrator user...")
-            username_to_create = default_admin_username if default_admin_username else "admin"
-            password_to_create = default_admin_password if default_admin_password else "admin123" 
-
-            hashed_password = generate_password_hash(password_to_create)
-            # MODIFICACIÓN: Añadir nuevas permisos por defecto
-            default_permissions = {
-                "shutdown": True, "restart": True, "lock": True,
-                "play_pause": True, "media_next": True, "media_previous": True,
-                "volume": True, "volume_mute": True, "system_metrics": True,
-                "modify_commands": True, "manage_users": True
-            }
-            permissions_json = json.dumps(default_permissions)
-
-            try:
-                cursor.execute(
-                    "INSERT INTO users (username, password_hash, permissions) VALUES (?, ?, ?)",
-                    (username_to_create, hashed_password, permissions_json)
-                )
-                conn.commit()
-                print(f"Default administrator user '{username_to_create}' created with default password.")
-            except sqlite3.IntegrityError:
-                print(f"The user '{username_to_create}' already exists.")
-        
-        # MODIFICACIÓN CLAVE: Eliminar todos los comandos existentes y volver a insertar los valores predeterminados
-        if supported_system and sys_actions and hasattr(sys_actions, 'DEFAULT_COMMANDS'):
-            print("Resetting and ensuring all default commands are present in the database...")
-            try:
-                cursor.execute("DELETE FROM commands") # Eliminar todos los comandos existentes
-                for key, value in sys_actions.DEFAULT_COMMANDS.items():
-                    cursor.execute(
-                        "INSERT INTO commands (command_key, command_value) VALUES (?, ?)",
-                        (key, value)
-                    )
-                conn.commit()
-                print("Default commands reset and populated successfully.")
-            except Exception as e:
-                conn.rollback() # Rollback en caso de error
-                print(f"Error resetting or populating default commands: {e}")
-        else:
-            print("Cannot populate default commands: sys_actions.DEFAULT_COMMANDS not found or system not supported.")
-        conn.close()
+    Applies the pending schema migrations and seeds the defaults, once per deployment.
+    On an up-to-date database this is a single read of the schema version.
+    """
+    if supported_system and sys_actions and hasattr(sys_actions, 'DEFAULT_COMMANDS'):
+        defaults = json.dumps(sys_actions.DEFAULT_COMMANDS, sort_keys=True)
+    else:
+        defaults = "{}"
+    with db.connection() as conn:
+        upgraded = migrations.upgrade(conn, DATABASE + ".migrate.lock", defaults, seed_defaults)
+    if upgraded:
+        # Workers that were already running must drop their cached users, commands and actions
+        shared_versions.bump('permissions')
+        shared_versions.bump('commands')
+        shared_versions.bump('actions')
+        shared_versions.bump('nodes')
+
+# --- ACTION JOBS ---
+# System actions run as jobs on a bounded executor; their records are shared by all workers
+job_engine = None
+if supported_system:
+    job_engine = JobEngine(JobStore(default_region_path(DATABASE) + ".jobs"))
+
+# --- QUERY COMMAND RESULTS ---
+# Results of the read-only get_* commands, shared by concurrent callers for a per-command TTL
+query_cache = None
+if sys_actions and hasattr(sys_actions, 'QUERY_COMMAND_TTLS'):
+    query_cache_counters = WorkerCounters(default_region_path(DATABASE) + ".queries", 2 * len(sys_actions.QUERY_COMMAND_TTLS), b"SPQ1")
+    query_cache_counters.attach()
+    query_cache = QueryCache(sys_actions.QUERY_COMMAND_TTLS, counters=query_cache_counters)
 
 # Ensure the database is initialized when the application starts
 with app.app_context():
     init_db()
 
+# --- METRICS CONFIGURATION ---
+# Only one process (the elected leader among the gunicorn workers) samples /proc.
+# It publishes every sample into a shared memory region that all workers read lock-free.
+shared_metrics = None
+media_state = None
+fleet_push_state = None
+metrics_history = None
+metrics_archive = None
+stream_slots = None
+METRICS_HISTORY_SECONDS = int(os.getenv("METRICS_HISTORY_SECONDS", "86400"))
+DEFAULT_HISTORY_POINTS = 300
+
+if metrics_sampler is not None:
+    metrics_region_path = os.getenv("METRICS_SHM_PATH") or default_region_path(DATABASE)
+    shared_metrics = SharedMetrics(metrics_region_path)
+    shared_metrics.attach()
+    metrics_sampler.add_listener(shared_metrics.write)
+    metrics_sampler.process_demand = lambda: shared_metrics.last_demand('processes')
+
+    # Recent samples for the history graphs, one typed column per metric
+    metrics_history = MetricsHistory(metrics_region_path + ".history", int(METRICS_HISTORY_SECONDS / metrics_sampler.interval))
+    metrics_history.attach()
+    metrics_sampler.add_listener(metrics_history.append)
+
+    # Long-term archive with 1-minute and 1-hour rollups, written only by the leader
+    metrics_archive = MetricsArchive(METRICS_ARCHIVE_DATABASE, HISTORY_COLUMNS)
+    metrics_sampler.add_listener(metrics_archive.enqueue)
+
+    # Audio and media state, kept current by the leader's pactl/playerctl subscribers.
+    # read_volume_state is defined further down; the lambda resolves it when first called.
+    media_state = SharedState(metrics_region_path + ".media")
+    media_state.attach()
+    media_monitor = MediaMonitor(
+        lambda: read_volume_state(), media_state.publish,
+        config_version=lambda: shared_versions.get('commands')
+    )
+
+    # Fleet push, also run by the leader: the collector keeps the latest state pushed by each
+    # node and publishes it for the workers; the agent pushes this node's status (node_status
+    # and push_token_valid are defined further down)
+    fleet_collector = None
+    if fleet_mode == 'aggregator' and fleet_collector_port:
+        fleet_push_state = SharedState(metrics_region_path + ".fleet", capacity=FLEET_PUSH_STATE_BYTES)
+        fleet_push_state.attach()
+        fleet_collector = PushCollector(
+            fleet_collector_port, lambda name, token: push_token_valid(name, token), fleet_push_state.publish
+        )
+    fleet_agent = None
+    if fleet_collector_address:
+        if not fleet_token or not ACTION_NAME.fullmatch(fleet_node_name):
+            print("Warning: FLEET_COLLECTOR needs FLEET_TOKEN and a valid FLEET_NODE_NAME (lowercase letters, digits, underscores). Not pushing.")
+        else:
+            fleet_agent = PushAgent(
+                fleet_collector_address, fleet_node_name, fleet_token, lambda: node_status(), metrics_sampler.interval
+            )
+
+    def on_metrics_leader_elected():
+        metrics_history.take_over()
+        metrics_archive.start_writer()
+        metrics_sampler.start()
+        media_monitor.start()
+        atexit.register(media_monitor.stop)
+        if fleet_collector:
+            fleet_collector.start()
+        if fleet_agent:
+            fleet_agent.start()
+            atexit.register(fleet_agent.stop)
+
+    shared_metrics.start_leader_election(on_metrics_leader_elected)
+
+    # Live dashboard streams are capped across all workers so they can't take every worker
+    stream_slots = StreamSlots(metrics_region_path + ".streams")
+    stream_slots.attach()
+
+def read_latest_metrics():
+    """Returns the latest sample published by the leader, with the formatted uptime."""
+    sample = shared_metrics.read() if shared_metrics else {}
+    if sample:
+        sample['uptime'] = linux_metrics.format_uptime(sample.get('uptime_seconds'))
+    return sample
+
+# Metric -> (command key, parser name). A command stored in the DB that differs from the
+# default opts that metric back into the legacy shell pipeline instead of the native sampler.
+METRIC_COMMANDS = {
+    'cpu_usage': ('get_cpu_usage_cmd', 'get_cpu_usage'),
+    'ram_usage': ('get_ram_usage_cmd', 'get_ram_usage'),
+    'uptime': ('get_uptime_cmd', 'get_uptime'),
+}
+
+def get_custom_metric_commands():
+    """Returns {metric: command} for the metric commands customized by the user."""
+    stored_commands = get_command_map()
+    custom_commands = {}
+    for metric, (command_key, _) in METRIC_COMMANDS.items():
+        command_value = stored_commands.get(command_key)
+        if command_value and command_value != sys_actions.DEFAULT_COMMANDS.get(command_key):
+            custom_commands[metric] = command_value
+    return custom_commands
+
+# --- PERMISSIONS CACHE ---
+# username -> permission mask (None for unknown users), valid as long as the shared
+# 'permissions' version hasn't changed since the cache was filled
+permission_cache = {}
+permission_cache_version = None
+permission_cache_lock = threading.Lock()
+
+def get_permission_mask(username):
+    """Returns the user's permission mask from the cache, querying the DB only on a miss."""
+    global permission_cache, permission_cache_version
+    # Read the version before querying, so a change committed meanwhile invalidates what we store
+    version = shared_versions.get('permissions')
+    with permission_cache_lock:
+        if version != permission_cache_version:
+            permission_cache = {}
+            permission_cache_version = version
+        if username in permission_cache:
+            return permission_cache[username]
+
+    row = db.query("SELECT permission_mask FROM users WHERE username = ?", (username,), one=True)
+    mask = row['permission_mask'] if row else None
+
+    with permission_cache_lock:
+        if permission_cache_version == version:
+            permission_cache[username] = mask
+    return mask
+
+def invalidate_permissions():
+    """Tells every worker that users or permissions changed. Call after the commit."""
+    shared_versions.bump('permissions')
+
+# --- COMMANDS CACHE ---
+# (version, read-only {command_key: command_value}) of the commands table. Readers take the
+# tuple in one reference read; a reload builds a new map and swaps the reference.
+command_map_state = (None, MappingProxyType({}))
+
+def get_command_map():
+    """Returns the stored commands as an immutable map, reloading it only when the version changed."""
+    global command_map_state
+    version = shared_versions.get('commands') # Read before the SELECT, like the permissions cache
+    cached_version, command_map = command_map_state
+    if cached_version == version:
+        return command_map
+    rows = db.query("SELECT command_key, command_value FROM commands")
+    command_map = MappingProxyType({row['command_key']: row['command_value'] for row in rows})
+    if sys_actions and hasattr(sys_actions, 'compile_command'):
+        for command_value in command_map.values():
+            sys_actions.compile_command(command_value) # Parse the templates once, at load time
+    if query_cache is not None:
+        # Results of commands edited in any worker must not be served anymore
+        query_cache.retain(lambda key, command: command_map.get(key, sys_actions.DEFAULT_COMMANDS.get(key)) == command)
+    command_map_state = (version, command_map)
+    return command_map
+
+def get_command(command_key):
+    """The command stored for `command_key`, or the system default if there is none."""
+    command_map = get_command_map()
+    if command_key in command_map:
+        return command_map[command_key]
+    return sys_actions.DEFAULT_COMMANDS.get(command_key)
+
+def run_query_command(command_key):
+    """Runs a read-only get_* command, sharing its result through the query cache."""
+    command = get_command(command_key)
+    execute = lambda: sys_actions.execute_shell_command(command, command_key)
+    if query_cache is None:
+        return execute()
+    return query_cache.get(command_key, command, execute)
+
+def invalidate_commands():
+    """Tells every worker that the commands table changed and reloads it here. Call after the commit."""
+    shared_versions.bump('commands')
+    get_command_map()
+
+# --- ACTION REGISTRY ---
+# (version, read-only {name: Action}): the built-in actions plus the user-defined ones,
+# rebuilt only when the shared 'actions' version changes
+action_registry_state = (None, MappingProxyType({}))
+
+def get_action_registry():
+    """Returns the action registry, reloading the user-defined actions only when the version changed."""
+    global action_registry_state
+    version = shared_versions.get('actions')
+    cached_version, registry = action_registry_state
+    if cached_version == version:
+        return registry
+    rows = db.query("SELECT name, label, permission, command, params, timeout, idempotent FROM actions")
+    registry = build_registry(rows)
+    if sys_actions and hasattr(sys_actions, 'compile_command'):
+        for action in registry.values():
+            if action.command:
+                sys_actions.compile_command(action.command)
+    action_registry_state = (version, registry)
+    return registry
+
+def invalidate_actions():
+    """Tells every worker that the actions table changed and reloads it here. Call after the commit."""
+    shared_versions.bump('actions')
+    get_action_registry()
+
+def issue_token(username, permission_mask):
+    """Signs a session token carrying the user's permission mask."""
+    return jwt.encode({
+        'user': username,
+        'perm': permission_mask,
+        'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    }, app.config['SECRET_KEY'], algorithm="HS256")
+
 def force_relogin_response():
     if request.accept_mimetypes.accept_html or not request.path.startswith('/api/'):
         response = redirect(url_for('index'))
@@ -142,7 +399,8 @@ def force_relogin_response():
 def token_required(f):
     """
     Decorator to protect routes, verifying the JWT token in cookies.
-    Also checks token permissions against the database on each request.
+    Also checks token permissions against the latest ones on each request (served from
+    the permissions cache, so steady-state requests don't touch the database).
     If permissions are inconsistent, a new token is issued and a message is returned.
     If the token is invalid/expired or user not found, it forces a re-login.
     """
@@ -158,34 +416,26 @@ def token_required(f):
             # Decodificar el token para obtener el usuario y los permisos incrustados
             token_data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
             username_from_token = token_data['user']
-            permissions_from_token = token_data.get('permissions', {})
+            if 'perm' in token_data:
+                mask_from_token = token_data['perm']
+            else:
+                # Tokens emitidos antes de las máscaras llevan el dict de permisos completo
+                mask_from_token = permissions_to_mask(token_data.get('permissions', {}))
 
-            # Obtener los últimos permisos del usuario de la base de datos
-            conn = get_db_connection()
-            db_user_row = conn.execute("SELECT permissions FROM users WHERE username = ?", (username_from_token,)).fetchone()
-            conn.close()
+            # Obtener la máscara de permisos actual del usuario (caché invalidada por versión)
+            db_mask = get_permission_mask(username_from_token)
 
             # Si el usuario no se encuentra en la base de datos, el token es inválido (aunque decodifique)
-            if not db_user_row:
+            if db_mask is None:
                 print(f"User '{username_from_token}' not found in DB. Forcing re-login.")
                 return force_relogin_response()
-            
-            db_permissions = json.loads(db_user_row['permissions'])
-
-            # Comparar permisos: convertir a lista ordenada de pares (clave, valor) para comparación fiable
-            sorted_token_perms = sorted(permissions_from_token.items())
-            sorted_db_perms = sorted(db_permissions.items())
 
             # Si los permisos son inconsistentes (cambiaron en la DB)
-            if sorted_token_perms != sorted_db_perms:
+            if mask_from_token != db_mask:
                 print(f"Permissions for user '{username_from_token}' inconsistent with DB. Issuing new token.")
                 
                 # Emitir un nuevo token con los permisos actualizados de la DB
-                new_token = jwt.encode({
-                    'user': username_from_token,
-                    'permissions': db_permissions, # Usa los permisos actualizados de la DB
-                    'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
-                }, app.config['SECRET_KEY'], algorithm="HS256")
+                new_token = issue_token(username_from_token, db_mask)
 
                 # Crear una respuesta que establezca la nueva cookie y contenga un mensaje para el frontend
                 response_on_permission_change = make_response(jsonify({
@@ -198,8 +448,8 @@ def token_required(f):
                 # La función decorada no se ejecuta, el controlador de ruta que la llamó debe manejar esto
                 return response_on_permission_change
             
-            # Si todas las comprobaciones pasan, pasar los ÚLTIMOS permisos de la DB a la función
-            return f(username_from_token, db_permissions, *args, **kwargs)
+            # Si todas las comprobaciones pasan, pasar la ÚLTIMA máscara de permisos a la función
+            return f(username_from_token, db_mask, *args, **kwargs)
 
         except jwt.ExpiredSignatureError:
             print("Token expired. Forcing re-login.")
@@ -207,6 +457,8 @@ def token_required(f):
         except jwt.InvalidTokenError:
             print("Invalid token. Forcing re-login.")
             return force_relogin_response()
+        except DatabaseBusy:
+            raise # Not a session problem: answered with 503 by the error handler
         except Exception as e:
             # Capturar cualquier otro error inesperado durante la validación del token o la búsqueda en la DB
             print(f"An unexpected error occurred during token validation: {str(e)}")
@@ -214,6 +466,13 @@ def token_required(f):
     return decorated
 
 # --- HTML ROUTES ---
+def render_page(template):
+    """Renders an HTML entry point with an ETag, so a revisit with unchanged assets is a 304."""
+    response = make_response(render_template(template))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
 @app.route('/')
 def index():
     token = request.cookies.get('syspilot_token')
@@ -224,7 +483,7 @@ def index():
         except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
             pass
 
-    return render_template('index.html')
+    return render_page('index.html')
 
 @app.route('/index.html')
 @app.route('/dashboard.html')
@@ -244,7 +503,7 @@ def redirect_to_root_or_dashboard():
 @token_required
 def dashboard(current_user, current_permissions):
     """Renders the dashboard if the user is authenticated."""
-    return render_template('dashboard.html')
+    return render_page('dashboard.html')
 
 # --- API ROUTES ---
 @app.route('/api/login', methods=['POST'])
@@ -254,18 +513,10 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    conn = get_db_connection()
-    user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
-    conn.close()
+    user = db.query("SELECT * FROM users WHERE username = ?", (username,), one=True)
 
     if user and check_password_hash(user['password_hash'], password):
-        permissions = json.loads(user['permissions'])
-
-        token = jwt.encode({
-            'user': username,
-            'permissions': permissions,
-            'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
-        }, app.config['SECRET_KEY'], algorithm="HS256")
+        token = issue_token(username, user['permission_mask'])
 
         response = make_response(jsonify({'success': True, 'message': 'Login successful'}))
         response.set_cookie('syspilot_token', token, httponly=True, samesite='Lax')
@@ -291,41 +542,48 @@ def get_dashboard_data(current_user, current_permissions):
     cpu_usage = None
     ram_usage = None
     uptime = None
-
-    if supported_system and current_permissions.get('system_metrics', False):
-        conn = get_db_connection()
-        get_cpu_cmd_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'get_cpu_usage_cmd'").fetchone()
-        get_ram_cmd_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'get_ram_usage_cmd'").fetchone()
-        get_uptime_cmd_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'get_uptime_cmd'").fetchone()
-        conn.close()
-
-        cpu_cmd = get_cpu_cmd_row['command_value'] if get_cpu_cmd_row else sys_actions.DEFAULT_COMMANDS.get('get_cpu_usage_cmd')
-        ram_cmd = get_ram_cmd_row['command_value'] if get_ram_cmd_row else sys_actions.DEFAULT_COMMANDS.get('get_ram_usage_cmd')
-        uptime_cmd = get_uptime_cmd_row['command_value'] if get_uptime_cmd_row else sys_actions.DEFAULT_COMMANDS.get('get_uptime_cmd')
-
-        if cpu_cmd and sys_actions and hasattr(sys_actions, 'execute_shell_command') and hasattr(sys_actions, 'get_cpu_usage'):
-            cpu_result = sys_actions.execute_shell_command(cpu_cmd, 'get_cpu_usage_cmd')
-            if cpu_result["success"]:
-                cpu_usage = sys_actions.get_cpu_usage(cpu_result["message"])
-        
-        if ram_cmd and sys_actions and hasattr(sys_actions, 'execute_shell_command') and hasattr(sys_actions, 'get_ram_usage'):
-            ram_result = sys_actions.execute_shell_command(ram_cmd, 'get_ram_usage_cmd')
-            if ram_result["success"]:
-                ram_usage = sys_actions.get_ram_usage(ram_result["message"])
-
-        if uptime_cmd and sys_actions and hasattr(sys_actions, 'execute_shell_command') and hasattr(sys_actions, 'get_uptime'):
-            uptime_result = sys_actions.execute_shell_command(uptime_cmd, 'get_uptime_cmd')
-            if uptime_result["success"]:
-                uptime = sys_actions.get_uptime(uptime_result["message"])
-
+    disk_io = None
+    network_io = None
+
+    if supported_system and has_permission(current_permissions, 'system_metrics'):
+        sample = read_latest_metrics()
+        details = shared_metrics.read_details()
+        disk_io = {
+            'read_bytes_per_sec': sample.get('disk_read_bps'),
+            'write_bytes_per_sec': sample.get('disk_write_bps'),
+            'devices': details.get('disks', {})
+        }
+        network_io = {
+            'rx_bytes_per_sec': sample.get('net_rx_bps'),
+            'tx_bytes_per_sec': sample.get('net_tx_bps'),
+            'interfaces': details.get('network', {})
+        }
+        metrics = {
+            'cpu_usage': sample.get('cpu_usage'),
+            'ram_usage': sample.get('ram_usage'),
+            'uptime': sample.get('uptime'),
+        }
+
+        # Opt-in fallback: user-customized metric commands still run through the shell
+        for metric in get_custom_metric_commands():
+            command_key, parser_name = METRIC_COMMANDS[metric]
+            result = run_query_command(command_key)
+            metrics[metric] = getattr(sys_actions, parser_name)(result["message"]) if result["success"] else None
+
+        cpu_usage = metrics['cpu_usage']
+        ram_usage = metrics['ram_usage']
+        uptime = metrics['uptime']
 
     data = {
         'cpu_usage': cpu_usage if cpu_usage is not None else '--',
         'ram_usage': ram_usage if ram_usage is not None else '--',
         'uptime': uptime if uptime is not None else '--',
+        'disk_io': disk_io,
+        'network_io': network_io,
         'user': current_user,
-        'permissions': current_permissions, # This will be the fresh DB permissions
-        'os_type': platform.system()
+        'permissions': mask_to_permissions(current_permissions), # This will be the fresh DB permissions
+        'os_type': platform.system(),
+        'fleet_enabled': fleet_aggregator is not None
     }
     # For HTML routes, if the token was updated, the redirect handles the new cookie.
     # For API routes, the token_required decorator handles setting the new cookie directly
@@ -340,7 +598,7 @@ def register_user(current_user, current_permissions):
     """
     Registers a new user. Accessible only by users with 'manage_users' permission.
     """
-    if not current_permissions.get('manage_users', False):
+    if not has_permission(current_permissions, 'manage_users'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
 
     data = request.get_json()
@@ -353,30 +611,17 @@ def register_user(current_user, current_permissions):
 
     hashed_password = generate_password_hash(password)
     
-    valid_permissions = {
-        "shutdown": False, "restart": False, "lock": False,
-        "play_pause": False, "media_next": False, "media_previous": False,
-        "volume": False, "volume_mute": False, "system_metrics": False,
-        "modify_commands": False, "manage_users": False
-    }
-    for perm_key, perm_value in permissions_data.items():
-        if perm_key in valid_permissions and isinstance(perm_value, bool):
-            valid_permissions[perm_key] = perm_value
-    
-    permissions_json = json.dumps(valid_permissions)
+    permission_mask = permissions_to_mask(permissions_data)
 
-    conn = get_db_connection()
     try:
-        conn.execute(
-            "INSERT INTO users (username, password_hash, permissions) VALUES (?, ?, ?)",
-            (username, hashed_password, permissions_json)
+        db.execute(
+            "INSERT INTO users (username, password_hash, permission_mask) VALUES (?, ?, ?)",
+            (username, hashed_password, permission_mask)
         )
-        conn.commit()
+        invalidate_permissions()
         return jsonify({'success': True, 'message': f'User {username} registered successfully'}), 201
     except sqlite3.IntegrityError:
         return jsonify({'success': False, 'message': 'Username already exists'}), 409
-    finally:
-        conn.close()
 
 @app.route('/api/users', methods=['GET'])
 @token_required
@@ -384,19 +629,18 @@ def get_users(current_user, current_permissions):
     """
     Gets the list of users. Accessible only by users with 'manage_users' permission.
     """
-    if not current_permissions.get('manage_users', False):
+    if not has_permission(current_permissions, 'manage_users'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
     
-    conn = get_db_connection()
-    users = conn.execute("SELECT id, username, permissions FROM users").fetchall()
-    conn.close()
+    users = db.query("SELECT id, username, permission_mask FROM users")
 
     users_list = []
     for user in users:
-        user_data = dict(user)
-        user_data['permissions'] = json.loads(user_data['permissions'])
-        user_data.pop('password_hash', None)
-        users_list.append(user_data)
+        users_list.append({
+            'id': user['id'],
+            'username': user['username'],
+            'permissions': mask_to_permissions(user['permission_mask'])
+        })
     
     return jsonify({'success': True, 'users': users_list})
 
@@ -408,36 +652,27 @@ def update_user_permissions(current_user_username, current_permissions, user_id)
     Updates permissions for a specific user. Accessible only by users with 'manage_users' permission.
     If the current user's permissions are updated, a new token is re-issued.
     """
-    if not current_permissions.get('manage_users', False):
+    if not has_permission(current_permissions, 'manage_users'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
 
     data = request.get_json()
     new_permissions_data = data.get('permissions', {})
 
-    conn = get_db_connection()
     # Fetch user_to_update's details, including their username, from DB
-    user_to_update = conn.execute("SELECT id, username, permissions FROM users WHERE id = ?", (user_id,)).fetchone()
+    user_to_update = db.query("SELECT id, username, permission_mask FROM users WHERE id = ?", (user_id,), one=True)
 
     if not user_to_update:
-        conn.close()
         return jsonify({'success': False, 'message': 'User not found'}), 404
 
-    current_user_permissions_db = json.loads(user_to_update['permissions']) # Permissions of the user being updated
-
-    updated_permissions = current_user_permissions_db.copy()
-    for perm_key, perm_value in new_permissions_data.items():
-        if perm_key in updated_permissions and isinstance(perm_value, bool):
-            updated_permissions[perm_key] = perm_value
-    
-    permissions_json = json.dumps(updated_permissions)
+    # Only the permissions present in the request change; the others keep their current bit
+    updated_mask = permissions_to_mask(new_permissions_data, user_to_update['permission_mask'])
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE users SET permissions = ? WHERE id = ?",
-            (permissions_json, user_id)
+        db.execute(
+            "UPDATE users SET permission_mask = ? WHERE id = ?",
+            (updated_mask, user_id)
         )
-        conn.commit()
+        invalidate_permissions()
 
         response = make_response(jsonify({'success': True, 'message': f'Permissions for user {user_to_update["username"]} updated successfully'}))
 
@@ -445,21 +680,14 @@ def update_user_permissions(current_user_username, current_permissions, user_id)
         if user_to_update['username'] == current_user_username:
             print(f"Updating token for current user: {current_user_username}")
             # Re-issue JWT token with new permissions
-            new_token = jwt.encode({
-                'user': current_user_username,
-                'permissions': updated_permissions, # Use the newly updated permissions
-                'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
-            }, app.config['SECRET_KEY'], algorithm="HS256")
+            new_token = issue_token(current_user_username, updated_mask) # Use the newly updated permissions
             response.set_cookie('syspilot_token', new_token, httponly=True, samesite='Lax')
             response.json['message'] += " New token issued with updated permissions." # Add message for frontend
 
         return response # Return the response, potentially with a new cookie
 
     except Exception as e:
-        conn.rollback()
         return jsonify({'success': False, 'message': f'Error updating permissions: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/users/delete/<int:user_id>', methods=['DELETE'])
@@ -469,27 +697,23 @@ def delete_user(current_user, current_permissions, user_id):
     Deletes a user. Accessible only by users with 'manage_users' permission.
     Prevents deleting the current user if they are the last administrator.
     """
-    if not current_permissions.get('manage_users', False):
+    if not has_permission(current_permissions, 'manage_users'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
 
-    conn = get_db_connection()
-    
-    user_to_delete = conn.execute("SELECT username, permissions FROM users WHERE id = ?", (user_id,)).fetchone()
+    user_to_delete = db.query("SELECT username, permission_mask FROM users WHERE id = ?", (user_id,), one=True)
     if user_to_delete:
-        is_admin_to_delete = json.loads(user_to_delete['permissions']).get('manage_users', False)
+        is_admin_to_delete = has_permission(user_to_delete['permission_mask'], ADMIN_PERMISSION)
         
         if is_admin_to_delete:
-            admin_users = conn.execute("SELECT COUNT(*) FROM users WHERE json_extract(permissions, '$.manage_users') = 1").fetchone()[0]
+            admin_users = db.query(f"SELECT COUNT(*) FROM users WHERE {ADMIN_FILTER}", one=True)[0]
             if admin_users == 1 and user_to_delete['username'] == current_user:
-                conn.close()
                 return jsonify({'success': False, 'message': 'Cannot delete the last administrator user.'}), 400
 
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        cursor = db.execute("DELETE FROM users WHERE id = ?", (user_id,))
         if cursor.rowcount == 0:
             return jsonify({'success': False, 'message': 'User not found'}), 404
-        conn.commit()
+        invalidate_permissions()
         
         # If the user being deleted is the current user, log them out
         response = make_response(jsonify({'success': True, 'message': 'User deleted successfully'}))
@@ -499,10 +723,7 @@ def delete_user(current_user, current_permissions, user_id):
         return response
 
     except Exception as e:
-        conn.rollback()
         return jsonify({'success': False, 'message': f'Error deleting user: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 
 # --- Custom Commands API Routes ---
@@ -515,24 +736,20 @@ def get_commands(current_user, current_permissions):
     If running on Linux, falls back to defaults from linux_actions if no custom command exists.
     Accessible only by users with 'modify_commands' permission.
     """
-    if not current_permissions.get('modify_commands', False):
+    if not has_permission(current_permissions, 'modify_commands'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
     
     if not supported_system or platform.system() != "Linux":
         return jsonify({'success': False, 'message': 'Custom command management is only available on Linux.'}), 400
 
-    conn = get_db_connection()
-    db_commands = conn.execute("SELECT command_key, command_value FROM commands").fetchall()
-    conn.close()
-
-    custom_commands = {row['command_key']: row['command_value'] for row in db_commands}
+    custom_commands = get_command_map()
     
     final_commands = {}
     if sys_actions and hasattr(sys_actions, 'DEFAULT_COMMANDS'):
         final_commands.update(sys_actions.DEFAULT_COMMANDS)
         final_commands.update(custom_commands)
     else:
-        final_commands = custom_commands
+        final_commands = dict(custom_commands)
 
     return jsonify({'success': True, 'commands': final_commands})
 
@@ -544,7 +761,7 @@ def update_commands(current_user, current_permissions):
     Updates custom commands in the database.
     Accessible only by users with 'modify_commands' permission.
     """
-    if not current_permissions.get('modify_commands', False):
+    if not has_permission(current_permissions, 'modify_commands'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
 
     data = request.get_json()
@@ -553,20 +770,18 @@ def update_commands(current_user, current_permissions):
     if not isinstance(new_commands, dict):
         return jsonify({'success': False, 'message': 'Invalid data format for commands.'}), 400
 
-    conn = get_db_connection()
     try:
-        cursor = conn.cursor()
-        for key, value in new_commands.items():
-            cursor.execute(
-                "INSERT OR REPLACE INTO commands (command_key, command_value) VALUES (?, ?)",
-                (key, value)
-            )
-        conn.commit()
+        with db.transaction() as conn:
+            for key, value in new_commands.items():
+                db.execute(
+                    "INSERT OR REPLACE INTO commands (command_key, command_value) VALUES (?, ?)",
+                    (key, value),
+                    conn=conn
+                )
+        invalidate_commands()
         return jsonify({'success': True, 'message': 'Commands updated successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating commands: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 
 @app.route('/api/commands/reset', methods=['POST'])
@@ -576,260 +791,286 @@ def reset_commands(current_user, current_permissions):
     Resets all custom commands to their default values (from sys_actions.DEFAULT_COMMANDS).
     Accessible only by users with 'modify_commands' permission.
     """
-    if not current_permissions.get('modify_commands', False):
+    if not has_permission(current_permissions, 'modify_commands'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
 
     if not supported_system or platform.system() != "Linux":
         return jsonify({'success': False, 'message': 'Custom command management is only available on Linux.'}), 400
 
-    conn = get_db_connection()
+    if not sys_actions or not hasattr(sys_actions, 'DEFAULT_COMMANDS'):
+        return jsonify({'success': False, 'message': 'Default commands not found for this system type.'}), 500
+
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM commands")
-        
-        if sys_actions and hasattr(sys_actions, 'DEFAULT_COMMANDS'):
+        with db.transaction() as conn:
+            db.execute("DELETE FROM commands", conn=conn)
             for key, value in sys_actions.DEFAULT_COMMANDS.items():
-                cursor.execute(
+                db.execute(
                     "INSERT INTO commands (command_key, command_value) VALUES (?, ?)",
-                    (key, value)
+                    (key, value),
+                    conn=conn
                 )
-            conn.commit()
-            return jsonify({'success': True, 'message': 'Commands reset to defaults successfully'})
-        else:
-            conn.rollback()
-            return jsonify({'success': False, 'message': 'Default commands not found for this system type.'}), 500
+        invalidate_commands()
+        return jsonify({'success': True, 'message': 'Commands reset to defaults successfully'})
     except Exception as e:
-        conn.rollback()
         return jsonify({'success': False, 'message': f'Error resetting commands: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 
 # --- STATIC FILE ROUTES ---
-@app.route('/css/style.css')
-def serve_style_css():
-    """Serves the main CSS file."""
-    return send_from_directory(f'{frontend_path}/css', 'style.css')
-
-@app.route('/js/app.js')
-def serve_app_js():
-    """Serves the JS file for login."""
-    return send_from_directory(f'{frontend_path}/js', 'app.js')
-
-@app.route('/js/dashboard.js')
-def serve_dashboard_js():
-    """Serves the JS file for the dashboard."""
-    return send_from_directory(f'{frontend_path}/js', 'dashboard.js')
+def asset_response(asset, immutable):
+    """Serves an asset from memory, in the best encoding the client accepts."""
+    status, body, headers = static_assets.respond(
+        asset, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'), immutable
+    )
+    return Response(body, status=status, headers=headers)
 
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Content-hashed assets: public, and cached by browsers for a year."""
+    asset = static_assets.by_hashed_name.get(filename)
+    if asset is None:
+        return jsonify({'success': False, 'message': 'Asset not found'}), 404
+    return asset_response(asset, immutable=True)
 
 @app.route('/<path:filename>')
+def static_files(filename):
+    """Serves known assets (CSS, JS...) by their plain path without a session; other files need one."""
+    asset = static_assets.by_name.get(filename)
+    if asset is not None:
+        return asset_response(asset, immutable=False)
+    return protected_static_file(filename)
+
 @token_required
-def static_files(current_user, current_permissions, filename):
-    """Serves general static files protected by authentication."""
+def protected_static_file(current_user, current_permissions, filename):
     return send_from_directory(frontend_path, filename)
 
 # --- API Endpoints for System Actions (MODIFIED to use custom commands) ---
-@app.route('/api/action/shutdown', methods=['POST'])
-@token_required
-def api_shutdown(current_user, current_permissions):
-    if not current_permissions.get('shutdown', False):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-
-    if not supported_system:
-        return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
-    
-    conn = get_db_connection()
-    command_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'shutdown_cmd'").fetchone()
-    conn.close()
-    
-    command_to_execute = command_row['command_value'] if command_row else sys_actions.DEFAULT_COMMANDS.get('shutdown_cmd')
-
-    if not command_to_execute:
-        return jsonify({"success": False, "message": "Shutdown command not defined."}), 500
+def queue_action(current_user, action, command_to_execute, value=None):
+    """
+    Submits the command of `action` as a job and returns its record (raises JobQueueFull).
+    Coalescing actions are latest-wins: a burst of submissions runs the command only once
+    more, with the newest value.
+    """
+    def run(on_spawn):
+        return sys_actions.execute_shell_command(
+            command_to_execute, action.job_name, level_placeholder=value, timeout=action.timeout, on_spawn=on_spawn
+        )
 
-    result = sys_actions.execute_shell_command(command_to_execute, 'shutdown_cmd')
-    status_code = 200 if result["success"] else 500
-    return jsonify(result), status_code
+    def run_latest(latest_value, latest, on_spawn):
+        # The newest submission's command and timeout, not the ones of the submitter that started the drainer
+        return sys_actions.execute_shell_command(
+            latest['command'], action.job_name, level_placeholder=latest_value, timeout=latest['timeout'], on_spawn=on_spawn
+        )
 
-@app.route('/api/action/restart', methods=['POST'])
-@token_required
-def api_restart(current_user, current_permissions):
-    if not current_permissions.get('restart', False):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    if action.coalesce:
+        return job_engine.submit_latest(
+            action.job_name, value, run_latest, current_user, {'command': command_to_execute, 'timeout': action.timeout}
+        )
+    return job_engine.submit(action.job_name, run, current_user)
 
-    if not supported_system:
-        return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
+def action_command(action):
+    """The command an action runs: its own, or the one stored for its command key."""
+    return action.command or get_command(action.command_key)
 
-    conn = get_db_connection()
-    command_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'restart_cmd'").fetchone()
-    conn.close()
-    
-    command_to_execute = command_row['command_value'] if command_row else sys_actions.DEFAULT_COMMANDS.get('restart_cmd')
+def submit_action(current_user, action, value=None):
+    """
+    Queues `action` as a job and answers 202 with the job ID right away;
+    the outcome is available from /api/jobs/<job_id>.
+    """
+    command_to_execute = action_command(action)
 
     if not command_to_execute:
-        return jsonify({"success": False, "message": "Restart command not defined."}), 500
+        return jsonify({"success": False, "message": f"{action.label} command not defined."}), 500
 
-    result = sys_actions.execute_shell_command(command_to_execute, 'restart_cmd')
-    status_code = 200 if result["success"] else 500
-    return jsonify(result), status_code
-
-@app.route('/api/action/lock', methods=['POST'])
+    try:
+        job = queue_action(current_user, action, command_to_execute, value)
+    except JobQueueFull:
+        response = jsonify({'success': False, 'message': 'Too many actions in progress. Please try again.'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({
+        'success': True,
+        'message': f'{action.label} command queued.',
+        'job_id': job['id'],
+        'status': job['status']
+    }), 202
+
+@app.route('/api/action/<action_name>', methods=['POST'])
 @token_required
-def api_lock(current_user, current_permissions):
-    if not current_permissions.get('lock', False):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+def run_action(current_user, current_permissions, action_name):
+    """Runs any action of the registry (built-in or user-defined) by name."""
+    action = get_action_registry().get(action_name)
+    if action is None:
+        return jsonify({'success': False, 'message': f'Unknown action: {action_name}'}), 404
 
-    if not supported_system:
-        return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
-
-    conn = get_db_connection()
-    command_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'lock_cmd'").fetchone()
-    conn.close()
-    
-    command_to_execute = command_row['command_value'] if command_row else sys_actions.DEFAULT_COMMANDS.get('lock_cmd')
-
-    if not command_to_execute:
-        return jsonify({"success": False, "message": "Lock command not defined."}), 500
-
-    result = sys_actions.execute_shell_command(command_to_execute, 'lock_cmd')
-    status_code = 200 if result["success"] else 500
-    return jsonify(result), status_code
-
-@app.route('/api/action/play_pause', methods=['POST'])
-@token_required
-def api_play_pause(current_user, current_permissions):
-    if not current_permissions.get('play_pause', False):
+    if not has_permission(current_permissions, action.permission):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
 
     if not supported_system:
         return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
 
-    conn = get_db_connection()
-    command_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'play_pause_cmd'").fetchone()
-    conn.close()
-    
-    command_to_execute = command_row['command_value'] if command_row else sys_actions.DEFAULT_COMMANDS.get('play_pause_cmd')
+    value, error = action.parse_params(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"success": False, "message": error}), 400
 
-    if not command_to_execute:
-        return jsonify({"success": False, "message": "Play/Pause command not defined."}), 500
+    return submit_action(current_user, action, value)
 
-    result = sys_actions.execute_shell_command(command_to_execute, 'play_pause_cmd')
-    status_code = 200 if result["success"] else 500
-    return jsonify(result), status_code
-
-# NUEVO ENDPOINT: Media Next
-@app.route('/api/action/media_next', methods=['POST'])
+@app.route('/api/actions', methods=['GET'])
 @token_required
-def api_media_next(current_user, current_permissions):
-    if not current_permissions.get('media_next', False):
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-
-    if not supported_system:
-        return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
-
-    conn = get_db_connection()
-    command_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'media_next_cmd'").fetchone()
-    conn.close()
-    
-    command_to_execute = command_row['command_value'] if command_row else sys_actions.DEFAULT_COMMANDS.get('media_next_cmd')
-
-    if not command_to_execute:
-        return jsonify({"success": False, "message": "Media Next command not defined."}), 500
-
-    result = sys_actions.execute_shell_command(command_to_execute, 'media_next_cmd')
-    status_code = 200 if result["success"] else 500
-    return jsonify(result), status_code
-
-# NUEVO ENDPOINT: Media Previous
-@app.route('/api/action/media_previous', methods=['POST'])
+def list_actions(current_user, current_permissions):
+    """Actions the user may run (every action for users who can modify commands)."""
+    can_manage = has_permission(current_permissions, 'modify_commands')
+    actions = [
+        dict(action.describe(), command=action.command) if can_manage and not action.builtin else action.describe()
+        for action in get_action_registry().values()
+        if can_manage or has_permission(current_permissions, action.permission)
+    ]
+    return jsonify({'success': True, 'actions': actions})
+
+@app.route('/api/actions/<action_name>', methods=['PUT'])
 @token_required
-def api_media_previous(current_user, current_permissions):
-    if not current_permissions.get('media_previous', False):
+def save_action(current_user, current_permissions, action_name):
+    """Creates or replaces a user-defined action. Requires 'modify_commands'."""
+    if not has_permission(current_permissions, 'modify_commands'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
 
-    if not supported_system:
-        return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
-
-    conn = get_db_connection()
-    command_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'media_previous_cmd'").fetchone()
-    conn.close()
-    
-    command_to_execute = command_row['command_value'] if command_row else sys_actions.DEFAULT_COMMANDS.get('media_previous_cmd')
-
-    if not command_to_execute:
-        return jsonify({"success": False, "message": "Media Previous command not defined."}), 500
+    try:
+        fields = validate_definition(action_name, request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
 
-    result = sys_actions.execute_shell_command(command_to_execute, 'media_previous_cmd')
-    status_code = 200 if result["success"] else 500
-    return jsonify(result), status_code
+    db.execute(
+        "INSERT OR REPLACE INTO actions (name, label, permission, command, params, timeout, idempotent) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (action_name, fields['label'], fields['permission'], fields['command'], fields['params'], fields['timeout'], int(fields['idempotent']))
+    )
+    invalidate_actions()
+    print(f"User '{current_user}' saved action '{action_name}'.")
+    return jsonify({'success': True, 'message': f'Action {action_name} saved.', 'action': get_action_registry()[action_name].describe()})
 
-@app.route('/api/action/set_volume', methods=['POST'])
+@app.route('/api/actions/<action_name>', methods=['DELETE'])
 @token_required
-def api_set_volume(current_user, current_permissions):
-    if not current_permissions.get('volume', False):
+def delete_action(current_user, current_permissions, action_name):
+    """Deletes a user-defined action. Requires 'modify_commands'."""
+    if not has_permission(current_permissions, 'modify_commands'):
         return jsonify({'success': False, 'message': 'Permission denied'}), 403
 
-    if not supported_system:
-        return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
-
-    data = request.get_json()
-    level = data.get('level')
-    if not isinstance(level, (int, float)) or not (0 <= level <= 100):
-        return jsonify({"success": False, "message": "Invalid volume level. Must be an integer or float between 0 and 100."}), 400
-
-    conn = get_db_connection()
-    command_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'set_volume_cmd'").fetchone()
-    conn.close()
-    
-    command_to_execute = command_row['command_value'] if command_row else sys_actions.DEFAULT_COMMANDS.get('set_volume_cmd')
+    if db.execute("DELETE FROM actions WHERE name = ?", (action_name,)).rowcount == 0:
+        return jsonify({'success': False, 'message': 'Action not found (built-in actions cannot be deleted).'}), 404
+    invalidate_actions()
+    print(f"User '{current_user}' deleted action '{action_name}'.")
+    return jsonify({'success': True, 'message': f'Action {action_name} deleted.'})
 
-    if not command_to_execute:
-        return jsonify({"success": False, "message": "Set volume command not defined."}), 500
-        
-    result = sys_actions.execute_shell_command(command_to_execute, 'set_volume_cmd', level_placeholder=level)
-    status_code = 200 if result["success"] else 500
-    return jsonify(result), status_code
+# --- ACTION BATCHES ---
+BATCH_MAX_ACTIONS = 16
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "10")) # How long a request waits for results; jobs keep running after it
 
-# NUEVO ENDPOINT: Volume Mute/Unmute
-@app.route('/api/action/volume_mute', methods=['POST'])
+@app.route('/api/actions/batch', methods=['POST'])
 @token_required
-def api_volume_mute(current_user, current_permissions):
-    if not current_permissions.get('volume_mute', False): # Use volume_mute permission
-        return jsonify({'success': False, 'message': 'Permission denied'}), 403
-
+def run_action_batch(current_user, current_permissions):
+    """
+    Runs an ordered list of actions in one request:
+    {"actions": [{"action": "volume_mute"}, {"action": "play_pause"}, {"action": "lock", "wait": true}],
+     "stop_on_error": false}
+    Consecutive actions run concurrently; "wait": true starts a new stage that begins once every
+    earlier action finished. Answers with the result of each action, in order; if time runs out
+    first, 202 with the IDs of the unfinished jobs in "pending" (poll /api/jobs/<id>).
+    """
     if not supported_system:
         return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
 
-    conn = get_db_connection()
-    command_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'volume_mute_cmd'").fetchone()
-    conn.close()
-    
-    command_to_execute = command_row['command_value'] if command_row else sys_actions.DEFAULT_COMMANDS.get('volume_mute_cmd')
-
-    if not command_to_execute:
-        return jsonify({"success": False, "message": "Volume Mute command not defined."}), 500
-
-    result = sys_actions.execute_shell_command(command_to_execute, 'volume_mute_cmd')
-    status_code = 200 if result["success"] else 500
-    return jsonify(result), status_code
-
-@app.route('/api/volume', methods=['GET'])
+    data = request.get_json(silent=True) or {}
+    items = data.get('actions')
+    if not isinstance(items, list) or not items or len(items) > BATCH_MAX_ACTIONS:
+        return jsonify({'success': False, 'message': f'"actions" must be a list of 1 to {BATCH_MAX_ACTIONS} actions.'}), 400
+
+    # Validate the whole batch (names, permissions, parameters, commands) before running any of it
+    registry = get_action_registry()
+    stages = []
+    for index, item in enumerate(items):
+        name = item.get('action') if isinstance(item, dict) else None
+        action = registry.get(name) if isinstance(name, str) else None
+        if action is None:
+            return jsonify({'success': False, 'message': f'Action {index}: unknown action "{name}".'}), 400
+        if not has_permission(current_permissions, action.permission):
+            return jsonify({'success': False, 'message': f'Action {index} ({name}): Permission denied'}), 403
+        value, error = action.parse_params(item)
+        if error:
+            return jsonify({'success': False, 'message': f'Action {index} ({name}): {error}'}), 400
+        command_to_execute = action_command(action)
+        if not command_to_execute:
+            return jsonify({'success': False, 'message': f'Action {index} ({name}): {action.label} command not defined.'}), 500
+        if not stages or item.get('wait'):
+            stages.append([])
+        stages[-1].append((index, action, command_to_execute, value))
+
+    results = [None] * len(items)
+    deadline = time.monotonic() + request_budget(request.environ, BATCH_TIMEOUT)
+    failed = False
+    for stage_number, stage in enumerate(stages):
+        if failed and data.get('stop_on_error'):
+            for index, action, *_ in stage:
+                results[index] = {'action': action.name, 'status': 'skipped', 'success': False, 'message': 'Skipped after an earlier failure.'}
+            continue
+        jobs = {}
+        for index, action, command_to_execute, value in stage:
+            try:
+                jobs[index] = queue_action(current_user, action, command_to_execute, value)['id']
+            except JobQueueFull:
+                results[index] = {'action': action.name, 'status': 'rejected', 'success': False, 'message': 'Too many actions in progress.'}
+        records = job_engine.wait(list(jobs.values()), max(0.0, deadline - time.monotonic()))
+        for index, action, *_ in stage:
+            if index not in jobs:
+                continue
+            job = records.get(jobs[index]) or {'status': 'unknown', 'result': None}
+            result = job['result'] or {'success': False, 'message': f"Still {job['status']}; poll /api/jobs/{jobs[index]}."}
+            results[index] = {'action': action.name, 'job_id': jobs[index], 'status': job['status'], **result}
+        failed = failed or any(not results[index]['success'] for index, *_ in stage)
+        if time.monotonic() >= deadline:
+            # Out of time: later stages depend on the unfinished ones and are not started
+            for later_stage in stages[stage_number + 1:]:
+                for index, action, *_ in later_stage:
+                    results[index] = {'action': action.name, 'status': 'skipped', 'success': False, 'message': 'Batch timed out before this stage.'}
+            break
+
+    pending = [result['job_id'] for result in results if 'job_id' in result and result['status'] not in FINAL_STATUSES]
+    response = {'success': all(result['success'] for result in results), 'results': results}
+    if pending:
+        return jsonify({**response, 'pending': pending}), 202
+    return jsonify(response), 200
+
+def visible_job(job_id, current_user, current_permissions):
+    """The job record if it exists and belongs to the user (administrators see every job)."""
+    job = job_engine.store.get(job_id) if job_engine else None
+    if job and (job['user'] == current_user or has_permission(current_permissions, ADMIN_PERMISSION)):
+        return job
+    return None
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
 @token_required
-def get_current_volume(current_user, current_permissions):
-    # MODIFICACIÓN: Ahora devuelve nivel Y estado de mute
-    if not current_permissions.get('volume', False) and not current_permissions.get('volume_mute', False):
-        return jsonify({'success': False, 'message': 'Permission denied for volume or mute status.'}), 403
-
-    if not supported_system or platform.system() != "Linux":
-        return jsonify({"success": False, "message": "Volume retrieval not supported or implemented on this OS."}), 501
-
-    conn = get_db_connection()
-    get_volume_cmd_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'get_volume_cmd'").fetchone()
-    get_mute_status_cmd_row = conn.execute("SELECT command_value FROM commands WHERE command_key = 'get_mute_status_cmd'").fetchone()
-    conn.close()
-
-    command_to_execute_volume = get_volume_cmd_row['command_value'] if get_volume_cmd_row else sys_actions.DEFAULT_COMMANDS.get('get_volume_cmd')
-    command_to_execute_mute = get_mute_status_cmd_row['command_value'] if get_mute_status_cmd_row else sys_actions.DEFAULT_COMMANDS.get('get_mute_status_cmd')
+def get_job(current_user, current_permissions, job_id):
+    """Status of an action job: queued, running, succeeded, failed, timeout or cancelled."""
+    job = visible_job(job_id, current_user, current_permissions)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@token_required
+def cancel_job(current_user, current_permissions, job_id):
+    """Cancels a queued job or terminates the command of a running one."""
+    if not visible_job(job_id, current_user, current_permissions):
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    job = job_engine.cancel(job_id)
+    if job['status'] in FINAL_STATUSES and job['status'] != 'cancelled':
+        return jsonify({'success': False, 'message': f"Job already finished ({job['status']}).", 'job': job}), 409
+    return jsonify({'success': True, 'message': 'Cancellation requested.', 'job': job})
+
+def read_volume_state():
+    """
+    Runs get_volume_cmd and get_mute_status_cmd and returns (level, is_muted); None when unknown.
+    Only the leader's MediaMonitor calls it, when pactl reports a change, so it isn't cached.
+    """
+    command_to_execute_volume = get_command('get_volume_cmd')
+    command_to_execute_mute = get_command('get_mute_status_cmd')
 
     volume_level = None
     is_muted_status = None
@@ -858,12 +1099,534 @@ def get_current_volume(current_user, current_permissions):
         else:
             print(f"Warning: Failed to execute get_mute_status_cmd: {shell_result_mute['message']}")
 
+    return volume_level, is_muted_status
+
+def read_audio_state():
+    """Latest (level, is_muted) published by the leader's audio subscriber; (None, None) when unknown."""
+    audio = (media_state.read() if media_state else {}).get('audio') or {}
+    return audio.get('level'), audio.get('is_muted')
+
+@app.route('/api/volume', methods=['GET'])
+@token_required
+def get_current_volume(current_user, current_permissions):
+    # MODIFICACIÓN: Ahora devuelve nivel Y estado de mute
+    if not has_permission(current_permissions, 'volume') and not has_permission(current_permissions, 'volume_mute'):
+        return jsonify({'success': False, 'message': 'Permission denied for volume or mute status.'}), 403
+
+    if not supported_system or platform.system() != "Linux":
+        return jsonify({"success": False, "message": "Volume retrieval not supported or implemented on this OS."}), 501
+
+    # O(1): the state is kept by the leader's subscriber, nothing is spawned here
+    audio = media_state.read().get('audio') if media_state else None
+    if not audio or audio.get('updated_at') is None:
+        response = jsonify({'success': False, 'message': 'Volume state not available yet.'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    volume_level, is_muted_status = audio['level'], audio['is_muted']
+
     # Return combined result
     if volume_level is not None or is_muted_status is not None:
         return jsonify({'success': True, 'level': volume_level, 'is_muted': is_muted_status}), 200
     else:
         return jsonify({'success': False, 'message': 'Failed to retrieve volume or mute status.'}), 500
 
+@app.route('/api/media', methods=['GET'])
+@token_required
+def get_media_state(current_user, current_permissions):
+    """Player status and now-playing track, as reported by playerctl."""
+    if not any(has_permission(current_permissions, name) for name in ('play_pause', 'media_next', 'media_previous')):
+        return jsonify({'success': False, 'message': 'Permission denied for media status.'}), 403
+
+    if not supported_system or not media_state:
+        return jsonify({"success": False, "message": "Media status not supported or implemented on this OS."}), 501
+
+    media = media_state.read().get('media')
+    if not media or not media.get('available'):
+        return jsonify({'success': False, 'message': 'No media player information available.'}), 503
+    return jsonify({'success': True, 'media': media}), 200
+
+@app.route('/api/metrics/history', methods=['GET'])
+@token_required
+def get_metrics_history(current_user, current_permissions):
+    """
+    Returns min/max/avg buckets of the metrics.
+    Query parameters (all in seconds): from and to as Unix timestamps, step as the bucket size.
+    Ranges still held by the in-memory ring buffer are served from it; older ones come from
+    the coarsest archive table that fits the step.
+    """
+    if not has_permission(current_permissions, 'system_metrics'):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+
+    if not supported_system:
+        return jsonify({"success": False, "message": "Metrics history not available on this OS."}), 501
+
+    try:
+        end_time = float(request.args.get('to', time.time()))
+        start_time = float(request.args.get('from', end_time - 3600))
+        step = float(request.args['step']) if request.args.get('step') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': "'from', 'to' and 'step' must be numbers of seconds."}), 400
+
+    if end_time <= start_time:
+        return jsonify({'success': False, 'message': "'to' must be greater than 'from'."}), 400
+
+    if step is None:
+        step = max(metrics_sampler.interval, (end_time - start_time) / DEFAULT_HISTORY_POINTS)
+    elif step <= 0 or (end_time - start_time) / step > MAX_BUCKETS:
+        return jsonify({'success': False, 'message': f"'step' is too small: at most {MAX_BUCKETS} buckets per query."}), 400
+
+    oldest_in_memory = metrics_history.oldest_timestamp()
+    if oldest_in_memory is None or oldest_in_memory >= end_time:
+        data = metrics_archive.downsample(start_time, end_time, step)
+        sources = [data.pop('table')]
+    elif oldest_in_memory <= start_time:
+        data = metrics_history.downsample(start_time, end_time, step)
+        sources = ['memory']
+    else:
+        # Older buckets from the archive, the rest from memory, split on a bucket boundary
+        split_time = start_time + math.ceil((oldest_in_memory - start_time) / step) * step
+        data = metrics_archive.downsample(start_time, split_time, step)
+        sources = [data.pop('table'), 'memory']
+        if split_time < end_time:
+            recent = metrics_history.downsample(split_time, end_time, step)
+            for key, values in recent.items():
+                if key == 't':
+                    data['t'].extend(values)
+                else:
+                    for aggregate, series in values.items():
+                        data[key][aggregate].extend(series)
+    return jsonify({'success': True, 'from': start_time, 'to': end_time, 'step': step, 'sources': sources, 'data': data})
+
+@app.route('/api/metrics/top', methods=['GET'])
+@token_required
+def get_metrics_top(current_user, current_permissions):
+    """
+    Returns per-core CPU usage and the top N processes by CPU and by resident memory.
+    Query parameter: limit (1 to PROCESS_TOP_LIMIT, default 10).
+    The first request after an idle period starts the process scan and gets "pending": true
+    with empty (or partial) lists and a Retry-After header: ask again after that many seconds.
+    """
+    if not has_permission(current_permissions, 'system_metrics'):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+
+    if not supported_system:
+        return jsonify({"success": False, "message": "Process view not available on this OS."}), 501
+
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'success': False, 'message': "'limit' must be an integer."}), 400
+    if not 1 <= limit <= PROCESS_TOP_LIMIT:
+        return jsonify({'success': False, 'message': f"'limit' must be between 1 and {PROCESS_TOP_LIMIT}."}), 400
+
+    # The leader only scans /proc/[pid] while this view is in use
+    shared_metrics.mark_demand('processes')
+    details = shared_metrics.read_details()
+    processes = details.get('processes') or {}
+    # No scan yet, or only the first one (CPU usage needs a delta): don't wait for the leader here
+    pending = not processes.get('top_cpu')
+    response = jsonify({
+        'success': True,
+        'pending': pending,
+        'cpu_per_core': details.get('cpu_per_core', []),
+        'process_count': processes.get('process_count'),
+        'top_cpu': processes.get('top_cpu', [])[:limit],
+        'top_memory': processes.get('top_memory', [])[:limit],
+        'timestamp': processes.get('timestamp')
+    })
+    if pending:
+        response.headers['Retry-After'] = str(math.ceil(PROCESS_SCAN_INTERVAL))
+    return response
+
+def stream_response(body, async_body, mimetype):
+    """
+    Response for a long-lived body. Under the ASGI server (asgi.py) `async_body` is iterated on
+    the event loop and the view's thread is free as soon as it returns; a WSGI worker iterates `body`.
+    Both are generators, so the one that isn't used never starts.
+    """
+    if ASYNC_BODY_KEY in request.environ:
+        request.environ[ASYNC_BODY_KEY] = async_body
+        body = iter(()) # An iterator, not a sequence: no Content-Length
+    response = Response(body, mimetype=mimetype)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Don't let a reverse proxy buffer the stream
+    return response
+
+@app.route('/api/stream', methods=['GET'])
+@token_required
+def api_stream(current_user, current_permissions):
+    """
+    Server-Sent Events stream of the dashboard values (CPU, RAM, uptime, disk and network
+    throughput, volume, mute).
+    Authenticated once when the connection opens; afterwards only changed fields are pushed.
+    """
+    include_metrics = has_permission(current_permissions, 'system_metrics')
+    include_volume = has_permission(current_permissions, 'volume') or has_permission(current_permissions, 'volume_mute')
+    if not include_metrics and not include_volume:
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+
+    if not supported_system:
+        return jsonify({"success": False, "message": "Live updates not available on this OS."}), 501
+
+    if not stream_slots.acquire(app.config['STREAM_MAX_CONNECTIONS']):
+        response = jsonify({'success': False, 'message': 'Too many open streams. Falling back to polling.'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    def read_state():
+        state = {}
+        if include_metrics:
+            sample = read_latest_metrics()
+            state['cpu_usage'] = sample.get('cpu_usage')
+            state['ram_usage'] = sample.get('ram_usage')
+            state['uptime'] = sample.get('uptime')
+            for field in ('disk_read_bps', 'disk_write_bps', 'net_rx_bps', 'net_tx_bps'):
+                state[field] = sample.get(field)
+        if include_volume:
+            state['volume'], state['is_muted'] = read_audio_state()
+        return state
+
+    read_version = lambda: (shared_metrics.sequence(), media_state.sequence())
+    # A sync worker ends the stream before its timeout; EventSource reconnects after STREAM_RETRY_MS
+    lifetime = request_budget(request.environ, STREAM_MAX_LIFETIME)
+    response = stream_response(
+        stream_state(read_state, read_version, lifetime),
+        stream_state_async(read_state, read_version, lifetime),
+        'text/event-stream'
+    )
+    response.call_on_close(stream_slots.release)
+    return response
+
+
+
+@app.errorhandler(DatabaseBusy)
+def database_busy(e):
+    """A lock held past the busy timeout fails fast with 503 instead of stalling the worker."""
+    print(f"Database busy: {e}")
+    response = jsonify({'success': False, 'message': 'The database is busy. Please try again.'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# --- FLEET ---
+fleet_aggregator = FleetAggregator() if fleet_mode == 'aggregator' else None
+fleet_nodes_state = (None, ())
+FLEET_BROADCAST_MAX_CONCURRENCY = 64
+FLEET_ACTION_MAX_TIMEOUT = 300
+FLEET_ACTION_MAX_RETRIES = 3
+FLEET_ACTION_SLACK = 2.0 # Network and queueing time on top of the node's own wait
+
+def node_action_wait(action):
+    """How long a node waits for a broadcast action before answering with its job still running."""
+    return request_budget(request.environ, action.timeout or BATCH_TIMEOUT)
+
+def get_fleet_nodes():
+    """Registered nodes as a tuple of {'name', 'url', 'token'}, reloaded only when the 'nodes' version changed."""
+    global fleet_nodes_state
+    version = shared_versions.get('nodes')
+    cached_version, nodes = fleet_nodes_state
+    if cached_version == version:
+        return nodes
+    rows = db.query("SELECT name, url, token FROM fleet_nodes ORDER BY name")
+    nodes = tuple({'name': row['name'], 'url': row['url'], 'token': row['token']} for row in rows)
+    fleet_nodes_state = (version, nodes)
+    return nodes
+
+def fleet_token_valid():
+    """True if the request carries this node's FLEET_TOKEN."""
+    authorization = request.headers.get('Authorization', '')
+    return bool(fleet_token) and authorization.startswith('Bearer ') and hmac.compare_digest(
+        authorization[7:].encode(), fleet_token.encode()
+    )
+
+def push_token_valid(name, token):
+    """Collector side of push mode: an agent authenticates with the token registered for its node."""
+    node = next((node for node in get_fleet_nodes() if node['name'] == name), None)
+    return node is not None and bool(node['token']) and isinstance(token, str) and hmac.compare_digest(
+        token.encode(), node['token'].encode()
+    )
+
+def fleet_view(nodes):
+    """
+    Status entries of `nodes`: pushed state when the node's agent is connected and current,
+    a concurrent pull from the node otherwise (falling back to older pushed data).
+    """
+    pushed = fleet_push_state.read() if fleet_push_state else {}
+    now = time.time()
+    fresh = {
+        name: state for name, state in pushed.items()
+        if state.get('connected') and state.get('data') and now - (state.get('updated_at') or 0) < FLEET_PUSH_STALE_SECONDS
+    }
+    pulled = {entry['name']: entry for entry in fleet_aggregator.status([node for node in nodes if node['name'] not in fresh], registered=nodes)}
+    entries = []
+    for node in nodes:
+        state = fresh.get(node['name'])
+        if state:
+            entries.append({'name': node['name'], 'url': node['url'], 'state': 'ok', 'source': 'push', 'latency_ms': None,
+                            'updated_at': state['updated_at'], 'error': None, 'data': state['data']})
+            continue
+        entry = pulled[node['name']]
+        older = pushed.get(node['name'])
+        if entry['data'] is None and older and older.get('data'):
+            entry.update(state='stale', source='push', updated_at=older['updated_at'], data=older['data'])
+        entries.append(entry)
+    return entries
+
+def node_status():
+    """Summary of this instance for an aggregator: metrics, audio and media state."""
+    sample = read_latest_metrics()
+    media = media_state.read() if media_state else {}
+    return {
+        'hostname': platform.node(),
+        'os_type': platform.system(),
+        'metrics': {field: sample.get(field) for field in (
+            'timestamp', 'cpu_usage', 'ram_usage', 'uptime', 'uptime_seconds',
+            'disk_read_bps', 'disk_write_bps', 'net_rx_bps', 'net_tx_bps',
+        )},
+        'audio': media.get('audio'),
+        'media': media.get('media'),
+    }
+
+@app.route('/api/node/status', methods=['GET'])
+def get_node_status():
+    """Node side of the fleet: authenticated with FLEET_TOKEN instead of a user session."""
+    if not fleet_token_valid():
+        return jsonify({'success': False, 'message': 'Invalid or missing fleet token.'}), 401
+    return jsonify({'success': True, 'node': node_status()})
+
+@app.route('/api/node/action/<action_name>', methods=['POST'])
+def run_node_action(action_name):
+    """
+    Node side of a fleet broadcast: runs an action of this node's registry and answers with
+    its outcome. The aggregator already checked the user's permission.
+    """
+    if not fleet_token_valid():
+        return jsonify({'success': False, 'message': 'Invalid or missing fleet token.'}), 401
+
+    action = get_action_registry().get(action_name)
+    if action is None:
+        return jsonify({'success': False, 'message': f'Unknown action: {action_name}'}), 404
+
+    if not supported_system:
+        return jsonify({"success": False, "message": "System actions not available on this OS."}), 501
+
+    value, error = action.parse_params(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"success": False, "message": error}), 400
+
+    command_to_execute = action_command(action)
+    if not command_to_execute:
+        return jsonify({"success": False, "message": f"{action.label} command not defined."}), 500
+
+    try:
+        job = queue_action('fleet', action, command_to_execute, value)
+    except JobQueueFull:
+        response = jsonify({'success': False, 'message': 'Too many actions in progress. Please try again.'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    def outcome(records):
+        record = records.get(job['id']) or job
+        result = record['result'] or {'success': False, 'message': f"Still {record['status']}; poll /api/jobs/{job['id']}."}
+        return {'job_id': job['id'], 'status': record['status'], **result}
+
+    if ASYNC_BODY_KEY in request.environ:
+        # Async serving: wait for the job on the event loop instead of in this thread
+        async def wait_async():
+            yield json.dumps(outcome(await job_engine.wait_async([job['id']], node_action_wait(action))))
+        request.environ[ASYNC_BODY_KEY] = wait_async()
+        return Response(iter(()), mimetype='application/json')
+    return jsonify(outcome(job_engine.wait([job['id']], node_action_wait(action))))
+
+@app.route('/api/fleet', methods=['GET'])
+@token_required
+def get_fleet(current_user, current_permissions):
+    """Status of every registered node, queried concurrently (aggregator mode only)."""
+    if not has_permission(current_permissions, 'system_metrics'):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    if fleet_aggregator is None:
+        return jsonify({'success': False, 'message': 'Fleet aggregation is not enabled (FLEET_MODE=aggregator).'}), 404
+    return jsonify({'success': True, 'nodes': fleet_view(get_fleet_nodes())})
+
+@app.route('/api/fleet/actions/<action_name>', methods=['POST'])
+@token_required
+def broadcast_fleet_action(current_user, current_permissions, action_name):
+    """
+    Runs one action on a group of nodes (aggregator mode only):
+    {"nodes": ["web1", "web2"], "params": {"level": 40}, "concurrency": 8, "timeout": 10, "retries": 1}
+    "nodes" defaults to every registered node; "retries" is only accepted for idempotent actions.
+    The permission is checked here, once; the nodes trust their FLEET_TOKEN. Answers with
+    newline-delimited JSON: one line per node as soon as it's done, then a summary line.
+    """
+    if fleet_aggregator is None:
+        return jsonify({'success': False, 'message': 'Fleet aggregation is not enabled (FLEET_MODE=aggregator).'}), 404
+
+    # The action is described by the aggregator's registry: custom actions must be defined here too
+    action = get_action_registry().get(action_name)
+    if action is None:
+        return jsonify({'success': False, 'message': f'Unknown action: {action_name}'}), 404
+
+    if not has_permission(current_permissions, action.permission):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+
+    data = request.get_json(silent=True) or {}
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'success': False, 'message': '"params" must be an object.'}), 400
+    value, error = action.parse_params(params)
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+
+    nodes = get_fleet_nodes()
+    selected = data.get('nodes')
+    if selected is not None:
+        if not isinstance(selected, list) or not all(isinstance(name, str) for name in selected):
+            return jsonify({'success': False, 'message': '"nodes" must be a list of node names.'}), 400
+        unknown = sorted(set(selected) - {node['name'] for node in nodes})
+        if unknown:
+            return jsonify({'success': False, 'message': f"Unknown nodes: {', '.join(unknown)}"}), 400
+        nodes = tuple(node for node in nodes if node['name'] in selected)
+    if not nodes:
+        return jsonify({'success': False, 'message': 'No nodes selected.'}), 400
+
+    concurrency = data.get('concurrency', FLEET_BROADCAST_CONCURRENCY)
+    timeout = data.get('timeout', node_action_wait(action) + FLEET_ACTION_SLACK)
+    retries = data.get('retries', 0)
+    if isinstance(concurrency, bool) or not isinstance(concurrency, int) or not 1 <= concurrency <= FLEET_BROADCAST_MAX_CONCURRENCY:
+        return jsonify({'success': False, 'message': f'"concurrency" must be an integer between 1 and {FLEET_BROADCAST_MAX_CONCURRENCY}.'}), 400
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not 0 < timeout <= FLEET_ACTION_MAX_TIMEOUT:
+        return jsonify({'success': False, 'message': f'"timeout" must be between 0 and {FLEET_ACTION_MAX_TIMEOUT} seconds.'}), 400
+    if isinstance(retries, bool) or not isinstance(retries, int) or not 0 <= retries <= FLEET_ACTION_MAX_RETRIES:
+        return jsonify({'success': False, 'message': f'"retries" must be an integer between 0 and {FLEET_ACTION_MAX_RETRIES}.'}), 400
+    if retries and not action.idempotent:
+        return jsonify({'success': False, 'message': f'{action.label} is not idempotent and cannot be retried.'}), 400
+
+    # A single-threaded worker must answer before its timeout: the nodes still running by then
+    # are reported as timed out (async and threaded workers let the broadcast run its course)
+    timeout = request_budget(request.environ, timeout)
+    budget = request_budget(request.environ, math.inf)
+    deadline = time.monotonic() + budget if budget != math.inf else None
+
+    print(f"User '{current_user}' broadcast action '{action_name}' to {len(nodes)} node(s).")
+    # Forward only the validated parameter, not whatever else the body carried
+    body = {name: value for name in action.params}
+
+    summary = lambda succeeded: json.dumps({
+        'done': True, 'action': action.name, 'total': len(nodes), 'succeeded': succeeded, 'failed': len(nodes) - succeeded
+    }) + "\n"
+
+    def generate():
+        succeeded = 0
+        for result in fleet_aggregator.broadcast(nodes, action.name, body, concurrency, timeout, retries, deadline):
+            succeeded += bool(result['success'])
+            yield json.dumps(result) + "\n"
+        yield summary(succeeded)
+
+    async def generate_async():
+        succeeded = 0
+        async for result in fleet_aggregator.broadcast_async(nodes, action.name, body, concurrency, timeout, retries):
+            succeeded += bool(result['success'])
+            yield json.dumps(result) + "\n"
+        yield summary(succeeded)
+
+    return stream_response(generate(), generate_async(), 'application/x-ndjson')
+
+@app.route('/api/fleet/nodes', methods=['GET'])
+@token_required
+def list_fleet_nodes(current_user, current_permissions):
+    if not has_permission(current_permissions, 'manage_users'):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    return jsonify({'success': True, 'nodes': [
+        {'name': node['name'], 'url': node['url'], 'has_token': bool(node['token'])} for node in get_fleet_nodes()
+    ]})
+
+@app.route('/api/fleet/nodes/<name>', methods=['PUT'])
+@token_required
+def save_fleet_node(current_user, current_permissions, name):
+    """Registers or updates a node: {"url": "http://host:5000", "token": "<its FLEET_TOKEN>"}."""
+    if not has_permission(current_permissions, 'manage_users'):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+
+    data = request.get_json(silent=True) or {}
+    url = data.get('url')
+    token = data.get('token', '')
+    if not ACTION_NAME.fullmatch(name):
+        return jsonify({'success': False, 'message': 'Node names must be 1-32 lowercase letters, digits or underscores.'}), 400
+    if not isinstance(token, str):
+        return jsonify({'success': False, 'message': 'Invalid token.'}), 400
+    try:
+        parse_node_url(url)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    db.execute("INSERT OR REPLACE INTO fleet_nodes (name, url, token) VALUES (?, ?, ?)", (name, url.rstrip('/'), token))
+    shared_versions.bump('nodes')
+    print(f"User '{current_user}' registered fleet node '{name}' ({url}).")
+    return jsonify({'success': True, 'message': f'Node {name} saved.'})
+
+@app.route('/api/fleet/nodes/<name>', methods=['DELETE'])
+@token_required
+def delete_fleet_node(current_user, current_permissions, name):
+    if not has_permission(current_permissions, 'manage_users'):
+        return jsonify({'success': False, 'message': 'Permission denied'}), 403
+    if db.execute("DELETE FROM fleet_nodes WHERE name = ?", (name,)).rowcount == 0:
+        return jsonify({'success': False, 'message': 'Node not found'}), 404
+    shared_versions.bump('nodes')
+    print(f"User '{current_user}' removed fleet node '{name}'.")
+    return jsonify({'success': True, 'message': f'Node {name} removed.'})
+
+# --- PROMETHEUS METRICS ---
+def scrape_allowed():
+    """True if the request carries the scrape token or comes from an allowed network."""
+    if metrics_scrape_token:
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer ') and hmac.compare_digest(authorization[7:].encode(), metrics_scrape_token.encode()):
+            return True
+    if metrics_allowed_networks and request.remote_addr:
+        try:
+            address = ipaddress.ip_address(request.remote_addr)
+        except ValueError:
+            return False
+        return any(address in network for network in metrics_allowed_networks)
+    return False
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus/OpenMetrics scrape endpoint. Protected by METRICS_SCRAPE_TOKEN (Bearer) and/or
+    METRICS_ALLOWED_NETWORKS instead of the login cookie; disabled when neither is set.
+    """
+    if not supported_system or (not metrics_scrape_token and not metrics_allowed_networks):
+        return jsonify({'success': False, 'message': 'Metrics scraping is not enabled.'}), 404
+    if not scrape_allowed():
+        response = jsonify({'success': False, 'message': 'Scrape not authorized.'})
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response, 401
+    return Response(exposition_cache.get(), content_type=prometheus_exporter.CONTENT_TYPE)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if http_metrics is not None and started is not None:
+        route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+        http_metrics.observe(route, response.status_code, time.perf_counter() - started)
+    return response
+
+# Registered last so that every route is known when the shared counter table is laid out
+http_metrics = None
+exposition_cache = None
+if shared_metrics is not None:
+    http_metrics = HTTPMetrics(metrics_region_path + ".http", [rule.rule for rule in app.url_map.iter_rules()])
+    http_metrics.attach()
+    exposition_cache = prometheus_exporter.ExpositionCache(
+        shared_metrics.sequence,
+        lambda: prometheus_exporter.render(
+            shared_metrics.read(), shared_metrics.read_details(), http_metrics.snapshot(),
+            db.stats(), query_cache.stats() if query_cache else None
+        )
+    )
 
 if __name__ == '__main__':
     if supported_system:
@@ -0,0 +1,162 @@
+# backend/asgi.py
+"""
+Async serving mode: `gunicorn -w 4 -k uvicorn_worker.UvicornWorker asgi:app`.
+The Flask views run unchanged on a bounded thread pool, which is where their database and
+file work happens. The difference is what a request holds once its view returned: responses
+that last (the SSE stream, fleet broadcasts, waiting for a broadcast action on a node) hand
+an async generator to this adapter, which iterates it on the event loop. An open stream then
+costs a coroutine and a socket instead of a sync worker, and thousands of idle clients only
+cost memory. Other response bodies are read from the pool.
+"""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from event_stream import ASYNC_BODY_KEY
+from app import app as flask_app
+
+ASYNC_VIEW_THREADS = int(os.getenv("ASYNC_VIEW_THREADS", "32"))
+# Streams no longer pin a worker here, so they can be capped much higher than in sync mode
+ASYNC_STREAM_MAX_CONNECTIONS = int(os.getenv("ASYNC_STREAM_MAX_CONNECTIONS", "1000"))
+MAX_REQUEST_BODY = 10 * 1024 * 1024
+
+
+class WSGIBridge:
+    """ASGI application running a WSGI app on a thread pool, with async response bodies."""
+
+    def __init__(self, wsgi_app, threads=ASYNC_VIEW_THREADS):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1000})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Created in the worker process, after the fork
+                self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="asgi-view")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_REQUEST_BODY:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    def _environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+            "PATH_INFO": scope["path"].encode().decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+            ASYNC_BODY_KEY: None, # Tells the views they may answer with an async body
+        }
+        for name, value in scope.get("headers", ()):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[name] = value
+                continue
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            await send({"type": "http.response.start", "status": 413, "headers": [(b"content-length", b"0")]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        loop = asyncio.get_running_loop()
+        environ = self._environ(scope, body)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+            return lambda data: None # The legacy write() callable isn't used by Flask
+
+        iterable = await loop.run_in_executor(self._executor, self.wsgi_app, environ, start_response)
+        try:
+            async_body = environ.get(ASYNC_BODY_KEY)
+            chunks = iter(iterable)
+            first = b"" if async_body is not None else await loop.run_in_executor(self._executor, next, chunks, None)
+            await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+            if async_body is not None:
+                await self._send_async_body(async_body, receive, send)
+                return
+            chunk = first
+            while chunk is not None:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(iterable, "close"):
+                # Runs the response's close callbacks (e.g. releasing a stream slot)
+                await loop.run_in_executor(self._executor, iterable.close)
+
+    async def _send_async_body(self, async_body, receive, send):
+        async def pump():
+            async for chunk in async_body:
+                await send({"type": "http.response.body", "body": chunk.encode() if isinstance(chunk, str) else chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        pumping = asyncio.ensure_future(pump())
+        watching = asyncio.ensure_future(disconnected())
+        try:
+            await asyncio.wait((pumping, watching), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (pumping, watching):
+                task.cancel()
+            await asyncio.gather(pumping, watching, return_exceptions=True)
+            await async_body.aclose()
+        error = pumping.exception() if pumping.done() and not pumping.cancelled() else None
+        if error is not None and not isinstance(error, OSError): # OSError: the client went away mid-write
+            raise error
+
+
+flask_app.config['STREAM_MAX_CONNECTIONS'] = ASYNC_STREAM_MAX_CONNECTIONS
+app = WSGIBridge(flask_app)
@@ -0,0 +1,155 @@
+# backend/db_pool.py
+"""
+Pooled access to the SQLite database.
+Each worker keeps a few connections open for its whole life, configured once for WAL
+(readers never wait for the writer in another worker), synchronous=NORMAL, a bounded
+busy timeout and a larger page cache. Statements are reused through sqlite3's per-connection
+statement cache, so the hot queries are parsed once per connection instead of per request.
+Waiting for a connection or for a database lock is counted, and a lock that isn't released
+within the busy timeout surfaces as DatabaseBusy instead of a request that hangs.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "2.0"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+STATEMENT_CACHE_SIZE = 64
+SLOW_QUERY_SECONDS = 0.1
+
+# Counters kept per pool (indexes into the shared WorkerCounters table)
+DB_STATS = (
+    "queries", "query_seconds", "slow_queries",
+    "pool_waits", "pool_wait_seconds", "busy_errors",
+)
+_STAT_INDEX = {name: index for index, name in enumerate(DB_STATS)}
+
+
+class DatabaseBusy(sqlite3.OperationalError):
+    """The database (or the pool) stayed locked for longer than DB_BUSY_TIMEOUT."""
+
+
+class ConnectionPool:
+    """Per-process pool of SQLite connections with query helpers and contention counters."""
+
+    def __init__(self, path, size=DB_POOL_SIZE, busy_timeout=DB_BUSY_TIMEOUT, counters=None):
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.counters = counters # Optional WorkerCounters with len(DB_STATS) values
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._pid = os.getpid()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            check_same_thread=False, # Connections move between threads, never used by two at once
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        return conn
+
+    def _count(self, increments):
+        if self.counters is not None:
+            self.counters.add([(_STAT_INDEX[name], amount) for name, amount in increments])
+
+    def _checkout(self):
+        if self._pid != os.getpid():
+            # Forked child: the parent's connections must not be shared, start a fresh pool
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = queue.LifoQueue()
+                    self._created = 0
+                    self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.busy_timeout)
+        except queue.Empty:
+            self._count([("pool_waits", 1), ("pool_wait_seconds", time.perf_counter() - started), ("busy_errors", 1)])
+            raise DatabaseBusy("No database connection became available in time")
+        self._count([("pool_waits", 1), ("pool_wait_seconds", time.perf_counter() - started)])
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection; an unfinished transaction is rolled back when it's returned."""
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Borrows a connection and commits on success (rolls back on error)."""
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    def _run(self, conn, sql, params, fetch):
+        started = time.perf_counter()
+        try:
+            cursor = conn.execute(sql, params)
+            return fetch(cursor) if fetch else cursor
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                self._count([("busy_errors", 1)])
+                raise DatabaseBusy(str(e)) from e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self._count([("queries", 1), ("query_seconds", elapsed), ("slow_queries", int(elapsed >= SLOW_QUERY_SECONDS))])
+
+    def query(self, sql, params=(), one=False, conn=None):
+        """Runs a SELECT and returns all rows (or the first row / None with one=True)."""
+        fetch = (lambda cursor: cursor.fetchone()) if one else (lambda cursor: cursor.fetchall())
+        if conn is not None:
+            return self._run(conn, sql, params, fetch)
+        with self.connection() as conn:
+            return self._run(conn, sql, params, fetch)
+
+    def execute(self, sql, params=(), conn=None):
+        """
+        Runs a write statement and returns its cursor (rowcount, lastrowid).
+        Commits immediately unless it's part of a transaction() passed as `conn`.
+        """
+        if conn is not None:
+            return self._run(conn, sql, params, None)
+        with self.transaction() as conn:
+            return self._run(conn, sql, params, None)
+
+    def stats(self):
+        """Counters summed over every worker: {name: value}."""
+        if self.counters is None:
+            return {}
+        return dict(zip(DB_STATS, self.counters.totals()))
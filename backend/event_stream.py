@@ -0,0 +1,184 @@
+# backend/event_stream.py
+"""
+Server-Sent Events helpers for the dashboard stream.
+A stream only ever holds the latest state: every tick it diffs the current values
+against what it already sent and emits the changed fields, so a slow client never
+accumulates a backlog (the blocking socket write is the backpressure).
+Under the ASGI server (asgi.py) the same stream is an async generator iterated on the event
+loop, so an open stream doesn't hold a thread.
+"""
+import asyncio
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from worker_counters import MAX_WORKERS
+
+# Half the threads of the default 4 workers x 8 threads, so open streams never take every thread
+STREAM_MAX_CONNECTIONS = int(os.getenv("STREAM_MAX_CONNECTIONS", "16"))
+STREAM_MAX_LIFETIME = float(os.getenv("STREAM_MAX_LIFETIME", "300"))
+STREAM_POLL_INTERVAL = 0.25
+STREAM_KEEPALIVE_INTERVAL = 15.0
+STREAM_RETRY_MS = 1000 # Streams in a sync worker end every few seconds; reconnect right away
+# WSGI environ key set by asgi.py; a view stores the async body of its response there
+ASYNC_BODY_KEY = "syspilot.async_body"
+# A single-threaded WSGI worker (gunicorn's plain sync worker) doesn't heartbeat while it is in
+# a request and is killed at its --timeout (30s by default), so a request that waits or streams
+# there must return well before that
+SYNC_REQUEST_BUDGET = float(os.getenv("SYNC_REQUEST_BUDGET", "15"))
+
+
+def request_budget(environ, seconds):
+    """`seconds`, capped to SYNC_REQUEST_BUDGET when the request holds a single-threaded worker."""
+    if ASYNC_BODY_KEY in environ or environ.get("wsgi.multithread"):
+        return seconds
+    return min(seconds, SYNC_REQUEST_BUDGET)
+
+
+# Open streams per worker slot
+_COUNT = struct.Struct("<I")
+_COUNTS = struct.Struct("<" + "I" * MAX_WORKERS)
+_STREAM_TABLE_SIZE = _COUNTS.size
+
+
+class StreamSlots:
+    """
+    Caps concurrent streams across all worker processes.
+    Every worker owns one open-stream counter in a small mmap'ed table (claimed with an flock
+    like WorkerCounters, and reset by the worker that takes it over: the streams of a dead
+    worker died with it). Opening a stream sums the table and bumps this worker's counter
+    under a single flock of the table file.
+    """
+
+    def __init__(self, path, max_slots=STREAM_MAX_CONNECTIONS):
+        self.path = path
+        self.max_slots = max_slots
+        self._fd = None
+        self._mm = None
+        self._offset = None
+        self._slot_fd = None
+        self._lock = threading.Lock() # flock doesn't exclude threads sharing the descriptor
+
+    def attach(self):
+        """Maps the table and claims this worker's counter (streams are refused if none is free)."""
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != _STREAM_TABLE_SIZE:
+                os.ftruncate(self._fd, _STREAM_TABLE_SIZE)
+            self._mm = mmap.mmap(self._fd, _STREAM_TABLE_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            for slot in range(MAX_WORKERS):
+                slot_fd = os.open(f"{self.path}.worker{slot}", os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(slot_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(slot_fd)
+                    continue
+                self._slot_fd = slot_fd
+                self._offset = slot * _COUNT.size
+                _COUNT.pack_into(self._mm, self._offset, 0) # Left over by a worker that died
+                return
+            print(f"Warning: No free stream counter in {self.path}; this worker won't open streams.")
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def acquire(self, max_slots=None):
+        """Takes a stream slot; returns False when `max_slots` (default self.max_slots) streams are already open."""
+        if self._offset is None:
+            return False
+        limit = self.max_slots if max_slots is None else max_slots
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if sum(_COUNTS.unpack_from(self._mm, 0)) >= limit:
+                    return False
+                _COUNT.pack_into(self._mm, self._offset, _COUNT.unpack_from(self._mm, self._offset)[0] + 1)
+                return True
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def release(self):
+        """Gives back a slot taken by acquire()."""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                count = _COUNT.unpack_from(self._mm, self._offset)[0]
+                _COUNT.pack_into(self._mm, self._offset, max(count - 1, 0))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def open_streams(self):
+        """Streams open across all workers."""
+        return sum(_COUNTS.unpack_from(self._mm, 0)) if self._mm is not None else 0
+
+
+def format_event(data, event=None):
+    """Serializes one SSE event."""
+    message = f"event: {event}\n" if event else ""
+    return f"{message}data: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def changed_fields(previous, current):
+    """Returns the entries of `current` whose value differs from `previous`."""
+    return {key: value for key, value in current.items() if previous.get(key, object()) != value}
+
+
+class _StateStream:
+    """What a stream sends on each tick: changed fields, keepalives, nothing at all."""
+
+    def __init__(self, read_state, read_version, max_lifetime):
+        self.read_state = read_state
+        self.read_version = read_version
+        self.max_lifetime = max_lifetime
+        self.sent = {}
+        self.last_version = None
+        self.started = self.last_write = time.monotonic()
+
+    def alive(self):
+        return time.monotonic() - self.started < self.max_lifetime
+
+    def tick(self):
+        """Returns the text to send now, or None."""
+        version = self.read_version()
+        if version != self.last_version:
+            self.last_version = version
+            delta = changed_fields(self.sent, self.read_state())
+            if delta:
+                self.sent.update(delta)
+                self.last_write = time.monotonic()
+                return format_event(delta, event="metrics")
+        if time.monotonic() - self.last_write >= STREAM_KEEPALIVE_INTERVAL:
+            self.last_write = time.monotonic()
+            return ": keepalive\n\n"
+        return None
+
+
+def stream_state(read_state, read_version, max_lifetime=STREAM_MAX_LIFETIME, poll_interval=STREAM_POLL_INTERVAL):
+    """
+    Generator producing the SSE stream.
+    `read_version()` is a cheap change indicator (e.g. the shared metrics sequence number);
+    `read_state()` is only called when it moves, and returns a flat dict of fields.
+    The stream ends after `max_lifetime` seconds so EventSource reconnects and re-authenticates.
+    """
+    yield f"retry: {STREAM_RETRY_MS}\n\n"
+    stream = _StateStream(read_state, read_version, max_lifetime)
+    while stream.alive():
+        event = stream.tick()
+        if event:
+            yield event
+        time.sleep(poll_interval)
+
+
+async def stream_state_async(read_state, read_version, max_lifetime=STREAM_MAX_LIFETIME, poll_interval=STREAM_POLL_INTERVAL):
+    """stream_state() as an async generator; both callbacks must be cheap (shared memory reads)."""
+    yield f"retry: {STREAM_RETRY_MS}\n\n"
+    stream = _StateStream(read_state, read_version, max_lifetime)
+    while stream.alive():
+        event = stream.tick()
+        if event:
+            yield event
+        await asyncio.sleep(poll_interval)
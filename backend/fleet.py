@@ -0,0 +1,340 @@
+# backend/fleet.py
+"""
+Fleet aggregation: one SysPilot instance fanning out to many nodes.
+Requests to the nodes run on an asyncio event loop in a background thread of each worker,
+over small per-node pools of keep-alive HTTP/1.1 connections (plain asyncio streams, no
+client library). All nodes are queried concurrently with a per-node timeout, so a fleet
+view costs about as much as its slowest healthy node; a node that doesn't answer in time
+is reported with its last known state. Concurrent views share in-flight node requests.
+Actions are broadcast the same way, with bounded concurrency, and each node's result is
+handed back as soon as it arrives.
+"""
+import asyncio
+import json
+import os
+import queue
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+FLEET_NODE_TIMEOUT = float(os.getenv("FLEET_NODE_TIMEOUT", "2.0"))
+FLEET_CACHE_TTL = float(os.getenv("FLEET_CACHE_TTL", "1.0"))
+FLEET_POOL_SIZE = int(os.getenv("FLEET_POOL_SIZE", "4"))
+MAX_RESPONSE_BYTES = 4 * 1024 * 1024
+NODE_STATUS_PATH = "/api/node/status"
+NODE_ACTION_PATH = "/api/node/action/"
+FLEET_BROADCAST_CONCURRENCY = int(os.getenv("FLEET_BROADCAST_CONCURRENCY", "8"))
+RETRY_DELAY = 0.5
+# Answers worth retrying an idempotent action on (the node or a proxy was overloaded)
+RETRY_STATUSES = (502, 503, 504)
+
+
+class NodeError(Exception):
+    """A node answered with an error, or not with HTTP at all."""
+
+
+def parse_node_url(url):
+    """Splits and validates a node base URL (http or https). Raises ValueError."""
+    parts = urlsplit(url) if isinstance(url, str) else None
+    if parts is None or parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Invalid node URL: {url}")
+    return parts
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class NodePool:
+    """Keep-alive HTTP/1.1 connections to one node, at most `size` of them in use at once."""
+
+    def __init__(self, base_url, size=FLEET_POOL_SIZE):
+        parts = parse_node_url(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.base_path = parts.path.rstrip("/")
+        self.host_header = parts.netloc
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.size = size
+
+    async def request(self, method, path, token=None, body=None):
+        """Returns (status, parsed JSON body). Retries once if a reused connection went stale."""
+        async with self._slots:
+            for attempt in range(2):
+                reused = bool(self._idle)
+                connection = self._idle.pop() if reused else await self._open()
+                keep = False
+                try:
+                    status, data, keep = await self._exchange(connection, method, path, token, body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if reused and attempt == 0:
+                        continue # The node closed an idle connection; try a fresh one
+                    raise
+                finally:
+                    if keep and len(self._idle) < self.size:
+                        self._idle.append(connection)
+                    else:
+                        connection.close()
+                try:
+                    return status, json.loads(data) if data else None
+                except ValueError:
+                    raise NodeError(f"Invalid JSON from node (HTTP {status})")
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        return _Connection(reader, writer)
+
+    async def _exchange(self, connection, method, path, token, body):
+        payload = json.dumps(body).encode() if body is not None else b""
+        lines = [
+            f"{method} {self.base_path}{path} HTTP/1.1",
+            f"Host: {self.host_header}",
+            "Connection: keep-alive",
+            "Accept: application/json",
+            f"Content-Length: {len(payload)}",
+        ]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        if token:
+            lines.append(f"Authorization: Bearer {token}")
+        connection.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+        await connection.writer.drain()
+
+        reader = connection.reader
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the node")
+        parts = status_line.decode("latin-1").split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise NodeError("Not an HTTP response")
+        version, status = parts[0], int(parts[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            size = 0
+            while True:
+                chunk_size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if chunk_size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass # Trailers
+                    break
+                size += chunk_size
+                if size > MAX_RESPONSE_BYTES:
+                    raise NodeError("Response too large")
+                chunks.append(await reader.readexactly(chunk_size))
+                await reader.readexactly(2)
+            data = b"".join(chunks)
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if length > MAX_RESPONSE_BYTES:
+                raise NodeError("Response too large")
+            data = await reader.readexactly(length)
+        else:
+            data = await reader.read(MAX_RESPONSE_BYTES)
+            keep = False # Body delimited by the end of the connection
+        return status, data, keep
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+class FleetAggregator:
+    """Concurrent, cached status of the registered nodes. Thread-safe entry points."""
+
+    def __init__(self, timeout=FLEET_NODE_TIMEOUT, cache_ttl=FLEET_CACHE_TTL, pool_size=FLEET_POOL_SIZE):
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._pools = {} # url -> NodePool (only touched from the loop thread)
+        self._inflight = {}
+        self._states = {} # name -> last successful status: (monotonic time, unix time, data)
+
+    def _get_loop(self):
+        # The loop thread doesn't survive fork: each worker process starts its own
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="fleet-loop", daemon=True).start()
+                self._loop = loop
+                self._pid = os.getpid()
+                self._pools = {}
+                self._inflight = {}
+            return self._loop
+
+    def run(self, coroutine, timeout):
+        """Runs a coroutine on the fleet loop and waits for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result(timeout)
+
+    def pool(self, node):
+        """The connection pool of a node (call from the loop)."""
+        pool = self._pools.get(node["url"])
+        if pool is None:
+            pool = self._pools[node["url"]] = NodePool(node["url"], self.pool_size)
+        return pool
+
+    def status(self, nodes, registered=None):
+        """
+        Returns one entry per node: name, url, state ('ok', 'stale' or 'down'), source, latency_ms,
+        updated_at (unix time of the data), error and data (the node's /api/node/status).
+        Connections are kept for the `registered` nodes (default: `nodes`) and closed for the others.
+        """
+        return self.run(self._status_all(nodes, registered or nodes), self.timeout + 5)
+
+    async def _status_all(self, nodes, registered):
+        urls = {node["url"] for node in registered}
+        for url in [url for url in self._pools if url not in urls]:
+            self._pools.pop(url).close() # Node removed from the registry
+        return await asyncio.gather(*(self._node_status(node) for node in nodes))
+
+    async def _node_status(self, node):
+        name = node["name"]
+        entry = {"name": name, "url": node["url"], "state": "down", "source": "pull", "latency_ms": None,
+                 "updated_at": None, "error": None, "data": None}
+        cached = self._states.get(name)
+        if cached and time.monotonic() - cached[0] < self.cache_ttl:
+            entry.update(state="ok", updated_at=cached[1], data=cached[2])
+            return entry
+
+        # Single-flight: concurrent views wait for the same request to the node
+        task = self._inflight.get(name)
+        if task is None:
+            task = self._inflight[name] = asyncio.ensure_future(self._fetch_status(node))
+            task.add_done_callback(lambda done: self._forget(name, done))
+        started = time.monotonic()
+        try:
+            data = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            entry["error"] = f"No answer within {self.timeout:g}s"
+        except Exception as e:
+            entry["error"] = str(e) or e.__class__.__name__
+        else:
+            self._states[name] = cached = (time.monotonic(), time.time(), data)
+            entry.update(state="ok", latency_ms=round((time.monotonic() - started) * 1000, 1))
+        if cached:
+            entry.update(updated_at=cached[1], data=cached[2])
+            if entry["state"] != "ok":
+                entry["state"] = "stale"
+        return entry
+
+    def _forget(self, name, task):
+        self._inflight.pop(name, None)
+        if not task.cancelled():
+            task.exception() # Retrieved here: every waiter may have timed out already
+
+    async def _fetch_status(self, node):
+        # Bounded on its own too: the callers only wait on it through shield()
+        status, body = await asyncio.wait_for(
+            self.pool(node).request("GET", NODE_STATUS_PATH, token=node.get("token")), self.timeout
+        )
+        if status != 200 or not isinstance(body, dict) or not body.get("success"):
+            message = body.get("message") if isinstance(body, dict) else None
+            raise NodeError(f"HTTP {status}" + (f": {message}" if message else ""))
+        return body["node"]
+
+    def broadcast(self, nodes, action, params, concurrency=FLEET_BROADCAST_CONCURRENCY, timeout=None, retries=0, deadline=None):
+        """
+        Runs `action` with `params` on every node, at most `concurrency` at a time, and yields
+        one result per node as soon as it's known: node, success, status, message, attempts,
+        elapsed_ms. `retries` extra attempts are made after transport errors or overload
+        answers, so it must stay 0 for actions that aren't idempotent.
+        `deadline` (a time.monotonic() value) bounds the whole broadcast: the nodes that haven't
+        answered by then are reported as timed out and their requests are abandoned.
+        """
+        results = queue.Queue()
+        future = self._start_broadcast(nodes, action, params, concurrency, timeout, retries, results.put)
+        unanswered = [node["name"] for node in nodes]
+        try:
+            for _ in nodes:
+                try:
+                    result = results.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                unanswered.remove(result["node"])
+                yield result
+            for name in unanswered:
+                yield {
+                    "node": name, "success": False, "status": "timeout", "attempts": None, "elapsed_ms": None,
+                    "message": "No answer before the broadcast's deadline; the action may still run on the node"
+                }
+        finally:
+            future.cancel() # The client went away: stop dispatching to the remaining nodes
+
+    async def broadcast_async(self, nodes, action, params, concurrency=FLEET_BROADCAST_CONCURRENCY, timeout=None, retries=0):
+        """broadcast() as an async generator, for a caller running its own event loop."""
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue()
+        future = self._start_broadcast(
+            nodes, action, params, concurrency, timeout, retries,
+            lambda result: loop.call_soon_threadsafe(results.put_nowait, result)
+        )
+        try:
+            for _ in nodes:
+                yield await results.get()
+        finally:
+            future.cancel()
+
+    def _start_broadcast(self, nodes, action, params, concurrency, timeout, retries, emit):
+        return asyncio.run_coroutine_threadsafe(
+            self._broadcast(nodes, action, params, concurrency, timeout or self.timeout, retries, emit), self._get_loop()
+        )
+
+    async def _broadcast(self, nodes, action, params, concurrency, timeout, retries, emit):
+        slots = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(self._dispatch(node, action, params, timeout, retries, slots, emit) for node in nodes))
+
+    async def _dispatch(self, node, action, params, timeout, retries, slots, emit):
+        result = {"node": node["name"], "success": False, "status": "error", "message": None, "attempts": 0, "elapsed_ms": None}
+        started = None
+        try:
+            while True:
+                result["attempts"] += 1
+                retry = False
+                async with slots: # Not held while backing off, so a dead node doesn't block the others
+                    started = started or time.monotonic()
+                    try:
+                        status, body = await asyncio.wait_for(
+                            self.pool(node).request("POST", NODE_ACTION_PATH + action, token=node.get("token"), body=params), timeout
+                        )
+                    except asyncio.TimeoutError:
+                        result.update(status="timeout", message=f"No answer within {timeout:g}s")
+                        retry = True
+                    except (OSError, asyncio.IncompleteReadError, NodeError) as e:
+                        result.update(status="error", message=str(e) or e.__class__.__name__)
+                        retry = True
+                    else:
+                        body = body if isinstance(body, dict) else {}
+                        result.update(
+                            success=bool(body.get("success")), status=body.get("status") or f"http_{status}",
+                            message=body.get("message"), job_id=body.get("job_id")
+                        )
+                        retry = status in RETRY_STATUSES
+                if not retry or result["attempts"] > retries:
+                    break
+                await asyncio.sleep(RETRY_DELAY * result["attempts"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result.update(status="error", message=str(e) or e.__class__.__name__)
+        if started is not None:
+            result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+        emit(result)
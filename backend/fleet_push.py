@@ -0,0 +1,324 @@
+# backend/fleet_push.py
+"""
+Push protocol between SysPilot agents and a fleet collector.
+An agent keeps one TCP connection to the collector and pushes its node status every
+sampling interval, in batches. Each update only carries the fields that changed since the
+previous one (nested fields are flattened to dotted keys) under a sequence number, and each
+direction of the connection is one zlib stream, so repeated field names cost almost nothing.
+A collector that sees a gap in the sequence asks for a full snapshot and ignores deltas
+until it gets one. The collector keeps the latest state of each node in memory and hands it
+to `publish()` for the workers. Nothing is queued while disconnected: a reconnecting agent
+starts over with a snapshot, and the collector holds one connection per registered node.
+"""
+import asyncio
+import json
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+import zlib
+
+PROTOCOL_VERSION = 1
+_LENGTH = struct.Struct(">I")
+MAX_FRAME_BYTES = 256 * 1024 # Compressed
+MAX_MESSAGE_BYTES = 1024 * 1024 # Decompressed
+PUSH_BATCH_INTERVAL = float(os.getenv("FLEET_PUSH_INTERVAL", "5.0"))
+MAX_BATCH_UPDATES = 64
+HELLO_TIMEOUT = 5.0
+IDLE_TIMEOUT = 60.0 # An agent sends a batch every PUSH_BATCH_INTERVAL, even without changes
+MAX_HANDSHAKES = 32 # Connections being authenticated at once; more are refused right away
+PUBLISH_INTERVAL = 0.5
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+STABLE_SESSION_SECONDS = 30.0
+
+
+class ProtocolError(Exception):
+    """The peer sent something that isn't a valid message of the protocol."""
+
+
+def parse_collector_address(address):
+    """"host:port" -> (host, port). Raises ValueError."""
+    host, _, port = (address or "").rpartition(":")
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"Invalid collector address (expected host:port): {address}")
+    return host.strip("[]"), int(port)
+
+
+def flatten(document, prefix=""):
+    """{'audio': {'level': 40}} -> {'audio.level': 40}; lists, scalars and empty dicts are leaves."""
+    fields = {}
+    for key, value in document.items():
+        if isinstance(value, dict) and value:
+            fields.update(flatten(value, f"{prefix}{key}."))
+        else:
+            fields[prefix + key] = value
+    return fields
+
+
+def unflatten(fields):
+    document = {}
+    for key, value in fields.items():
+        *parents, leaf = key.split(".")
+        node = document
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = value
+    return document
+
+
+def diff(previous, current):
+    """(changed fields, removed keys) that turn `previous` into `current`."""
+    changed = {key: value for key, value in current.items() if key not in previous or previous[key] != value}
+    return changed, [key for key in previous if key not in current]
+
+
+class FrameCodec:
+    """Length-prefixed JSON messages, compressed as one zlib stream per direction."""
+
+    def __init__(self):
+        self._compressor = zlib.compressobj()
+        self._decompressor = zlib.decompressobj()
+
+    def encode(self, message):
+        data = self._compressor.compress(json.dumps(message, separators=(",", ":")).encode())
+        data += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return _LENGTH.pack(len(data)) + data
+
+    def frame_length(self, header):
+        length = _LENGTH.unpack(header)[0]
+        if length > MAX_FRAME_BYTES:
+            raise ProtocolError(f"Frame too large ({length} bytes)")
+        return length
+
+    def decode(self, payload):
+        try:
+            data = self._decompressor.decompress(payload, MAX_MESSAGE_BYTES)
+            if self._decompressor.unconsumed_tail:
+                raise ProtocolError("Message too large")
+            message = json.loads(data)
+        except (zlib.error, ValueError):
+            raise ProtocolError("Invalid message")
+        if not isinstance(message, dict):
+            raise ProtocolError("Invalid message")
+        return message
+
+
+class PushAgent:
+    """
+    Pushes `read_status()` to the collector at `address` every `interval` seconds, in batches
+    sent every `batch_interval` seconds. Runs in a daemon thread of the metrics leader.
+    """
+
+    def __init__(self, address, node, token, read_status, interval, batch_interval=PUSH_BATCH_INTERVAL):
+        self.address = parse_collector_address(address)
+        self.node = node
+        self.token = token
+        self.read_status = read_status
+        self.interval = interval
+        self.batch_interval = max(batch_interval, interval)
+        self.seq = 0
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name="fleet-agent", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                self._session()
+            except (OSError, ProtocolError) as e:
+                print(f"Warning: Fleet agent disconnected from {self.address[0]}:{self.address[1]}: {e}")
+            if time.monotonic() - started >= STABLE_SESSION_SECONDS:
+                delay = RECONNECT_MIN_DELAY
+            # Full jitter: agents of a restarted collector don't all come back at the same moment
+            self._stopped.wait(random.uniform(0, delay))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def _receive(self, sock, codec):
+        header = self._receive_exactly(sock, _LENGTH.size)
+        return codec.decode(self._receive_exactly(sock, codec.frame_length(header)))
+
+    def _receive_exactly(self, sock, size):
+        data = b""
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed by the collector")
+            data += chunk
+        return data
+
+    def _session(self):
+        codec = FrameCodec()
+        with socket.create_connection(self.address, timeout=HELLO_TIMEOUT) as sock:
+            sock.sendall(codec.encode({"type": "hello", "version": PROTOCOL_VERSION, "node": self.node, "token": self.token}))
+            reply = self._receive(sock, codec)
+            if reply.get("type") != "welcome":
+                raise ProtocolError(reply.get("message") or "Handshake refused")
+            print(f"Fleet agent connected to {self.address[0]}:{self.address[1]} as '{self.node}'.")
+
+            sent = None # Fields as of the last update; None makes the next update a full snapshot
+            batch = []
+            next_sample = next_flush = time.monotonic()
+            while not self._stopped.is_set():
+                now = time.monotonic()
+                if now >= next_sample:
+                    next_sample = max(next_sample + self.interval, now)
+                    try:
+                        fields = flatten(self.read_status())
+                    except Exception as e:
+                        print(f"Warning: Fleet agent could not read the node status: {e}")
+                    else:
+                        self.seq += 1
+                        if sent is None:
+                            batch = [{"seq": self.seq, "full": True, "fields": fields}] # Supersedes pending deltas
+                        else:
+                            changed, removed = diff(sent, fields)
+                            batch.append(dict({"seq": self.seq, "fields": changed}, **({"removed": removed} if removed else {})))
+                        sent = fields
+                if batch and (now >= next_flush or len(batch) >= MAX_BATCH_UPDATES):
+                    sock.sendall(codec.encode({"type": "updates", "updates": batch}))
+                    batch = []
+                    next_flush = now + self.batch_interval
+
+                # Sleep until the next sample, waking up for messages from the collector
+                readable, _, _ = select.select([sock], [], [], max(0.0, next_sample - time.monotonic()))
+                if readable:
+                    message = self._receive(sock, codec)
+                    if message.get("type") == "resync":
+                        sent = None
+                        next_sample = next_flush = time.monotonic()
+                    elif message.get("type") == "error":
+                        raise ProtocolError(message.get("message") or "Refused by the collector")
+
+
+class PushCollector:
+    """
+    Accepts agent connections on `port` and keeps the latest state of every node in memory.
+    `authenticate(node, token)` checks a hello (called in a thread); `publish(document)` gets
+    {node: {'connected', 'seq', 'updated_at', 'gaps', 'data'}} at most every PUBLISH_INTERVAL.
+    """
+
+    def __init__(self, port, authenticate, publish, host="0.0.0.0"):
+        self.host = host
+        self.port = port
+        self.authenticate = authenticate
+        self.publish = publish
+        self._nodes = {} # name -> state (only touched from the collector loop)
+        self._connections = {} # name -> writer of its current connection
+        self._handshakes = 0
+        self._dirty = None
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self._serve()), name="fleet-collector", daemon=True).start()
+
+    async def _serve(self):
+        self._dirty = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            print(f"Warning: Fleet collector could not listen on port {self.port}: {e}")
+            return
+        print(f"Fleet collector listening on port {self.port}.")
+        async with server:
+            await self._publish_loop()
+
+    async def _publish_loop(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            document = {}
+            for name, state in self._nodes.items():
+                if state["document"] is None and state["fields"]:
+                    state["document"] = unflatten(state["fields"])
+                document[name] = {
+                    "connected": name in self._connections, "seq": state["seq"],
+                    "updated_at": state["updated_at"], "gaps": state["gaps"], "data": state["document"],
+                }
+            try:
+                await asyncio.to_thread(self.publish, document)
+            except Exception as e:
+                print(f"Warning: Fleet collector could not publish the node states: {e}")
+            await asyncio.sleep(PUBLISH_INTERVAL)
+
+    async def _receive(self, reader, codec):
+        header = await reader.readexactly(_LENGTH.size)
+        return codec.decode(await reader.readexactly(codec.frame_length(header)))
+
+    async def _handle(self, reader, writer):
+        if self._handshakes >= MAX_HANDSHAKES:
+            writer.close() # Reconnect storm: the agent comes back after its backoff
+            return
+        codec = FrameCodec()
+        self._handshakes += 1
+        try:
+            hello = await asyncio.wait_for(self._receive(reader, codec), HELLO_TIMEOUT)
+            name = hello.get("node")
+            if (hello.get("type") != "hello" or hello.get("version") != PROTOCOL_VERSION or not isinstance(name, str)
+                    or not await asyncio.to_thread(self.authenticate, name, hello.get("token"))):
+                writer.write(codec.encode({"type": "error", "message": "Unknown node, invalid token or unsupported version."}))
+                await writer.drain()
+                writer.close()
+                return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ProtocolError):
+            writer.close()
+            return
+        finally:
+            self._handshakes -= 1
+
+        previous = self._connections.get(name)
+        if previous is not None:
+            previous.close() # The agent reconnected; its old connection is dead or about to be
+        self._connections[name] = writer
+        state = self._nodes.setdefault(name, {"fields": {}, "document": None, "seq": None, "updated_at": None, "gaps": 0})
+        synced = False # Deltas only apply on top of a snapshot received on this connection
+        resync_requested = False
+        writer.write(codec.encode({"type": "welcome", "version": PROTOCOL_VERSION}))
+        self._dirty.set()
+        try:
+            while self._connections.get(name) is writer:
+                message = await asyncio.wait_for(self._receive(reader, codec), IDLE_TIMEOUT)
+                updates = message.get("updates")
+                if message.get("type") != "updates" or not isinstance(updates, list) or self._connections.get(name) is not writer:
+                    break
+                for update in updates:
+                    if not isinstance(update, dict) or not isinstance(update.get("seq"), int) or not isinstance(update.get("fields"), dict):
+                        raise ProtocolError("Invalid update")
+                    if update.get("full"):
+                        state["fields"] = dict(update["fields"])
+                        synced, resync_requested = True, False
+                    elif synced and update["seq"] == state["seq"] + 1:
+                        state["fields"].update(update["fields"])
+                        for key in update.get("removed") or ():
+                            state["fields"].pop(key, None)
+                    else:
+                        # Gap: every delta up to the next snapshot is useless
+                        if synced:
+                            state["gaps"] += 1
+                        synced = False
+                        if not resync_requested:
+                            resync_requested = True
+                            writer.write(codec.encode({"type": "resync", "seq": state["seq"]}))
+                        continue
+                    state["seq"] = update["seq"]
+                    state["document"] = None
+                if synced:
+                    state["updated_at"] = time.time()
+                    self._dirty.set()
+                await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ProtocolError) as e:
+            if self._connections.get(name) is writer:
+                print(f"Fleet agent '{name}' disconnected: {e.__class__.__name__} {e}".rstrip())
+        finally:
+            if self._connections.get(name) is writer:
+                del self._connections[name]
+                self._dirty.set()
+            writer.close()
@@ -0,0 +1,53 @@
+# backend/http_metrics.py
+"""
+HTTP request counters and latency histograms per Flask route, shared by all workers
+through a WorkerCounters table (one slot per worker, summed on scrape).
+"""
+from worker_counters import WorkerCounters
+
+MAGIC = b"SPR2"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+UNMATCHED_ROUTE = "unmatched"
+
+# Per route: one counter per status class, one per latency bucket (+Inf is the total), latency sum
+_VALUES_PER_ROUTE = len(STATUS_CLASSES) + len(LATENCY_BUCKETS) + 1
+
+
+class HTTPMetrics:
+    """Cross-worker request counters for a fixed list of routes."""
+
+    def __init__(self, path, routes):
+        self.routes = sorted(set(routes) | {UNMATCHED_ROUTE})
+        self._route_index = {route: index for index, route in enumerate(self.routes)}
+        self._counters = WorkerCounters(path, len(self.routes) * _VALUES_PER_ROUTE, MAGIC)
+
+    def attach(self):
+        self._counters.attach()
+
+    def observe(self, route, status_code, duration):
+        """Counts one request in this worker's slot."""
+        base = self._route_index.get(route, self._route_index[UNMATCHED_ROUTE]) * _VALUES_PER_ROUTE
+        status_index = min(max(status_code // 100, 1), 5) - 1
+        increments = [(base + status_index, 1)]
+        for bucket_index, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                increments.append((base + len(STATUS_CLASSES) + bucket_index, 1))
+        increments.append((base + _VALUES_PER_ROUTE - 1, duration))
+        self._counters.add(increments)
+
+    def snapshot(self):
+        """
+        Sums every worker slot. Returns {route: (status_counts, bucket_counts, latency_sum)}
+        for the routes that have seen at least one request.
+        """
+        totals = self._counters.totals()
+        result = {}
+        for route_index, route in enumerate(self.routes):
+            route_totals = totals[route_index * _VALUES_PER_ROUTE:(route_index + 1) * _VALUES_PER_ROUTE]
+            status_counts = route_totals[:len(STATUS_CLASSES)]
+            if not any(status_counts):
+                continue
+            bucket_counts = route_totals[len(STATUS_CLASSES):_VALUES_PER_ROUTE - 1]
+            result[route] = (status_counts, bucket_counts, route_totals[-1])
+        return result
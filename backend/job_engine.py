@@ -0,0 +1,382 @@
+# backend/job_engine.py
+"""
+Asynchronous execution of system actions.
+An action is submitted to a small per-worker thread pool and gets a job ID right away, so a
+hanging command never pins the request that started it. Job records (status, result, PID of
+the running child) are JSON files in a directory shared by all workers: any worker can answer
+/api/jobs/<id> or cancel a job, whichever worker happens to run it.
+Commands that only need their latest value applied (the volume slider) are coalesced:
+while one runs, newer submissions replace the pending value instead of queuing more
+processes, and every job covered by a run completes with the value that run applied.
+Cancelling one job of such a run only detaches it; the process is killed once every job
+sharing it was cancelled.
+"""
+import asyncio
+import fcntl
+import json
+import os
+import re
+import secrets
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "32"))
+# Finished jobs are kept this many seconds for status polling
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "600"))
+PRUNE_INTERVAL = 60.0
+# Polling interval bounds of wait()
+WAIT_MIN_DELAY = 0.01
+WAIT_MAX_DELAY = 0.2
+
+FINAL_STATUSES = ("succeeded", "failed", "timeout", "cancelled")
+_JOB_ID = re.compile(r"[0-9a-f]{16}")
+
+
+class JobQueueFull(Exception):
+    """More actions are queued in this worker than JOB_QUEUE_LIMIT allows."""
+
+
+class JobStore:
+    """Job records as one JSON file each; updates are serialized by an flock on the directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".lock")
+        self._last_prune = 0.0
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write_json(self, path, data):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path) # Readers never see a half-written file
+
+    def _write(self, record):
+        self._write_json(self._path(record["id"]), record)
+
+    @contextmanager
+    def locked(self):
+        """Holds the store lock; use the *_locked methods inside it."""
+        lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(lock_fd)
+
+    def get(self, job_id):
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def create(self, record):
+        self._write(record)
+
+    def update(self, job_id, change):
+        """
+        Applies `change(record)`, which returns the fields to update or None to leave the record
+        as it is, under the store lock. Returns the updated record, or None if nothing changed.
+        """
+        with self.locked():
+            return self.update_locked(job_id, change)
+
+    def update_locked(self, job_id, change):
+        record = self.get(job_id)
+        if record is None:
+            return None
+        fields = change(record)
+        if fields is None:
+            return None
+        record.update(fields)
+        self._write(record)
+        return record
+
+    def read_slot_locked(self, action):
+        """Coalescing slot of `action`: {'value', 'context', 'jobs': [pending job IDs]}."""
+        try:
+            with open(os.path.join(self.directory, f"{action}.latest")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"value": None, "context": None, "jobs": []}
+
+    def write_slot_locked(self, action, slot):
+        self._write_json(os.path.join(self.directory, f"{action}.latest"), slot)
+
+    def claim_drainer(self, action):
+        """
+        Returns an fd holding the drainer lock of `action`, or None while another thread or worker
+        holds it. The lock is an flock: it lasts until the fd is closed, and the kernel drops it
+        if the drainer's worker dies, so a dead (or reused) PID can't keep the slot owned.
+        """
+        fd = os.open(os.path.join(self.directory, f"{action}.drain"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except BlockingIOError:
+            os.close(fd)
+            return None
+
+    def prune(self, now):
+        """Deletes finished jobs older than JOB_RETENTION (at most once per PRUNE_INTERVAL)."""
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            record = self.get(name[:-5])
+            if record and record["status"] in FINAL_STATUSES and now - (record["finished_at"] or 0) > JOB_RETENTION:
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+class JobEngine:
+    """Bounded per-worker executor for action jobs."""
+
+    def __init__(self, store, max_workers=JOB_WORKERS, queue_limit=JOB_QUEUE_LIMIT):
+        self.store = store
+        self.max_workers = max_workers
+        self._slots = threading.BoundedSemaphore(max_workers + queue_limit)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Threads don't survive fork: each worker process gets its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="action-job")
+                self._pid = os.getpid()
+            return self._executor
+
+    def _new_record(self, action, user):
+        return {
+            "id": secrets.token_hex(8), "action": action, "user": user, "status": "queued",
+            "submitted_at": time.time(), "started_at": None, "finished_at": None,
+            "pid": None, "batch": None, "cancel_requested": False, "result": None,
+        }
+
+    def submit(self, action, run, user):
+        """
+        Queues `run(on_spawn)`, which must return a {'success', 'message'} dict and call
+        `on_spawn(process)` once the child process exists. Returns the new job record.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull()
+        record = self._new_record(action, user)
+        try:
+            self.store.create(record)
+            self._get_executor().submit(self._run, record["id"], run)
+        except Exception:
+            self._slots.release()
+            raise
+        return record
+
+    def submit_latest(self, action, value, run, user, context=None):
+        """
+        Like submit(), but latest-wins per `action`: `run(value, context, on_spawn)` is executed by
+        a single drainer across all workers, always with the newest pending value and context, and
+        each run completes every job submitted since the previous one. `context` (JSON-serializable,
+        e.g. the command and its timeout) is stored with the value, so a command edited mid-burst
+        is what the next run executes. Returns the new job record.
+        """
+        record = self._new_record(action, user)
+        record["value"] = value
+        with self.store.locked():
+            self.store.create(record)
+            slot = self.store.read_slot_locked(action)
+            slot["value"] = value
+            slot["context"] = context
+            slot["jobs"].append(record["id"])
+            # None: a drainer is running and picks the job up before it stops
+            drain_fd = self.store.claim_drainer(action)
+            if drain_fd is not None and not self._slots.acquire(blocking=False):
+                os.close(drain_fd)
+                slot["jobs"].remove(record["id"])
+                self.store.write_slot_locked(action, slot)
+                self.store.update_locked(record["id"], lambda job: {
+                    "status": "failed", "finished_at": time.time(),
+                    "result": {"success": False, "message": "Too many actions in progress."},
+                })
+                raise JobQueueFull()
+            self.store.write_slot_locked(action, slot)
+        if drain_fd is not None:
+            try:
+                self._get_executor().submit(self._drain, action, run, drain_fd)
+            except Exception:
+                os.close(drain_fd)
+                self._slots.release()
+                raise
+        return record
+
+    def _drain(self, action, run, drain_fd):
+        """Runs the pending value of `action` until its slot is empty, holding the drainer lock `drain_fd`."""
+        try:
+            while True:
+                with self.store.locked():
+                    slot = self.store.read_slot_locked(action)
+                    if not slot["jobs"]:
+                        # Released under the store lock: a submitter either queued its job before
+                        # this check, or finds the lock free and starts the next drainer
+                        os.close(drain_fd)
+                        drain_fd = None
+                        return
+                    value, context, batch = slot["value"], slot.get("context"), slot["jobs"]
+                    slot["jobs"] = []
+                    self.store.write_slot_locked(action, slot)
+                    started = {"status": "running", "started_at": time.time(), "batch": batch}
+                    job_ids = [
+                        job_id for job_id in batch
+                        if self.store.update_locked(job_id, lambda record: started if record["status"] == "queued" else None)
+                    ]
+                if job_ids: # Otherwise every pending job was cancelled while queued
+                    self._execute(job_ids, lambda on_spawn: run(value, context, on_spawn), value)
+        except Exception as e:
+            print(f"Coalesced action {action} error: {e}")
+        finally:
+            if drain_fd is not None:
+                os.close(drain_fd)
+            self._slots.release()
+            try:
+                self.store.prune(time.time())
+            except OSError as e:
+                print(f"Warning: Could not prune action jobs: {e}")
+
+    def _run(self, job_id, run):
+        try:
+            started = self.store.update(
+                job_id, lambda record: {"status": "running", "started_at": time.time()} if record["status"] == "queued" else None
+            )
+            if started is None:
+                return # Cancelled while queued
+            self._execute([job_id], run)
+        except Exception as e:
+            print(f"Action job {job_id} error: {e}")
+        finally:
+            self._slots.release()
+            try:
+                self.store.prune(time.time())
+            except OSError as e:
+                print(f"Warning: Could not prune action jobs: {e}")
+
+    def _execute(self, job_ids, run, value=None):
+        """Runs the command of running jobs `job_ids` (one process for all) and records the outcome."""
+        def on_spawn(process):
+            for job_id in job_ids:
+                self.store.update(job_id, lambda record: {"pid": process.pid} if record["status"] == "running" else None)
+            if all(self.store.get(job_id).get("cancel_requested") for job_id in job_ids):
+                _terminate(process.pid) # Cancelled between start and spawn
+
+        try:
+            result = run(on_spawn)
+        except Exception as e:
+            result = {"success": False, "message": f"An unexpected error occurred: {str(e)}"}
+
+        def finish(record):
+            if record["status"] in FINAL_STATUSES:
+                return None # Detached from the run by a cancel
+            if record["cancel_requested"]:
+                status = "cancelled"
+            elif result.get("timed_out"):
+                status = "timeout"
+            else:
+                status = "succeeded" if result["success"] else "failed"
+            outcome = {"success": result["success"], "message": result["message"]}
+            if value is not None:
+                outcome["value"] = value # The value actually applied, which may be newer than the job's own
+            return {"status": status, "finished_at": time.time(), "pid": None, "result": outcome}
+
+        for job_id in job_ids:
+            self.store.update(job_id, finish)
+
+    def wait(self, job_ids, timeout):
+        """
+        Waits until every job in `job_ids` is finished, or `timeout` seconds passed.
+        Returns {job_id: record}; jobs may run in any worker, so the store is polled.
+        """
+        deadline = time.monotonic() + timeout
+        delay = WAIT_MIN_DELAY
+        while True:
+            records = {job_id: self.store.get(job_id) for job_id in job_ids}
+            if all(record is None or record["status"] in FINAL_STATUSES for record in records.values()):
+                return records
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return records
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, WAIT_MAX_DELAY)
+
+    async def wait_async(self, job_ids, timeout):
+        """wait() for a caller running an event loop: sleeps without holding a thread."""
+        deadline = time.monotonic() + timeout
+        delay = WAIT_MIN_DELAY
+        while True:
+            records = {job_id: self.store.get(job_id) for job_id in job_ids}
+            if all(record is None or record["status"] in FINAL_STATUSES for record in records.values()):
+                return records
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return records
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, WAIT_MAX_DELAY)
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job, or kills the process of a running one. A job whose process is shared
+        with other jobs still waiting for it (a coalesced run) is only detached from it; the
+        process is killed by the cancel of the last of them. Returns the current record.
+        """
+        def request_cancel(record):
+            if record["status"] == "queued":
+                return {
+                    "status": "cancelled", "cancel_requested": True, "finished_at": time.time(),
+                    "result": {"success": False, "message": "Cancelled before it started."},
+                }
+            if record["status"] == "running":
+                return {"cancel_requested": True}
+            return None
+
+        def detach(record):
+            if record["status"] != "running":
+                return None
+            return {
+                "status": "cancelled", "finished_at": time.time(),
+                "result": {"success": False, "message": "Cancelled; the run it shared with other requests continues."},
+            }
+
+        pid = None
+        with self.store.locked():
+            record = self.store.update_locked(job_id, request_cancel)
+            if record and record["status"] == "running":
+                sharing = [
+                    other for other in (self.store.get(other_id) for other_id in record.get("batch") or () if other_id != job_id)
+                    if other and other["status"] == "running" and not other["cancel_requested"]
+                ]
+                if sharing:
+                    self.store.update_locked(job_id, detach)
+                else:
+                    pid = record["pid"]
+        if pid:
+            _terminate(pid)
+        return self.store.get(job_id)
+
+
+def _terminate(pid):
+    """Sends SIGTERM to the process group of a command (started with start_new_session)."""
+    try:
+        os.killpg(pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass
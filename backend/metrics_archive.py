@@ -0,0 +1,220 @@
+# backend/metrics_archive.py
+"""
+Persistent metrics archive in its own SQLite file.
+Raw samples, keyed by their exact timestamp (METRICS_INTERVAL may be under a second), are
+rolled up into 1-minute and 1-hour aggregates and pruned by age.
+Only the elected sampler leader writes, from a single writer thread that batches the
+inserts; HTTP workers open read-only connections, so the archive never contends with
+the users/commands database used for authentication.
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv("METRICS_ARCHIVE_FLUSH_INTERVAL", "10"))
+PRUNE_BATCH_SIZE = 5000
+QUEUE_SIZE = 10000
+
+# (table, resolution in seconds, retention in seconds); finest first
+ARCHIVE_TABLES = (
+    ("metrics_raw", 1, float(os.getenv("METRICS_ARCHIVE_RAW_DAYS", "2")) * 86400),
+    ("metrics_1m", 60, float(os.getenv("METRICS_ARCHIVE_1M_DAYS", "30")) * 86400),
+    ("metrics_1h", 3600, float(os.getenv("METRICS_ARCHIVE_1H_DAYS", "400")) * 86400),
+)
+
+
+class MetricsArchive:
+    """SQLite-backed metrics archive with rollups, retention and resolution-aware queries."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = [name for name, _ in columns]
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._flush_lock = threading.Lock()
+        self._conn = None
+        self._thread = None
+
+    # --- Writer side (sampler leader only) ---
+
+    def enqueue(self, sample):
+        """Sampler listener: hands the sample to the writer thread without blocking."""
+        if self._thread is None:
+            return
+        if sample.get("timestamp") is None or any(sample.get(name) is None for name in self.columns):
+            return
+        try:
+            self._queue.put_nowait(sample)
+        except queue.Full:
+            pass # The writer is stuck; dropping samples is better than growing without bound
+
+    def start_writer(self):
+        if self._thread is not None:
+            return
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._ensure_schema()
+        self._thread = threading.Thread(target=self._run, name="metrics-archive-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _ensure_schema(self):
+        raw_table = ARCHIVE_TABLES[0][0]
+        self._migrate_raw_key(raw_table)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {raw_table} (ts REAL PRIMARY KEY)")
+        for table, _, _ in ARCHIVE_TABLES[1:]:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (bucket INTEGER PRIMARY KEY, samples INTEGER NOT NULL)")
+
+        # Add the columns of metrics introduced after the archive was created
+        for table, _, _ in ARCHIVE_TABLES:
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for column in self._table_columns(table):
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} REAL")
+        self._conn.commit()
+
+    def _migrate_raw_key(self, raw_table):
+        """Archives created with whole-second keys (ts INTEGER) are rebuilt keyed by the exact timestamp."""
+        info = list(self._conn.execute(f"PRAGMA table_info({raw_table})"))
+        if not any(row[1] == "ts" and row[2].upper() == "INTEGER" for row in info):
+            return
+        print(f"Migrating {raw_table} to exact sample timestamps...")
+        columns = [row[1] for row in info]
+        definitions = ["ts REAL PRIMARY KEY"] + [f"{name} REAL" for name in columns if name != "ts"]
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(f"ALTER TABLE {raw_table} RENAME TO {raw_table}_old")
+            self._conn.execute(f"CREATE TABLE {raw_table} ({', '.join(definitions)})")
+            self._conn.execute(f"INSERT INTO {raw_table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {raw_table}_old")
+            self._conn.execute(f"DROP TABLE {raw_table}_old")
+
+    def _table_columns(self, table):
+        if table == ARCHIVE_TABLES[0][0]:
+            return list(self.columns)
+        return [f"{name}_{kind}" for name in self.columns for kind in ("min", "max", "sum")]
+
+    def _run(self):
+        while True:
+            time.sleep(ARCHIVE_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Metrics archive error: {e}")
+
+    def flush(self):
+        """Writes the queued samples in one transaction, refreshes the touched rollups and prunes."""
+        with self._flush_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch or self._conn is None:
+                return
+
+            rows = [(float(sample["timestamp"]), *[sample.get(name) for name in self.columns]) for sample in batch]
+            with self._conn:
+                raw_table = ARCHIVE_TABLES[0][0]
+                placeholders = ",".join("?" * (len(self.columns) + 1))
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {raw_table} (ts, {', '.join(self.columns)}) VALUES ({placeholders})",
+                    rows
+                )
+                first_ts = min(row[0] for row in rows)
+                last_ts = max(row[0] for row in rows)
+                for (source, _, _), (table, resolution, _) in zip(ARCHIVE_TABLES, ARCHIVE_TABLES[1:]):
+                    self._rollup(source, table, resolution, first_ts, last_ts)
+                self._prune(time.time())
+
+    def _rollup(self, source, table, resolution, first_ts, last_ts):
+        """Recomputes the `table` buckets overlapping [first_ts, last_ts] from `source`."""
+        first_bucket = first_ts - first_ts % resolution
+        last_bucket = last_ts - last_ts % resolution
+        if source == ARCHIVE_TABLES[0][0]:
+            time_column = "ts"
+            count_expr = "COUNT(*)"
+            aggregates = [f"{func}({name})" for name in self.columns for func in ("MIN", "MAX", "SUM")]
+        else:
+            time_column = "bucket"
+            count_expr = "SUM(samples)"
+            aggregates = [f"{func}({name}_{kind})" for name in self.columns
+                          for func, kind in (("MIN", "min"), ("MAX", "max"), ("SUM", "sum"))]
+
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {table} (bucket, samples, {', '.join(self._table_columns(table))}) "
+            f"SELECT CAST({time_column} / {resolution} AS INTEGER) * {resolution} AS b, {count_expr}, {', '.join(aggregates)} "
+            f"FROM {source} WHERE {time_column} >= ? AND {time_column} < ? GROUP BY b",
+            (first_bucket, last_bucket + resolution)
+        )
+
+    def _prune(self, now):
+        """Deletes at most PRUNE_BATCH_SIZE expired rows per table, so each flush stays short."""
+        for table, _, retention in ARCHIVE_TABLES:
+            time_column = "ts" if table == ARCHIVE_TABLES[0][0] else "bucket"
+            self._conn.execute(
+                f"DELETE FROM {table} WHERE {time_column} IN "
+                f"(SELECT {time_column} FROM {table} WHERE {time_column} < ? ORDER BY {time_column} LIMIT ?)",
+                (int(now - retention), PRUNE_BATCH_SIZE)
+            )
+
+    # --- Reader side (any worker) ---
+
+    def pick_table(self, start_time, step, now=None):
+        """
+        Chooses the coarsest table whose resolution fits in `step` and whose retention
+        still covers `start_time`. Falls back to the coarsest table overall.
+        """
+        now = time.time() if now is None else now
+        candidates = [entry for entry in ARCHIVE_TABLES if entry[1] <= step and now - entry[2] <= start_time]
+        if candidates:
+            return candidates[-1]
+        for entry in ARCHIVE_TABLES:
+            if now - entry[2] <= start_time:
+                return entry
+        return ARCHIVE_TABLES[-1]
+
+    def downsample(self, start_time, end_time, step):
+        """Same columnar min/max/avg buckets as MetricsHistory.downsample, read from the archive."""
+        table, _, _ = self.pick_table(start_time, step)
+        result = {"t": [], "table": table}
+        for name in self.columns:
+            result[name] = {"min": [], "max": [], "avg": []}
+
+        if not os.path.exists(self.path):
+            return result
+        if table == ARCHIVE_TABLES[0][0]:
+            time_column, count_expr = "ts", "COUNT(*)"
+            aggregates = [f"MIN({name}), MAX({name}), SUM({name})" for name in self.columns]
+        else:
+            time_column, count_expr = "bucket", "SUM(samples)"
+            aggregates = [f"MIN({name}_min), MAX({name}_max), SUM({name}_sum)" for name in self.columns]
+
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                f"SELECT CAST(({time_column} - ?) / ? AS INTEGER) AS b, {count_expr}, {', '.join(aggregates)} "
+                f"FROM {table} WHERE {time_column} >= ? AND {time_column} < ? GROUP BY b ORDER BY b",
+                (start_time, step, start_time, end_time)
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"Warning: Could not query metrics archive: {e}")
+            rows = []
+        finally:
+            conn.close()
+
+        for row in rows:
+            bucket_index, samples = row[0], row[1]
+            if not samples:
+                continue
+            result["t"].append(round(start_time + bucket_index * step, 3))
+            for position, name in enumerate(self.columns):
+                minimum, maximum, total = row[2 + position * 3:5 + position * 3]
+                series = result[name]
+                series["min"].append(None if minimum is None else round(minimum, 1))
+                series["max"].append(None if maximum is None else round(maximum, 1))
+                series["avg"].append(None if total is None else round(total / samples, 1))
+        return result
@@ -0,0 +1,154 @@
+# backend/metrics_history.py
+"""
+Fixed-size, shared-memory ring buffer of recent metrics samples.
+Each metric is its own typed column (float64 timestamps, float32 values) in one mmap'ed
+file, so a day of 1 s samples fits in a few MB and every worker can query it.
+The elected sampler leader is the only writer; readers never lock.
+"""
+import array
+import math
+import mmap
+import os
+import struct
+from bisect import bisect_left
+
+# Column name -> array typecode. The timestamp column is implicit and always float64.
+HISTORY_COLUMNS = (
+    ("cpu_usage", "f"),
+    ("ram_usage", "f"),
+    ("disk_read_bps", "f"),
+    ("disk_write_bps", "f"),
+    ("net_rx_bps", "f"),
+    ("net_tx_bps", "f"),
+)
+
+MAGIC = b"SPH1"
+# magic | column count | capacity | total samples ever written
+_HEADER = struct.Struct("<4sIQQ")
+_COUNT_OFFSET = 16
+_COUNT = struct.Struct("<Q")
+# Slots about to be overwritten are skipped by readers so they never see a torn sample
+READ_MARGIN = 2
+MAX_BUCKETS = 2000
+
+
+class MetricsHistory:
+    """Ring buffer of samples with min/max/avg downsampling over time ranges."""
+
+    def __init__(self, path, capacity, columns=HISTORY_COLUMNS):
+        self.path = path
+        self.capacity = capacity
+        self.columns = columns
+        self._mm = None
+        self._timestamps = None
+        self._views = {}
+
+    def _column_layout(self):
+        offset = _HEADER.size
+        layout = [("timestamp", "d", offset)]
+        offset += self.capacity * 8
+        for name, typecode in self.columns:
+            layout.append((name, typecode, offset))
+            offset += self.capacity * array.array(typecode).itemsize
+        return layout, offset
+
+    def attach(self):
+        """Maps the ring buffer into this process, creating the backing file if needed."""
+        layout, size = self._column_layout()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+        buffer = memoryview(self._mm)
+        for name, typecode, offset in layout:
+            itemsize = array.array(typecode).itemsize
+            view = buffer[offset:offset + self.capacity * itemsize].cast(typecode)
+            if name == "timestamp":
+                self._timestamps = view
+            else:
+                self._views[name] = view
+
+    def take_over(self):
+        """Called by the new leader: keeps the existing data if the layout still matches."""
+        magic, column_count, capacity, _ = _HEADER.unpack_from(self._mm, 0)
+        if (magic, column_count, capacity) != (MAGIC, len(self.columns), self.capacity):
+            _HEADER.pack_into(self._mm, 0, MAGIC, len(self.columns), self.capacity, 0)
+
+    def _count(self):
+        magic, column_count, capacity, count = _HEADER.unpack_from(self._mm, 0)
+        if (magic, column_count, capacity) != (MAGIC, len(self.columns), self.capacity):
+            return 0
+        return count
+
+    def append(self, sample):
+        """Stores one sample. Samples with missing values are skipped."""
+        values = [sample.get(name) for name, _ in self.columns]
+        if sample.get("timestamp") is None or any(value is None for value in values):
+            return
+        count = _COUNT.unpack_from(self._mm, _COUNT_OFFSET)[0]
+        slot = count % self.capacity
+        self._timestamps[slot] = sample["timestamp"]
+        for (name, _), value in zip(self.columns, values):
+            self._views[name][slot] = value
+        _COUNT.pack_into(self._mm, _COUNT_OFFSET, count + 1)
+
+    def _segments(self, count):
+        """Physical (start, end) slices holding the readable samples, oldest first."""
+        if count <= self.capacity:
+            return [(0, count)]
+        first = count - self.capacity + READ_MARGIN
+        start = first % self.capacity
+        end = count % self.capacity
+        if start < end:
+            return [(start, end)]
+        return [(start, self.capacity), (0, end)]
+
+    def oldest_timestamp(self):
+        """Timestamp of the oldest readable sample, or None if the buffer is empty."""
+        start, end = self._segments(self._count())[0]
+        return self._timestamps[start] if end > start else None
+
+    def _select(self, start_time, end_time):
+        """Copies the samples with start_time <= timestamp < end_time into contiguous arrays."""
+        timestamps = array.array("d")
+        values = {name: array.array(typecode) for name, typecode in self.columns}
+        for seg_start, seg_end in self._segments(self._count()):
+            segment = self._timestamps[seg_start:seg_end]
+            lo = seg_start + bisect_left(segment, start_time)
+            hi = seg_start + bisect_left(segment, end_time)
+            if lo >= hi:
+                continue
+            timestamps.frombytes(self._timestamps[lo:hi].cast("B"))
+            for name, _ in self.columns:
+                values[name].frombytes(self._views[name][lo:hi].cast("B"))
+        return timestamps, values
+
+    def downsample(self, start_time, end_time, step):
+        """
+        Aggregates the samples in [start_time, end_time) into `step`-second buckets.
+        Returns columnar lists: bucket start times plus min/max/avg per column.
+        Empty buckets are omitted.
+        """
+        timestamps, values = self._select(start_time, end_time)
+        result = {"t": []}
+        for name, _ in self.columns:
+            result[name] = {"min": [], "max": [], "avg": []}
+
+        i = 0
+        total = len(timestamps)
+        while i < total:
+            bucket_start = start_time + math.floor((timestamps[i] - start_time) / step) * step
+            j = bisect_left(timestamps, bucket_start + step, i, total)
+            result["t"].append(round(bucket_start, 3))
+            for name, _ in self.columns:
+                bucket = values[name][i:j]
+                series = result[name]
+                series["min"].append(round(min(bucket), 1))
+                series["max"].append(round(max(bucket), 1))
+                series["avg"].append(round(sum(bucket) / (j - i), 1))
+            i = j
+        return result
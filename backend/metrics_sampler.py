@@ -0,0 +1,189 @@
+# backend/metrics_sampler.py
+"""
+Background metrics sampler.
+Reads /proc on a fixed cadence and keeps the latest sample in memory, so request
+handlers only copy a cached dict instead of spawning shell pipelines.
+"""
+import os
+import threading
+import time
+
+from system_actions import linux_metrics
+
+DEFAULT_INTERVAL = float(os.getenv("METRICS_INTERVAL", "1.0"))
+PROCESS_SCAN_INTERVAL = float(os.getenv("PROCESS_SCAN_INTERVAL", "2.0"))
+# Processes are only scanned while someone viewed them within this many seconds
+PROCESS_DEMAND_WINDOW = 60.0
+PROCESS_TOP_LIMIT = 50
+
+DISK_RATE_NAMES = ("read_bytes_per_sec", "write_bytes_per_sec", "read_iops", "write_iops")
+NET_RATE_NAMES = ("rx_bytes_per_sec", "tx_bytes_per_sec", "rx_packets_per_sec", "tx_packets_per_sec")
+
+
+class MetricsSampler:
+    """
+    Samples CPU, RAM, uptime, disk and network I/O every `interval` seconds in a daemon thread.
+    CPU usage is computed from the delta between two consecutive /proc/stat reads,
+    so it reflects the current load instead of the since-boot average.
+    Disk and network throughput are also deltas of cumulative counters; the totals are
+    top-level fields and the per-device figures go, with the rest of the variable-size
+    data (per-core usage, top processes), into sample['details'].
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._previous_cpu = None
+        self._previous_cores = []
+        self._disk_reader = linux_metrics.DiskStatsReader()
+        self._net_reader = linux_metrics.NetDevReader()
+        self._previous_io = None # (monotonic time, disk counters, network counters)
+        self._listeners = []
+        # Callable returning the Unix time of the last request for the process view
+        self.process_demand = None
+        self._process_scanner = None
+        self._processes = None
+        self._last_process_scan = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add_listener(self, callback):
+        """Registers a callable invoked with every new sample (from the sampler thread)."""
+        self._listeners.append(callback)
+
+    def start(self):
+        """
+        Starts the sampling thread if it is not running in this process.
+        Safe to call repeatedly; a forked child (e.g. a gunicorn worker) gets its own thread.
+        """
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop_event.clear()
+        self._previous_cpu = None
+        self._previous_io = None
+        self.sample_once() # Prime the cache so the first request already has data
+        self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stop_event.is_set():
+            next_tick += self.interval
+            try:
+                self.sample_once()
+            except Exception as e:
+                print(f"Metrics sampler error: {e}")
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # We fell behind (suspend, heavy load): realign instead of bursting
+                next_tick = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def sample_once(self):
+        """Takes one sample, stores it as the latest one and notifies the listeners."""
+        sample = {"timestamp": time.time()}
+        details = {}
+
+        try:
+            cpu_times, core_times = linux_metrics.read_cpu_times()
+            sample["cpu_usage"] = linux_metrics.cpu_percent(self._previous_cpu, cpu_times)
+            if len(self._previous_cores) == len(core_times):
+                details["cpu_per_core"] = [
+                    linux_metrics.cpu_percent(previous, current)
+                    for previous, current in zip(self._previous_cores, core_times)
+                ]
+            self._previous_cpu = cpu_times
+            self._previous_cores = core_times
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Warning: Could not read CPU times: {e}")
+            sample["cpu_usage"] = None
+
+        try:
+            sample["ram_usage"] = linux_metrics.read_memory_usage()
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Warning: Could not read memory info: {e}")
+            sample["ram_usage"] = None
+
+        try:
+            sample["uptime_seconds"] = linux_metrics.read_uptime_seconds()
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Warning: Could not read uptime: {e}")
+            sample["uptime_seconds"] = None
+        sample["uptime"] = linux_metrics.format_uptime(sample["uptime_seconds"])
+
+        self._sample_io(sample, details)
+        details["processes"] = self._scan_processes_if_requested()
+        sample["details"] = details
+
+        with self._lock:
+            self._latest = sample
+
+        for listener in self._listeners:
+            try:
+                listener(sample)
+            except Exception as e:
+                print(f"Metrics listener error: {e}")
+        return sample
+
+    def _sample_io(self, sample, details):
+        """Adds disk and network throughput (totals in `sample`, per device in `details`)."""
+        now = time.monotonic()
+        try:
+            disk_counters = self._disk_reader.read()
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Warning: Could not read disk stats: {e}")
+            disk_counters = {}
+        try:
+            net_counters = self._net_reader.read()
+        except (OSError, ValueError, IndexError) as e:
+            print(f"Warning: Could not read network stats: {e}")
+            net_counters = {}
+
+        details["disks"] = details["network"] = {}
+        for field in ("disk_read_bps", "disk_write_bps", "net_rx_bps", "net_tx_bps"):
+            sample[field] = None # No rates until there are two snapshots to compare
+
+        if self._previous_io is not None:
+            previous_time, previous_disks, previous_networks = self._previous_io
+            elapsed = now - previous_time
+            disks = linux_metrics.counter_rates(previous_disks, disk_counters, elapsed, DISK_RATE_NAMES)
+            networks = linux_metrics.counter_rates(previous_networks, net_counters, elapsed, NET_RATE_NAMES)
+            details["disks"] = disks
+            details["network"] = networks
+            sample["disk_read_bps"] = sum(d["read_bytes_per_sec"] for d in disks.values())
+            sample["disk_write_bps"] = sum(d["write_bytes_per_sec"] for d in disks.values())
+            sample["net_rx_bps"] = sum(n["rx_bytes_per_sec"] for n in networks.values())
+            sample["net_tx_bps"] = sum(n["tx_bytes_per_sec"] for n in networks.values())
+        self._previous_io = (now, disk_counters, net_counters)
+
+    def _scan_processes_if_requested(self):
+        """Rescans /proc/[pid] every PROCESS_SCAN_INTERVAL seconds, but only while the view is in use."""
+        demand = self.process_demand() if self.process_demand else 0.0
+        if time.time() - demand > PROCESS_DEMAND_WINDOW:
+            # Nobody is looking: stop scanning and forget the per-PID state
+            self._process_scanner = None
+            self._processes = None
+            return None
+
+        if self._process_scanner is None:
+            self._process_scanner = linux_metrics.ProcessScanner()
+        if time.monotonic() - self._last_process_scan >= PROCESS_SCAN_INTERVAL:
+            self._last_process_scan = time.monotonic()
+            try:
+                self._processes = self._process_scanner.scan(PROCESS_TOP_LIMIT)
+                self._processes["timestamp"] = time.time()
+            except OSError as e:
+                print(f"Warning: Could not scan processes: {e}")
+        return self._processes
+
+    def latest(self):
+        """Returns a copy of the most recent sample (empty dict if nothing was sampled yet)."""
+        with self._lock:
+            return dict(self._latest)
@@ -0,0 +1,181 @@
+# backend/migrations.py
+"""
+Versioned schema migrations for the SysPilot database.
+The schema_version table holds one row: the schema version and the defaults that were
+last seeded. A starting worker reads that row and, if both are current, does nothing else.
+Otherwise it takes an exclusive file lock, re-checks (another worker may have finished the
+job meanwhile) and applies the pending migrations in order, each in its own transaction,
+followed by the seeding of the defaults. Migrations must be idempotent and are never edited
+once released; changes go into a new one appended to MIGRATIONS.
+"""
+import fcntl
+import json
+import os
+import sqlite3
+
+from permissions import ADMIN_FILTER, permissions_to_mask
+
+
+def _create_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            permission_mask INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS commands (
+            command_key TEXT PRIMARY KEY NOT NULL,
+            command_value TEXT NOT NULL
+        )
+    ''')
+
+
+def _permissions_to_mask(conn):
+    """Rebuilds a users table that still has the legacy JSON 'permissions' column."""
+    if 'permissions' not in {row[1] for row in conn.execute("PRAGMA table_info(users)")}:
+        return
+    rows = conn.execute("SELECT id, username, password_hash, permissions FROM users").fetchall()
+    conn.execute('''
+        CREATE TABLE users_migrated (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            permission_mask INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for row in rows:
+        try:
+            legacy_permissions = json.loads(row[3])
+        except (TypeError, ValueError):
+            legacy_permissions = {}
+        conn.execute(
+            "INSERT INTO users_migrated (id, username, password_hash, permission_mask) VALUES (?, ?, ?, ?)",
+            (row[0], row[1], row[2], permissions_to_mask(legacy_permissions))
+        )
+    conn.execute("DROP TABLE users")
+    conn.execute("ALTER TABLE users_migrated RENAME TO users")
+    print(f"Migrated permissions of {len(rows)} users from JSON to bitmasks.")
+
+
+def _admin_index(conn):
+    # Partial index holding only the administrators, used to count them
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_users_admins ON users(id) WHERE {ADMIN_FILTER}")
+
+
+def _create_actions_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS actions (
+            name TEXT PRIMARY KEY NOT NULL,
+            label TEXT NOT NULL,
+            permission TEXT NOT NULL,
+            command TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            timeout REAL,
+            idempotent INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def _create_fleet_nodes_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fleet_nodes (
+            name TEXT PRIMARY KEY NOT NULL,
+            url TEXT NOT NULL,
+            token TEXT NOT NULL DEFAULT ''
+        )
+    ''')
+
+
+# (version, description, function); append only
+MIGRATIONS = (
+    (1, "create users and commands tables", _create_tables),
+    (2, "store permissions as bitmasks", _permissions_to_mask),
+    (3, "partial index on administrators", _admin_index),
+    (4, "user-defined actions table", _create_actions_table),
+    (5, "fleet nodes table", _create_fleet_nodes_table),
+)
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def merge_commands(conn, defaults, previous_defaults):
+    """
+    Merges the default commands ({key: command}) into the commands table: missing commands are
+    added and a command still equal to its previous default follows the new one, while commands
+    customized by the user are kept. Returns the number of commands added or updated.
+    """
+    stored_commands = {row[0]: row[1] for row in conn.execute("SELECT command_key, command_value FROM commands")}
+    merged = 0
+    for key, value in defaults.items():
+        if key not in stored_commands:
+            conn.execute("INSERT INTO commands (command_key, command_value) VALUES (?, ?)", (key, value))
+            merged += 1
+        elif stored_commands[key] != value and stored_commands[key] == previous_defaults.get(key):
+            conn.execute("UPDATE commands SET command_value = ? WHERE command_key = ?", (value, key))
+            merged += 1
+    return merged
+
+
+def read_state(conn):
+    """Returns (schema version, seeded defaults); (0, None) for a database without the table."""
+    try:
+        row = conn.execute("SELECT version, seeded_defaults FROM schema_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError: # No such table yet
+        return 0, None
+    return (row[0], row[1]) if row else (0, None)
+
+
+def upgrade(conn, lock_path, defaults, seed):
+    """
+    Brings the database to LATEST_VERSION and seeds `defaults` (a JSON string) if they changed.
+    `seed(conn, previous_defaults)` runs inside a transaction and receives the defaults seeded
+    last time (None if unknown), so it can merge instead of overwriting.
+    """
+    if read_state(conn) == (LATEST_VERSION, defaults):
+        return False
+
+    lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                seeded_defaults TEXT
+            )
+        ''')
+        version, previous_defaults = read_state(conn)
+
+        for migration_version, description, migrate in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            print(f"Applying database migration {migration_version}: {description}...")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migrate(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (id, version, seeded_defaults) VALUES (1, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET version = excluded.version",
+                    (migration_version, previous_defaults)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            version = migration_version
+
+        if previous_defaults != defaults:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                seed(conn, previous_defaults)
+                conn.execute("UPDATE schema_version SET seeded_defaults = ? WHERE id = 1", (defaults,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return True
+    finally:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
@@ -0,0 +1,44 @@
+# backend/permissions.py
+"""
+Registry of user permissions.
+Permissions are stored (in the users table and in the JWT) as an integer bitmask;
+bit n is PERMISSIONS[n]. New permissions must be appended at the end, never inserted
+or reordered, because the bit positions are persisted.
+"""
+
+PERMISSIONS = (
+    "shutdown", "restart", "lock",
+    "play_pause", "media_next", "media_previous",
+    "volume", "volume_mute", "system_metrics",
+    "modify_commands", "manage_users",
+)
+
+PERMISSION_BITS = {name: 1 << index for index, name in enumerate(PERMISSIONS)}
+ALL_PERMISSIONS = (1 << len(PERMISSIONS)) - 1
+ADMIN_PERMISSION = "manage_users"
+
+# SQL condition matching the users with the admin permission; the admin-count query must use
+# exactly this expression for SQLite to pick the partial index built on it
+ADMIN_FILTER = f"permission_mask & {PERMISSION_BITS[ADMIN_PERMISSION]} != 0"
+
+
+def has_permission(mask, name):
+    """True if the permission `name` is set in `mask`."""
+    return bool(mask & PERMISSION_BITS[name])
+
+
+def permissions_to_mask(permissions, base_mask=0):
+    """
+    Applies a {name: bool} dict (e.g. from a request or a legacy JSON row) on top of `base_mask`.
+    Unknown names and non-boolean values are ignored.
+    """
+    mask = base_mask
+    for name, value in permissions.items():
+        if name in PERMISSION_BITS and isinstance(value, bool):
+            mask = mask | PERMISSION_BITS[name] if value else mask & ~PERMISSION_BITS[name]
+    return mask
+
+
+def mask_to_permissions(mask):
+    """Expands a mask into the {name: bool} dict the frontend works with."""
+    return {name: bool(mask & bit) for name, bit in PERMISSION_BITS.items()}
@@ -0,0 +1,149 @@
+# backend/prometheus_exporter.py
+"""
+Prometheus text exposition (format 0.0.4) of the SysPilot metrics.
+The page is rendered at most once per sampler tick and kept as bytes, so a scrape
+costs a sequence-number comparison and a memory copy however often it happens.
+"""
+import threading
+
+from http_metrics import LATENCY_BUCKETS, STATUS_CLASSES
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Sample field -> (metric name, help text)
+GAUGES = (
+    ("cpu_usage", "syspilot_cpu_usage_percent", "CPU usage over the last sampling interval."),
+    ("ram_usage", "syspilot_memory_usage_percent", "Used memory (MemTotal - MemAvailable) as a percentage."),
+    ("uptime_seconds", "syspilot_uptime_seconds", "System uptime."),
+    ("timestamp", "syspilot_last_sample_timestamp_seconds", "Unix time of the last metrics sample."),
+)
+
+# Database pool statistic -> (metric name, help text); all of them are counters
+DB_COUNTERS = (
+    ("queries", "syspilot_db_queries_total", "SQLite statements executed through the connection pool."),
+    ("query_seconds", "syspilot_db_query_seconds_total", "Time spent executing SQLite statements."),
+    ("slow_queries", "syspilot_db_slow_queries_total", "SQLite statements slower than the slow-query threshold."),
+    ("pool_waits", "syspilot_db_pool_waits_total", "Times a request waited for a free pooled connection."),
+    ("pool_wait_seconds", "syspilot_db_pool_wait_seconds_total", "Time spent waiting for a pooled connection."),
+    ("busy_errors", "syspilot_db_busy_errors_total", "Requests that gave up on a locked database after the busy timeout."),
+)
+
+# Query command cache counter -> (metric name, help text), labelled by command key
+QUERY_CACHE_COUNTERS = (
+    ("hits", "syspilot_command_cache_hits_total", "Read-only command results served from the cache or a shared in-flight run."),
+    ("misses", "syspilot_command_cache_misses_total", "Read-only command executions."),
+)
+
+# Details section -> (label name, [(rate field, metric name, help text)])
+DEVICE_GAUGES = (
+    ("disks", "device", (
+        ("read_bytes_per_sec", "syspilot_disk_read_bytes_per_second", "Disk read throughput."),
+        ("write_bytes_per_sec", "syspilot_disk_write_bytes_per_second", "Disk write throughput."),
+        ("read_iops", "syspilot_disk_reads_per_second", "Completed disk reads per second."),
+        ("write_iops", "syspilot_disk_writes_per_second", "Completed disk writes per second."),
+    )),
+    ("network", "interface", (
+        ("rx_bytes_per_sec", "syspilot_network_receive_bytes_per_second", "Network receive throughput."),
+        ("tx_bytes_per_sec", "syspilot_network_transmit_bytes_per_second", "Network transmit throughput."),
+        ("rx_packets_per_sec", "syspilot_network_receive_packets_per_second", "Received packets per second."),
+        ("tx_packets_per_sec", "syspilot_network_transmit_packets_per_second", "Transmitted packets per second."),
+    )),
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render(sample, details, http_snapshot, db_stats=None, query_stats=None):
+    """
+    Builds the exposition text from a metrics sample, its details, the HTTP and the database
+    counters and the query command cache counters.
+    """
+    lines = []
+
+    for field, name, help_text in GAUGES:
+        if sample.get(field) is None:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_number(sample[field])}")
+
+    cores = details.get("cpu_per_core") or []
+    if cores:
+        lines.append("# HELP syspilot_cpu_core_usage_percent CPU usage per core over the last sampling interval.")
+        lines.append("# TYPE syspilot_cpu_core_usage_percent gauge")
+        for index, value in enumerate(cores):
+            if value is not None:
+                lines.append(f'syspilot_cpu_core_usage_percent{{core="{index}"}} {_number(value)}')
+
+    for section, label, metrics in DEVICE_GAUGES:
+        devices = details.get(section) or {}
+        if not devices:
+            continue
+        for field, name, help_text in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for device, rates in sorted(devices.items()):
+                lines.append(f'{name}{{{label}="{_escape(device)}"}} {_number(rates[field])}')
+
+    if http_snapshot:
+        lines.append("# HELP syspilot_http_requests_total HTTP requests handled, by Flask route and status class.")
+        lines.append("# TYPE syspilot_http_requests_total counter")
+        for route, (status_counts, _, _) in sorted(http_snapshot.items()):
+            for status_class, count in zip(STATUS_CLASSES, status_counts):
+                if count:
+                    lines.append(f'syspilot_http_requests_total{{route="{_escape(route)}",status="{status_class}"}} {_number(count)}')
+
+        lines.append("# HELP syspilot_http_request_duration_seconds HTTP request latency, by Flask route.")
+        lines.append("# TYPE syspilot_http_request_duration_seconds histogram")
+        for route, (status_counts, bucket_counts, latency_sum) in sorted(http_snapshot.items()):
+            escaped_route = _escape(route)
+            for bound, count in zip(LATENCY_BUCKETS, bucket_counts):
+                lines.append(f'syspilot_http_request_duration_seconds_bucket{{route="{escaped_route}",le="{bound}"}} {_number(count)}')
+            total = sum(status_counts)
+            lines.append(f'syspilot_http_request_duration_seconds_bucket{{route="{escaped_route}",le="+Inf"}} {_number(total)}')
+            lines.append(f'syspilot_http_request_duration_seconds_sum{{route="{escaped_route}"}} {_number(latency_sum)}')
+            lines.append(f'syspilot_http_request_duration_seconds_count{{route="{escaped_route}"}} {_number(total)}')
+
+    for field, name, help_text in DB_COUNTERS:
+        if db_stats and field in db_stats:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {_number(db_stats[field])}")
+
+    if query_stats:
+        for field, name, help_text in QUERY_CACHE_COUNTERS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for command_key, counts in sorted(query_stats.items()):
+                lines.append(f'{name}{{command="{_escape(command_key)}"}} {_number(counts[field])}')
+
+    return ("\n".join(lines) + "\n").encode()
+
+
+class ExpositionCache:
+    """Keeps the rendered page and re-renders it only when the sampler published a new tick."""
+
+    def __init__(self, read_version, build):
+        self._read_version = read_version
+        self._build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._body = b""
+
+    def get(self):
+        version = self._read_version()
+        if version == self._version:
+            return self._body
+        with self._lock:
+            if version != self._version:
+                self._body = self._build()
+                self._version = version
+            return self._body
@@ -0,0 +1,80 @@
+# backend/query_cache.py
+"""
+Result cache for the read-only get_* commands.
+Entries are keyed by command key and rendered command string and live for the TTL of their
+command. Concurrent callers of a command that isn't cached share a single execution
+(single-flight) instead of each spawning their own copy. Hits and misses are counted per
+command key so the TTLs can be tuned from /metrics.
+The volume and mute reads don't go through it: only the leader's MediaMonitor makes them,
+when pactl reports a change, and a stored value would hide that change.
+"""
+import threading
+import time
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class QueryCache:
+    """Per-worker TTL cache with single-flight execution for a fixed set of command keys."""
+
+    def __init__(self, ttls, counters=None):
+        self.ttls = dict(ttls) # command key -> seconds; other keys are never cached
+        self.keys = tuple(self.ttls)
+        self.counters = counters # Optional WorkerCounters with 2 values (hits, misses) per key
+        self._index = {key: index for index, key in enumerate(self.keys)}
+        self._lock = threading.Lock()
+        self._entries = {} # (command key, command) -> (expires, result)
+        self._flights = {}
+
+    def _count(self, command_key, hit):
+        if self.counters is not None:
+            self.counters.add([(2 * self._index[command_key] + (0 if hit else 1), 1)])
+
+    def get(self, command_key, command, execute):
+        """Returns the cached result of `command`, or `execute()`'s. Only successful results are stored."""
+        if command_key not in self._index:
+            return execute()
+        key = (command_key, command)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._count(command_key, hit=True)
+                return entry[1]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            self._count(command_key, hit=True)
+            flight.done.wait()
+            return flight.result
+
+        self._count(command_key, hit=False)
+        try:
+            flight.result = execute()
+        except Exception as e:
+            flight.result = {"success": False, "message": f"An unexpected error occurred: {str(e)}"}
+        finally:
+            with self._lock:
+                if flight.result is not None and flight.result.get("success"):
+                    self._entries[key] = (time.monotonic() + self.ttls[command_key], flight.result)
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def retain(self, is_current):
+        """Drops the entries whose command is no longer current: `is_current(command_key, command)`."""
+        with self._lock:
+            self._entries = {key: entry for key, entry in self._entries.items() if is_current(*key)}
+
+    def stats(self):
+        """{command key: {'hits', 'misses'}} summed over every worker."""
+        if self.counters is None:
+            return {}
+        totals = self.counters.totals()
+        return {key: {"hits": totals[2 * index], "misses": totals[2 * index + 1]} for key, index in self._index.items()}
@@ -0,0 +1,189 @@
+# backend/shared_metrics.py
+"""
+Shared-memory publication of the latest metrics sample.
+One gunicorn worker is elected leader (an flock on a lock file) and runs the sampler;
+it writes every sample into a small fixed-layout mmap region. All workers read that
+region without locks: a sequence counter (seqlock) tells readers when they raced a write.
+Besides the fixed fields, a bounded JSON area carries the variable-size details
+(per-core usage, per-device I/O, top processes) under the same sequence counter.
+"""
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+# Layout: magic (4 bytes, includes the layout version) | padding | seq (uint64) |
+#         demand timestamps | fixed payload | details length (uint32) | details JSON
+MAGIC = b"SPM3"
+_HEADER = struct.Struct("<4s4xQ")
+_SEQ_OFFSET = 8
+_SEQ = struct.Struct("<Q")
+
+# Written by any worker (outside the seqlock) to tell the leader a view is in use
+DEMAND_FIELDS = ("processes",)
+_DEMAND = struct.Struct("<" + "d" * len(DEMAND_FIELDS))
+_DEMAND_OFFSET = _HEADER.size
+_DOUBLE = struct.Struct("<d")
+
+METRIC_FIELDS = (
+    "timestamp", "cpu_usage", "ram_usage", "uptime_seconds",
+    "disk_read_bps", "disk_write_bps", "net_rx_bps", "net_tx_bps",
+)
+_PAYLOAD = struct.Struct("<" + "d" * len(METRIC_FIELDS))
+_PAYLOAD_OFFSET = _DEMAND_OFFSET + _DEMAND.size
+
+_DETAILS_LENGTH = struct.Struct("<I")
+_DETAILS_OFFSET = _PAYLOAD_OFFSET + _PAYLOAD.size
+DETAILS_CAPACITY = 64 * 1024
+
+REGION_SIZE = _DETAILS_OFFSET + _DETAILS_LENGTH.size + DETAILS_CAPACITY
+READ_RETRIES = 100
+
+
+def default_region_path(key):
+    """
+    Builds the path of the shared region for an instance identified by `key`
+    (typically the database path), preferring the /dev/shm tmpfs.
+    """
+    base_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    digest = hashlib.sha1(os.path.abspath(key).encode()).hexdigest()[:12]
+    return os.path.join(base_dir, f"syspilot-metrics-{os.getuid()}-{digest}")
+
+
+class SharedMetrics:
+    """Fixed-layout, seqlock-protected metrics region backed by an mmap'ed file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._mm = None
+        self._lock_fd = None
+        self._seq = 0
+        self._details_cache = (None, {})
+
+    def attach(self):
+        """Maps the region into this process, creating the backing file if needed."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != REGION_SIZE:
+                os.ftruncate(fd, REGION_SIZE)
+            self._mm = mmap.mmap(fd, REGION_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd) # The mapping keeps its own reference to the file
+
+    def start_leader_election(self, on_elected):
+        """
+        Competes for leadership in a daemon thread. The thread blocks on the lock file until
+        the current leader exits (the kernel releases its flock), then calls `on_elected`.
+        """
+        def elect():
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._lock_fd = fd
+            self._take_over()
+            print(f"Process {os.getpid()} elected as metrics sampler leader.")
+            on_elected()
+
+        threading.Thread(target=elect, name="metrics-leader-election", daemon=True).start()
+
+    def _take_over(self):
+        magic, seq = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm[:REGION_SIZE] = bytes(REGION_SIZE)
+            seq = 0
+        # A previous leader may have died mid-write and left an odd sequence number
+        self._seq = seq + (seq & 1)
+        _HEADER.pack_into(self._mm, 0, MAGIC, self._seq)
+
+    def write(self, sample):
+        """Publishes a sample. Only the elected leader may call this."""
+        if not self.is_leader_process():
+            return
+        values = [sample.get(field) for field in METRIC_FIELDS]
+        payload = [math.nan if value is None else float(value) for value in values]
+        details = json.dumps(sample.get("details") or {}, separators=(",", ":")).encode()
+        if len(details) > DETAILS_CAPACITY:
+            print(f"Warning: Metrics details too large for shared memory ({len(details)} bytes), dropping them.")
+            details = b"{}"
+
+        self._seq += 1 # Odd: write in progress
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+        _PAYLOAD.pack_into(self._mm, _PAYLOAD_OFFSET, *payload)
+        _DETAILS_LENGTH.pack_into(self._mm, _DETAILS_OFFSET, len(details))
+        start = _DETAILS_OFFSET + _DETAILS_LENGTH.size
+        self._mm[start:start + len(details)] = details
+        self._seq += 1 # Even: consistent again
+        _SEQ.pack_into(self._mm, _SEQ_OFFSET, self._seq)
+
+    def mark_demand(self, view):
+        """Records that `view` (one of DEMAND_FIELDS) was just requested."""
+        if self._mm is not None:
+            _DOUBLE.pack_into(self._mm, _DEMAND_OFFSET + DEMAND_FIELDS.index(view) * _DOUBLE.size, time.time())
+
+    def last_demand(self, view):
+        """Unix time of the last request for `view` in any worker (0 if never)."""
+        if self._mm is None:
+            return 0.0
+        return _DOUBLE.unpack_from(self._mm, _DEMAND_OFFSET + DEMAND_FIELDS.index(view) * _DOUBLE.size)[0]
+
+    def is_leader_process(self):
+        return self._lock_fd is not None
+
+    def sequence(self):
+        """Returns the current sequence number; it changes every time a sample is published."""
+        if self._mm is None:
+            return 0
+        return _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+
+    def read(self):
+        """
+        Returns the latest published sample as a dict ({} if none is available yet).
+        Lock-free: retries while the leader is in the middle of a write.
+        """
+        if self._mm is None:
+            return {}
+        mm = self._mm
+        for _ in range(READ_RETRIES):
+            magic, seq_before = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or seq_before == 0:
+                return {}
+            if seq_before & 1:
+                continue
+            values = _PAYLOAD.unpack_from(mm, _PAYLOAD_OFFSET)
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] == seq_before:
+                sample = {field: (None if math.isnan(value) else value) for field, value in zip(METRIC_FIELDS, values)}
+                sample["seq"] = seq_before
+                return sample
+        return {}
+
+    def read_details(self):
+        """
+        Returns the details of the latest sample ({} if unavailable).
+        The decoded JSON is cached per sequence number, so repeated reads are free.
+        """
+        if self._mm is None:
+            return {}
+        mm = self._mm
+        for _ in range(READ_RETRIES):
+            magic, seq_before = _HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or seq_before == 0:
+                return {}
+            if seq_before & 1:
+                continue
+            cached_seq, cached_details = self._details_cache
+            if cached_seq == seq_before:
+                return cached_details
+            length = min(_DETAILS_LENGTH.unpack_from(mm, _DETAILS_OFFSET)[0], DETAILS_CAPACITY)
+            start = _DETAILS_OFFSET + _DETAILS_LENGTH.size
+            raw = mm[start:start + length]
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] == seq_before:
+                details = json.loads(raw) if raw else {}
+                self._details_cache = (seq_before, details)
+                return details
+        return {}
@@ -0,0 +1,98 @@
+# backend/shared_state.py
+"""
+A small JSON document shared by every worker of an instance.
+The document lives in an mmap'ed file under a sequence counter (seqlock): writers
+serialize on an flock, readers never lock and retry when they raced a write. The decoded
+document is cached per sequence number, so reading an unchanged state costs one memory read.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+
+MAGIC = b"SPS1"
+# magic | padding | seq (uint64) | document length (uint32) | document JSON
+_HEADER = struct.Struct("<4s4xQI")
+_SEQ_OFFSET = 8
+_SEQ = struct.Struct("<Q")
+_LENGTH_OFFSET = 16
+_LENGTH = struct.Struct("<I")
+DEFAULT_CAPACITY = 16 * 1024
+READ_RETRIES = 100
+
+
+class SharedState:
+    """Seqlock-protected JSON document backed by an mmap'ed file."""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self.size = _HEADER.size + capacity
+        self._mm = None
+        self._write_lock = threading.Lock()
+        self._cache = (None, {})
+
+    def attach(self):
+        """Maps the document file, (re)initializing it if its layout doesn't match."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, self.size)
+            self._mm = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            if _HEADER.unpack_from(self._mm, 0)[0] != MAGIC:
+                self._mm[:self.size] = bytes(self.size)
+                _HEADER.pack_into(self._mm, 0, MAGIC, 0, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def publish(self, document):
+        """Replaces the document. Returns False (and keeps the old one) if it doesn't fit."""
+        data = json.dumps(document, separators=(",", ":")).encode()
+        if len(data) > self.capacity:
+            print(f"Warning: Shared state too large for {self.path} ({len(data)} bytes), dropping it.")
+            return False
+        with self._write_lock:
+            fd = os.open(self.path, os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                seq = _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+                seq += 1 + (seq & 1) # Odd: write in progress (a writer that died mid-write left it odd)
+                _SEQ.pack_into(self._mm, _SEQ_OFFSET, seq)
+                _LENGTH.pack_into(self._mm, _LENGTH_OFFSET, len(data))
+                self._mm[_HEADER.size:_HEADER.size + len(data)] = data
+                _SEQ.pack_into(self._mm, _SEQ_OFFSET, seq + 1) # Even: consistent again
+            finally:
+                os.close(fd)
+        return True
+
+    def sequence(self):
+        """Changes every time the document is published (0 before the first one)."""
+        if self._mm is None:
+            return 0
+        return _SEQ.unpack_from(self._mm, _SEQ_OFFSET)[0]
+
+    def read(self):
+        """Returns the latest document ({} if none was published yet). Lock-free."""
+        if self._mm is None:
+            return {}
+        mm = self._mm
+        for _ in range(READ_RETRIES):
+            seq_before = _SEQ.unpack_from(mm, _SEQ_OFFSET)[0]
+            if seq_before == 0:
+                return {}
+            if seq_before & 1:
+                continue
+            cached_seq, cached_document = self._cache
+            if cached_seq == seq_before:
+                return cached_document
+            length = min(_LENGTH.unpack_from(mm, _LENGTH_OFFSET)[0], self.capacity)
+            raw = mm[_HEADER.size:_HEADER.size + length]
+            if _SEQ.unpack_from(mm, _SEQ_OFFSET)[0] == seq_before:
+                document = json.loads(raw) if raw else {}
+                self._cache = (seq_before, document)
+                return document
+        return {}
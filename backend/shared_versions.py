@@ -0,0 +1,65 @@
+# backend/shared_versions.py
+"""
+Cross-worker version counters for in-process caches.
+Each counter is a uint64 in a small mmap'ed file. A worker that commits a change bumps
+the counter (under an flock); every worker compares it with the version its cache was
+filled under, which costs one memory read instead of a database query.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"SPV1"
+MAX_COUNTERS = 16
+# magic | number of named counters
+_HEADER = struct.Struct("<4sI")
+_COUNTER = struct.Struct("<Q")
+REGION_SIZE = _HEADER.size + MAX_COUNTERS * _COUNTER.size
+
+
+class SharedVersions:
+    """Named, monotonically increasing counters shared by every worker of an instance."""
+
+    def __init__(self, path, names):
+        if len(names) > MAX_COUNTERS:
+            raise ValueError(f"At most {MAX_COUNTERS} shared version counters are supported.")
+        self.path = path
+        self.names = tuple(names)
+        self._offsets = {name: _HEADER.size + index * _COUNTER.size for index, name in enumerate(self.names)}
+        self._mm = None
+
+    def attach(self):
+        """Maps the counters file, (re)initializing it if its layout doesn't match."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != REGION_SIZE:
+                os.ftruncate(fd, REGION_SIZE)
+            self._mm = mmap.mmap(fd, REGION_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            if _HEADER.unpack_from(self._mm, 0) != (MAGIC, len(self.names)):
+                # Seed from the clock so a reinitialized counter never repeats a version
+                # that a still-running worker might have cached
+                seed = time.time_ns()
+                for offset in self._offsets.values():
+                    _COUNTER.pack_into(self._mm, offset, seed)
+                _HEADER.pack_into(self._mm, 0, MAGIC, len(self.names))
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def get(self, name):
+        """Current value of a counter (lock-free; aligned 8-byte reads don't tear)."""
+        return _COUNTER.unpack_from(self._mm, self._offsets[name])[0]
+
+    def bump(self, name):
+        """Increments a counter and returns the new value. Call it after the change is committed."""
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            value = self.get(name) + 1
+            _COUNTER.pack_into(self._mm, self._offsets[name], value)
+            return value
+        finally:
+            os.close(fd)
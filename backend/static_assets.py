@@ -0,0 +1,120 @@
+# backend/static_assets.py
+"""
+Static assets of the frontend (CSS, JS, images), loaded once at startup.
+Each file is content-hashed and kept in memory together with precompressed gzip and, when
+the optional brotli module is installed, brotli variants. Hashed URLs
+(/assets/js/app.<hash>.js) are cached by browsers for a year as immutable, so a revisit
+doesn't even revalidate them; the plain URLs keep working with an ETag, so revalidating them
+costs a 304. Assets are public: only the HTML entry points need a session.
+Changes to the frontend files are picked up when the workers restart.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS_PREFIX = "/assets/"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESSED_SIZE = 256 # Smaller files aren't worth a Content-Encoding
+ENCODING_PREFERENCE = ("br", "gzip")
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+EXCLUDED_EXTENSIONS = (".html",) # Entry points: rendered, and behind the session check
+
+
+class Asset:
+    """One file: its content hash, MIME type and bytes per content coding (None: identity)."""
+
+    def __init__(self, name, data):
+        self.name = name
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        base, extension = os.path.splitext(name)
+        self.hashed_name = f"{base}.{self.digest}{extension}"
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        textual = self.mimetype.startswith("text/") or self.mimetype == "application/javascript"
+        self.content_type = f"{self.mimetype}; charset=utf-8" if textual else self.mimetype
+        self.variants = {None: data}
+        if len(data) >= MIN_COMPRESSED_SIZE and self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            compressed = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(data, quality=11)
+            self.variants.update({encoding: body for encoding, body in compressed.items() if len(body) < len(data)})
+
+    def etag(self, encoding):
+        return f'"{self.digest}{ETAG_SUFFIXES.get(encoding, "")}"'
+
+
+def accepted_encodings(header):
+    """Content codings allowed by an Accept-Encoding header ('*' allows any)."""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, parameters = part.partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip() and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class StaticAssets:
+    """The assets found under `root`, by plain and by hashed name."""
+
+    def __init__(self, root):
+        self.root = root
+        self.by_name = {}
+        self.by_hashed_name = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if filename.startswith(".") or filename.endswith(EXCLUDED_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, filename)
+                with open(path, "rb") as asset_file:
+                    asset = Asset(os.path.relpath(path, root).replace(os.sep, "/"), asset_file.read())
+                self.by_name[asset.name] = asset
+                self.by_hashed_name[asset.hashed_name] = asset
+
+    def url(self, name):
+        """Immutable URL of the asset `name` (e.g. "js/app.js"); its plain path if unknown."""
+        asset = self.by_name.get(name)
+        return ASSETS_PREFIX + asset.hashed_name if asset else "/" + name
+
+    def respond(self, asset, accept_encoding, if_none_match, immutable):
+        """(status, body, headers) for a GET of `asset` with the given request headers."""
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next(
+            (encoding for encoding in ENCODING_PREFERENCE if encoding in asset.variants and (encoding in accepted or "*" in accepted)),
+            None
+        )
+        etag = asset.etag(encoding)
+        headers = [
+            ("Cache-Control", IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL),
+            ("ETag", etag),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if etag_matches(if_none_match, etag):
+            return 304, b"", headers
+        if encoding:
+            headers.append(("Content-Encoding", encoding))
+        body = asset.variants[encoding]
+        headers += [("Content-Type", asset.content_type), ("Content-Length", str(len(body)))]
+        return 200, body, headers
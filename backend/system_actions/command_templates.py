@@ -0,0 +1,85 @@
+# backend/system_actions/command_templates.py
+"""
+Parsing of command templates into argv form.
+A template without shell syntax (pipes, redirections, variables, globs, ...) is split once
+with shlex and executed directly, without a /bin/sh in between; the executable is looked up
+in PATH once and re-checked with a single stat() per run. Templates that need a shell keep
+using one. The "{}" placeholder is substituted into a single argv element (or shell-quoted
+for the shell fallback), so a value can never inject extra arguments or commands.
+"""
+import functools
+import os
+import shlex
+import shutil
+
+PLACEHOLDER = "{}"
+# Characters that only a shell can interpret ("{}" is removed before checking)
+SHELL_METACHARACTERS = set("|&;<>()$`\\*?[]{}~#!\n")
+
+
+class CommandTemplate:
+    """A parsed command template: `argv` for direct execution, or None if it needs a shell."""
+
+    def __init__(self, template):
+        self.template = template
+        self.argv = None
+        if not any(char in SHELL_METACHARACTERS for char in template.replace(PLACEHOLDER, "")):
+            try:
+                argv = shlex.split(template)
+            except ValueError: # Unbalanced quotes: let the shell report it
+                argv = []
+            # A leading VAR=value is an environment assignment, which only the shell understands
+            if argv and "=" not in argv[0]:
+                self.argv = argv
+
+    def render_argv(self, value=None):
+        if value is None:
+            return list(self.argv)
+        return [arg.replace(PLACEHOLDER, str(value)) for arg in self.argv]
+
+    def render_shell(self, value=None):
+        if value is None or PLACEHOLDER not in self.template:
+            return self.template
+        return self.template.replace(PLACEHOLDER, shlex.quote(str(value)))
+
+
+@functools.lru_cache(maxsize=256)
+def compile_command(template):
+    """Parses a template once; later calls with the same string reuse the result."""
+    return CommandTemplate(template)
+
+
+# (name, PATH) -> (resolved path, (st_ino, st_mtime_ns))
+_executable_cache = {}
+
+
+def _identity(path):
+    stat_result = os.stat(path)
+    return stat_result.st_ino, stat_result.st_mtime_ns
+
+
+def resolve_executable(name):
+    """
+    Full path of `name` looked up in PATH, cached. The cached path is revalidated with one
+    stat(): if the binary was removed, replaced or upgraded, PATH is searched again.
+    Raises FileNotFoundError if it can't be found.
+    """
+    if os.sep in name:
+        return name
+    search_path = os.environ.get("PATH", os.defpath)
+    key = (name, search_path)
+    cached = _executable_cache.get(key)
+    if cached is not None:
+        path, identity = cached
+        try:
+            if _identity(path) == identity:
+                return path
+        except OSError:
+            pass
+
+    path = shutil.which(name, path=search_path)
+    if path is None:
+        _executable_cache.pop(key, None)
+        raise FileNotFoundError(name)
+    _executable_cache[key] = (path, _identity(path))
+    return path
@@ -1,8 +1,11 @@
 # backend/system_actions/linux_actions.py
 import subprocess
 import os
+import signal
 import re # Importar para expresiones regulares
 
+from system_actions.command_templates import compile_command, resolve_executable
+
 # Define los comandos por defecto para Linux
 # Estos son los valores que se usarán si no hay comandos personalizados en la DB
 DEFAULT_COMMANDS = {
@@ -37,30 +40,85 @@ SUCCESS_COMMANDS_MESSAGES = {
     "get_mute_status_cmd": "Get mute status command executed successfully."
 }
 
-def execute_shell_command(command_string, command_action, level_placeholder=None):
+# Tiempo máximo (segundos) de cada comando; al vencer se mata el grupo de procesos completo.
+# Las acciones declaran el suyo en action_registry.py
+DEFAULT_COMMAND_TIMEOUT = 10
+COMMAND_TIMEOUTS = {
+    "get_volume_cmd": 5,
+    "get_mute_status_cmd": 5,
+}
+
+# Comandos de solo lectura: segundos que se reutiliza su resultado (ver query_cache.py).
+# Los de volumen y mute no: solo los lee el MediaMonitor, cuando pactl avisa de un cambio
+QUERY_COMMAND_TTLS = {
+    "get_cpu_usage_cmd": 1,
+    "get_ram_usage_cmd": 2,
+    "get_uptime_cmd": 30,
+}
+
+def command_timeout(command_action):
+    return COMMAND_TIMEOUTS.get(command_action, DEFAULT_COMMAND_TIMEOUT)
+
+def _kill_process_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+def execute_shell_command(command_string, command_action, level_placeholder=None, timeout=None, on_spawn=None):
     """
-    Ejecuta un comando de shell.
+    Ejecuta un comando.
     Si level_placeholder es un valor, reemplaza el placeholder en el comando.
+    Simple templates are executed directly (no /bin/sh); only those with shell syntax go
+    through the shell. The command runs in its own process group, which is killed if it outlives `timeout`
+    (by default the command's entry in COMMAND_TIMEOUTS). `on_spawn(process)` is called
+    right after the child starts, e.g. to record its PID so the job can be cancelled.
     """
-    if level_placeholder is not None and "{}" in command_string:
-        command_string = command_string.format(level_placeholder)
+    template = compile_command(command_string)
+    command_string = template.render_shell(level_placeholder) # Para los mensajes y el fallback de shell
+    if timeout is None:
+        timeout = command_timeout(command_action)
     
     try:
-        # Se usa shell=True para permitir comandos con pipes (||) como en lock_cmd o set_volume_cmd
-        result = subprocess.run(command_string, shell=True, check=True, capture_output=True, text=True)
+        if template.argv is not None:
+            argv = template.render_argv(level_placeholder)
+            process = subprocess.Popen(
+                argv, executable=resolve_executable(argv[0]),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True
+            )
+        else:
+            # Solo los comandos con sintaxis de shell (pipes, ||, redirecciones...) pasan por /bin/sh
+            process = subprocess.Popen(
+                command_string, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                start_new_session=True # Grupo de procesos propio: el timeout mata también a los hijos del shell
+            )
+        if on_spawn:
+            on_spawn(process)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill_process_group(process)
+            process.communicate()
+            print(f"Command timed out after {timeout}s: '{command_string}'")
+            return {"success": False, "message": f"Command timed out after {timeout} seconds.", "timed_out": True}
+
         print(f"Command executed: '{command_string}'")
-        stdout_message = result.stdout.strip()
+        stdout_message = stdout.strip()
         print(f"Stdout: {stdout_message}")
-        if result.stderr:
-            print(f"Stderr: {result.stderr.strip()}")
+        if stderr:
+            print(f"Stderr: {stderr.strip()}")
+
+        if process.returncode != 0:
+            if process.returncode < 0:
+                error_message = f"Command '{command_string}' was terminated by signal {-process.returncode}."
+            else:
+                error_message = stderr.strip() or f"Command '{command_string}' failed with exit code {process.returncode}."
+            print(f"Error executing command: {error_message}")
+            return {"success": False, "message": error_message}
         
-        final_message = stdout_message if stdout_message else SUCCESS_COMMANDS_MESSAGES[command_action]
+        final_message = stdout_message if stdout_message else SUCCESS_COMMANDS_MESSAGES.get(command_action, "Command executed successfully.")
         
         return {"success": True, "message": final_message}
-    except subprocess.CalledProcessError as e:
-        error_message = e.stderr.strip() or f"Command '{command_string}' failed with exit code {e.returncode}."
-        print(f"Error executing command: {error_message}")
-        return {"success": False, "message": error_message}
     except FileNotFoundError:
         return {"success": False, "message": f"Command not found for: '{command_string.split(' ')[0]}'."}
     except Exception as e:
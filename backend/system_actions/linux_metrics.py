@@ -0,0 +1,258 @@
+# backend/system_actions/linux_metrics.py
+"""
+Native /proc readers for the system metrics.
+They replace the grep/awk/free/uptime shell pipelines from DEFAULT_COMMANDS:
+no process is spawned, only kernel pseudo-files are read.
+"""
+import heapq
+import os
+import time
+
+PROC_STAT = "/proc/stat"
+PROC_MEMINFO = "/proc/meminfo"
+PROC_UPTIME = "/proc/uptime"
+PROC_DIR = "/proc"
+PROC_DISKSTATS = "/proc/diskstats"
+PROC_NET_DEV = "/proc/net/dev"
+SYS_BLOCK = "/sys/block"
+SECTOR_SIZE = 512 # /proc/diskstats always counts 512-byte sectors
+
+
+def _cpu_counters(line):
+    fields = [int(value) for value in line.split()[1:]]
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    # guest/guest_nice (fields 8 and 9) are already included in user/nice
+    total = sum(fields[:8])
+    return total - idle, total
+
+
+def read_cpu_times(path=PROC_STAT):
+    """
+    Returns the CPU counters from /proc/stat as (aggregate, per_core), where each entry is
+    a (busy, total) tuple of jiffies. iowait counts as idle time, matching what top and htop report.
+    """
+    with open(path, "rb") as f:
+        aggregate = _cpu_counters(f.readline())
+        per_core = []
+        for line in f:
+            if not line.startswith(b"cpu"):
+                break # The per-core lines come right after the aggregate one
+            per_core.append(_cpu_counters(line))
+    return aggregate, per_core
+
+
+def cpu_percent(previous, current):
+    """
+    Computes CPU utilization between two (busy, total) samples.
+    Returns None when there is no elapsed time to compare against.
+    """
+    if previous is None or current is None:
+        return None
+    busy_delta = current[0] - previous[0]
+    total_delta = current[1] - previous[1]
+    if total_delta <= 0:
+        return None
+    return round(max(0.0, min(100.0, busy_delta * 100.0 / total_delta)), 1)
+
+
+def read_memory_usage(path=PROC_MEMINFO):
+    """
+    Returns used RAM as a percentage of MemTotal, where used = MemTotal - MemAvailable
+    (the same figure `free` reports in its 'used' column).
+    """
+    total = available = None
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"MemTotal:"):
+                total = int(line.split()[1])
+            elif line.startswith(b"MemAvailable:"):
+                available = int(line.split()[1])
+            if total is not None and available is not None:
+                break
+    if not total or available is None:
+        return None
+    return float(round((total - available) * 100.0 / total))
+
+
+def read_uptime_seconds(path=PROC_UPTIME):
+    """Returns the system uptime in seconds from /proc/uptime."""
+    with open(path, "rb") as f:
+        return float(f.read().split()[0])
+
+
+def format_uptime(seconds):
+    """
+    Formats an uptime in seconds like `uptime -p` does (without the leading 'up'),
+    e.g. '2 days, 3 hours, 4 minutes'.
+    """
+    if seconds is None:
+        return None
+    minutes_total = int(seconds) // 60
+    weeks, remainder = divmod(minutes_total, 7 * 24 * 60)
+    days, remainder = divmod(remainder, 24 * 60)
+    hours, minutes = divmod(remainder, 60)
+
+    parts = []
+    for value, unit in ((weeks, "week"), (days, "day"), (hours, "hour"), (minutes, "minute")):
+        if value:
+            parts.append(f"{value} {unit}{'s' if value != 1 else ''}")
+    return ", ".join(parts) if parts else "0 minutes"
+
+
+class DiskStatsReader:
+    """
+    Reads cumulative per-device I/O counters from /proc/diskstats.
+    Only whole disks are reported (partitions, loop and ram devices are skipped); the
+    include/skip decision is cached per device name, so /sys is only consulted for new devices.
+    """
+
+    def __init__(self, path=PROC_DISKSTATS, sys_block=SYS_BLOCK):
+        self.path = path
+        self.sys_block = sys_block
+        self._included = {}
+
+    def _include(self, name):
+        included = self._included.get(name)
+        if included is None:
+            included = (not name.startswith(("loop", "ram", "zram"))
+                        and os.path.exists(os.path.join(self.sys_block, name.replace("/", "!"))))
+            self._included[name] = included
+        return included
+
+    def read(self):
+        """Returns {device: (read_bytes, write_bytes, reads_completed, writes_completed)}."""
+        counters = {}
+        with open(self.path, "rb") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 10:
+                    continue
+                name = fields[2].decode()
+                if not self._include(name):
+                    continue
+                counters[name] = (
+                    int(fields[5]) * SECTOR_SIZE,
+                    int(fields[9]) * SECTOR_SIZE,
+                    int(fields[3]),
+                    int(fields[7]),
+                )
+        return counters
+
+
+class NetDevReader:
+    """
+    Reads cumulative per-interface traffic counters from /proc/net/dev.
+    The loopback interface is skipped; interface names are decoded once and cached.
+    """
+
+    def __init__(self, path=PROC_NET_DEV):
+        self.path = path
+        self._names = {}
+
+    def read(self):
+        """Returns {interface: (rx_bytes, tx_bytes, rx_packets, tx_packets)}."""
+        counters = {}
+        with open(self.path, "rb") as f:
+            f.readline() # Two header lines
+            f.readline()
+            for line in f:
+                raw_name, _, values = line.partition(b":")
+                name = self._names.get(raw_name)
+                if name is None:
+                    name = self._names[raw_name] = raw_name.strip().decode()
+                if name == "lo":
+                    continue
+                fields = values.split()
+                if len(fields) < 10:
+                    continue
+                counters[name] = (int(fields[0]), int(fields[8]), int(fields[1]), int(fields[9]))
+        return counters
+
+
+def counter_rates(previous, current, elapsed, names):
+    """
+    Turns two snapshots of cumulative counters ({key: tuple}) into per-second rates.
+    `names` labels the tuple positions. Keys missing from the previous snapshot and
+    counters that went backwards (device reset, wrap-around) are skipped.
+    """
+    rates = {}
+    if not previous or not elapsed or elapsed <= 0:
+        return rates
+    for key, values in current.items():
+        before = previous.get(key)
+        if before is None or any(now < then for now, then in zip(values, before)):
+            continue
+        rates[key] = {name: round((now - then) / elapsed, 1) for name, now, then in zip(names, values, before)}
+    return rates
+
+class ProcessScanner:
+    """
+    Incremental scanner of /proc/[pid]/stat for the top processes by CPU and memory.
+    Keeps (start time, CPU ticks, name) per PID between scans: CPU usage is the tick delta
+    since the previous scan, names are decoded only once per process, and PIDs that exited
+    simply drop out of the cache. A reused PID is detected by its different start time.
+    """
+
+    def __init__(self, proc_dir=PROC_DIR):
+        self.proc_dir = proc_dir
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._cache = {}
+        self._last_scan = None
+
+    def _read_stat(self, pid):
+        fd = os.open(f"{self.proc_dir}/{pid}/stat", os.O_RDONLY)
+        try:
+            return os.read(fd, 4096)
+        finally:
+            os.close(fd)
+
+    def scan(self, limit):
+        """
+        Scans every live process once and returns {'top_cpu': [...], 'top_memory': [...]}
+        with at most `limit` entries each. CPU percentages are per core, like top (100 = one core);
+        processes seen for the first time have no CPU figure until the next scan.
+        """
+        now = time.monotonic()
+        elapsed = now - self._last_scan if self._last_scan is not None else None
+        self._last_scan = now
+
+        cache = {}
+        processes = []
+        for entry in os.listdir(self.proc_dir):
+            if not entry.isdigit():
+                continue
+            pid = int(entry)
+            try:
+                data = self._read_stat(pid)
+            except OSError:
+                continue # Exited between listdir and open
+            # The name may contain spaces or parentheses, so split on the last ')'
+            name_end = data.rfind(b")")
+            fields = data[name_end + 2:].split()
+            if len(fields) < 22:
+                continue
+            cpu_ticks = int(fields[11]) + int(fields[12]) # utime + stime
+            start_time = fields[19]
+            rss_bytes = int(fields[21]) * self._page_size
+
+            previous = self._cache.get(pid)
+            if previous is not None and previous[0] == start_time:
+                name = previous[2]
+                cpu_usage = None
+                if elapsed:
+                    cpu_usage = round((cpu_ticks - previous[1]) * 100.0 / (self._clock_ticks * elapsed), 1)
+            else:
+                name = data[data.find(b"(") + 1:name_end].decode(errors="replace")
+                cpu_usage = None
+
+            cache[pid] = (start_time, cpu_ticks, name)
+            processes.append({"pid": pid, "name": name, "cpu_usage": cpu_usage, "rss_bytes": rss_bytes})
+        self._cache = cache
+
+        return {
+            "top_cpu": heapq.nlargest(limit, (p for p in processes if p["cpu_usage"] is not None),
+                                      key=lambda p: p["cpu_usage"]),
+            "top_memory": heapq.nlargest(limit, processes, key=lambda p: p["rss_bytes"]),
+            "process_count": len(processes),
+        }
@@ -0,0 +1,172 @@
+# backend/system_actions/media_monitor.py
+"""
+Event-driven audio and media state.
+Two long-lived subscribers run in the leader process: `pactl subscribe` reports changes
+on the sinks (volume, mute, default device) and `playerctl --follow` prints the player
+status and the now-playing track whenever they change. Audio events only trigger a re-read
+of the volume and mute commands, debounced so a dragged slider costs one read; without a
+working subscriber the volume is polled instead. A subscriber that dies is respawned with
+exponential backoff. Every change is handed to `publish(state)`.
+"""
+import subprocess
+import threading
+import time
+
+from system_actions.command_templates import resolve_executable
+
+AUDIO_SUBSCRIBE_ARGV = ["pactl", "subscribe"]
+MEDIA_FIELDS = ("status", "player", "artist", "title", "album")
+MEDIA_FOLLOW_ARGV = [
+    "playerctl", "--follow", "metadata", "--format",
+    "{{status}}\t{{playerName}}\t{{artist}}\t{{title}}\t{{album}}",
+]
+# pactl subscribe targets whose events can change the volume or mute state of the default sink
+AUDIO_EVENT_TARGETS = ("sink", "server", "card")
+
+RESPAWN_MIN_DELAY = 1.0
+RESPAWN_MAX_DELAY = 60.0
+STABLE_RUN_SECONDS = 30.0 # A subscriber that ran this long starts over from the minimum delay
+AUDIO_DEBOUNCE = 0.05
+AUDIO_POLL_INTERVAL = 5.0 # Without a subscriber
+AUDIO_RESYNC_INTERVAL = 60.0 # With one, in case an event was missed
+CONFIG_CHECK_INTERVAL = 1.0
+
+
+def parse_media_line(line):
+    """Parses one line of MEDIA_FOLLOW_ARGV output; an empty line means no player."""
+    values = line.rstrip("\n").split("\t")
+    if len(values) != len(MEDIA_FIELDS) or not values[0]:
+        return dict.fromkeys(MEDIA_FIELDS)
+    return {field: (value or None) for field, value in zip(MEDIA_FIELDS, values)}
+
+
+def is_audio_event(line):
+    """True for pactl subscribe lines like "Event 'change' on sink #54"."""
+    words = line.split()
+    return len(words) >= 4 and words[0] == "Event" and words[3] in AUDIO_EVENT_TARGETS
+
+
+class MediaMonitor:
+    """
+    Keeps {'audio': {...}, 'media': {...}} up to date.
+    `read_audio()` returns (level, is_muted) by running the configured commands;
+    `config_version()`, if given, changes when those commands are edited.
+    """
+
+    def __init__(self, read_audio, publish, config_version=None):
+        self.read_audio = read_audio
+        self.publish = publish
+        self.config_version = config_version
+        self._lock = threading.Lock()
+        self._refresh = threading.Event()
+        self._stopped = threading.Event()
+        self._processes = {}
+        self._subscribed = {"audio": False, "media": False}
+        self._state = {
+            "audio": {"level": None, "is_muted": None, "updated_at": None, "source": None},
+            "media": dict(dict.fromkeys(MEDIA_FIELDS), updated_at=None, available=False),
+        }
+
+    def start(self):
+        threading.Thread(target=self._refresh_audio_loop, name="audio-refresh", daemon=True).start()
+        threading.Thread(
+            target=self._supervise, args=("audio", AUDIO_SUBSCRIBE_ARGV, self._on_audio_line),
+            name="audio-subscriber", daemon=True
+        ).start()
+        threading.Thread(
+            target=self._supervise, args=("media", MEDIA_FOLLOW_ARGV, self._on_media_line),
+            name="media-subscriber", daemon=True
+        ).start()
+
+    def stop(self):
+        """Stops the loops and terminates the subscriber processes."""
+        self._stopped.set()
+        self._refresh.set()
+        for process in list(self._processes.values()):
+            if process.poll() is None:
+                process.terminate()
+
+    def _update(self, section, values):
+        with self._lock:
+            current = self._state[section]
+            changed = any(current.get(key) != value for key, value in values.items())
+            if not changed and current["updated_at"] is not None:
+                return
+            self._state[section] = dict(current, **values, updated_at=time.time())
+            snapshot = {key: dict(value) for key, value in self._state.items()}
+        self.publish(snapshot)
+
+    def _supervise(self, name, argv, on_line):
+        """Runs `argv` forever, feeding each output line to `on_line`; respawns with backoff."""
+        delay = RESPAWN_MIN_DELAY
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            try:
+                process = subprocess.Popen(
+                    argv, executable=resolve_executable(argv[0]),
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+                    text=True, bufsize=1
+                )
+            except OSError as e:
+                print(f"Warning: Could not start the {name} subscriber ({argv[0]}): {e}. Retrying in {delay:.0f}s.")
+            else:
+                self._processes[name] = process
+                self._set_subscribed(name, True)
+                try:
+                    for line in process.stdout:
+                        on_line(line)
+                except Exception as e:
+                    print(f"Warning: The {name} subscriber failed: {e}")
+                finally:
+                    if process.poll() is None:
+                        process.terminate()
+                    process.wait()
+                    self._set_subscribed(name, False)
+                if self._stopped.is_set():
+                    return
+                if time.monotonic() - started >= STABLE_RUN_SECONDS:
+                    delay = RESPAWN_MIN_DELAY
+                print(f"Warning: The {name} subscriber exited with code {process.returncode}. Respawning in {delay:.0f}s.")
+            self._stopped.wait(delay)
+            delay = min(delay * 2, RESPAWN_MAX_DELAY)
+
+    def _set_subscribed(self, name, subscribed):
+        self._subscribed[name] = subscribed
+        if name == "audio":
+            self._refresh.set() # Re-read now: events may have been missed while it was down
+        elif not subscribed:
+            self._update("media", dict(dict.fromkeys(MEDIA_FIELDS), available=False))
+
+    def _on_audio_line(self, line):
+        if is_audio_event(line):
+            self._refresh.set()
+
+    def _on_media_line(self, line):
+        self._update("media", dict(parse_media_line(line), available=True))
+
+    def _refresh_audio_loop(self):
+        last_refresh = 0.0
+        last_config = None
+        while not self._stopped.is_set():
+            interval = AUDIO_RESYNC_INTERVAL if self._subscribed["audio"] else AUDIO_POLL_INTERVAL
+            wait = max(0.0, last_refresh + interval - time.monotonic())
+            if self.config_version is not None:
+                wait = min(wait, CONFIG_CHECK_INTERVAL)
+            if self._refresh.wait(wait):
+                self._stopped.wait(AUDIO_DEBOUNCE) # Let a burst of events settle
+                self._refresh.clear()
+            else:
+                config = self.config_version() if self.config_version is not None else None
+                if config == last_config and time.monotonic() - last_refresh < interval:
+                    continue
+            if self._stopped.is_set():
+                return
+            last_config = self.config_version() if self.config_version is not None else None
+            last_refresh = time.monotonic()
+            try:
+                level, muted = self.read_audio()
+            except Exception as e:
+                print(f"Warning: Could not read the audio state: {e}")
+                continue
+            source = "subscriber" if self._subscribed["audio"] else "polling"
+            self._update("audio", {"level": level, "is_muted": muted, "source": source})
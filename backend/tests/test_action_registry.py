@@ -0,0 +1,41 @@
+import pytest
+
+from action_registry import BUILTIN_ACTIONS, build_registry, validate_definition
+
+
+def stored(name, **fields):
+    row = {"name": name, "label": name, "permission": "shutdown", "command": "true", "params": "{}", "timeout": None, "idempotent": 0}
+    row.update(fields)
+    return row
+
+
+def test_only_the_volume_slider_coalesces():
+    assert [action.name for action in BUILTIN_ACTIONS if action.coalesce] == ["set_volume"]
+
+
+def test_power_actions_are_never_retried():
+    registry = build_registry([])
+    assert not registry["shutdown"].idempotent and not registry["restart"].idempotent
+    assert registry["lock"].idempotent and not registry["lock"].coalesce
+
+
+def test_user_actions_can_be_retried_but_never_coalesce():
+    registry = build_registry([stored("flush_dns", idempotent=1)])
+    action = registry["flush_dns"]
+    assert action.idempotent and not action.coalesce and not action.builtin
+    assert action.describe()["coalesce"] is False
+
+
+def test_invalid_stored_rows_are_skipped():
+    registry = build_registry([stored("shutdown"), stored("Bad Name")])
+    assert registry["shutdown"].builtin and "Bad Name" not in registry
+
+
+@pytest.mark.parametrize("data, message", [
+    ({"command": "", "permission": "shutdown"}, "empty"),
+    ({"command": "echo", "permission": "root"}, "Unknown permission"),
+    ({"command": "echo", "permission": "shutdown", "idempotent": "yes"}, "idempotent"),
+])
+def test_validate_definition_rejects(data, message):
+    with pytest.raises(ValueError, match=message):
+        validate_definition("custom", data)
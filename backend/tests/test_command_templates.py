@@ -0,0 +1,84 @@
+import os
+import shlex
+
+import pytest
+
+from system_actions.command_templates import CommandTemplate, compile_command, resolve_executable
+from system_actions.linux_actions import execute_shell_command
+
+INJECTIONS = ("5; touch {marker}", "$(touch {marker})", "`touch {marker}`", "5 && touch {marker}", "5 | touch {marker}")
+
+
+@pytest.mark.parametrize("template", [
+    "pactl set-sink-volume @DEFAULT_SINK@ {}%",
+    "loginctl lock-session 1",
+    "playerctl play-pause",
+    "sh -c 'echo hi'", # Quoted: shlex keeps it as one argument, no outer shell needed
+])
+def test_plain_templates_run_without_a_shell(template):
+    assert CommandTemplate(template).argv == shlex.split(template)
+
+
+@pytest.mark.parametrize("template", [
+    "grep 'cpu ' /proc/stat | awk '{print $2}'",
+    "free -m > /tmp/out",
+    "cat < /etc/hostname",
+    "true && reboot",
+    "true; reboot",
+    "echo $HOME",
+    "echo `id`",
+    "echo $(id)",
+    "ls *.log",
+    "ls ~",
+    "(reboot)",
+    "echo a\necho b",
+    "DISPLAY=:0 xdg-screensaver lock", # Environment assignment
+    "echo 'unbalanced", # Left for the shell to report
+])
+def test_shell_syntax_needs_the_shell(template):
+    assert CommandTemplate(template).argv is None
+
+
+def test_placeholder_is_one_argument():
+    template = CommandTemplate("pactl set-sink-volume @DEFAULT_SINK@ {}%")
+    assert template.render_argv("5; reboot") == ["pactl", "set-sink-volume", "@DEFAULT_SINK@", "5; reboot%"]
+    assert template.render_argv(40) == ["pactl", "set-sink-volume", "@DEFAULT_SINK@", "40%"]
+    assert template.render_argv() == template.argv and template.render_argv() is not template.argv
+
+
+def test_placeholder_is_quoted_for_the_shell():
+    template = CommandTemplate("echo {} | cat")
+    assert template.argv is None
+    rendered = template.render_shell("$(reboot); `reboot` 'x'")
+    assert shlex.split(rendered) == ["echo", "$(reboot); `reboot` 'x'", "|", "cat"]
+    assert template.render_shell() == "echo {} | cat"
+
+
+@pytest.mark.parametrize("command", ["echo {}", "echo {} | cat"])
+@pytest.mark.parametrize("injection", INJECTIONS)
+def test_values_cannot_inject_commands(tmp_path, command, injection):
+    marker = tmp_path / "injected"
+    value = injection.format(marker=marker)
+    result = execute_shell_command(command, "test_cmd", level_placeholder=value, timeout=5)
+    assert result == {"success": True, "message": value}
+    assert not marker.exists()
+
+
+def test_compile_command_is_cached():
+    assert compile_command("playerctl next") is compile_command("playerctl next")
+
+
+def test_resolve_executable_follows_the_binary(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+    with pytest.raises(FileNotFoundError):
+        resolve_executable("syspilot-test-tool")
+
+    tool = tmp_path / "syspilot-test-tool"
+    tool.write_text("#!/bin/sh\n")
+    tool.chmod(0o755)
+    assert resolve_executable("syspilot-test-tool") == str(tool)
+
+    tool.unlink()
+    with pytest.raises(FileNotFoundError):
+        resolve_executable("syspilot-test-tool")
+    assert resolve_executable(os.path.join("bin", "sh")) == os.path.join("bin", "sh") # Paths aren't looked up
@@ -0,0 +1,287 @@
+import glob
+import importlib
+import json
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import fleet
+from fleet import FleetAggregator
+
+
+class StubNode:
+    """
+    A node answering /api/node/status and /api/node/action/<name> on its own port.
+    `delay`, `action_statuses` (HTTP status of each successive action call) and `stop()` simulate trouble.
+    """
+
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.requests = 0
+        self.action_statuses = []
+        self.actions = []
+        self.stopped = False
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def _handler(self):
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real nodes behind gunicorn
+
+            def do_GET(self):
+                node.requests += 1
+                time.sleep(node.delay)
+                if node.stopped:
+                    self.close_connection = True # Drops the pooled connection without answering
+                    return
+                self.answer({"success": True, "node": {"name": node.name, "served": node.requests}})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"null")
+                node.actions.append((self.path, self.headers.get("Authorization"), body))
+                time.sleep(node.delay)
+                status = node.action_statuses.pop(0) if node.action_statuses else 200
+                if status == 200:
+                    self.answer({"success": True, "status": "completed", "message": f"done on {node.name}", "job_id": "j1"})
+                else:
+                    self.answer({"success": False, "message": "overloaded"}, status)
+
+            def answer(self, body, status=200):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def entry(self):
+        return {"name": self.name, "url": self.url, "token": "secret"}
+
+    def stop(self):
+        self.stopped = True
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_nodes():
+    started = []
+
+    def start(*delays):
+        nodes = [StubNode(f"node{index}", delay) for index, delay in enumerate(delays)]
+        started.extend(nodes)
+        return nodes
+
+    yield start
+    for node in started:
+        if not node.stopped:
+            node.stop()
+
+
+def unused_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def by_name(entries):
+    return {entry["name"]: entry for entry in entries}
+
+
+def test_fleet_view_has_one_entry_per_node(stub_nodes):
+    nodes = stub_nodes(0, 0, 0)
+    entries = FleetAggregator(timeout=2).status([node.entry() for node in nodes])
+    assert [entry["name"] for entry in entries] == ["node0", "node1", "node2"]
+    for entry, node in zip(entries, nodes):
+        assert entry["state"] == "ok" and entry["source"] == "pull" and entry["error"] is None
+        assert entry["url"] == node.url and entry["data"]["name"] == node.name
+        assert entry["latency_ms"] is not None and entry["updated_at"] <= time.time()
+
+
+def test_latency_follows_the_slowest_node_not_the_sum(stub_nodes):
+    nodes = stub_nodes(0.2, 0.3, 0.4)
+    aggregator = FleetAggregator(timeout=2)
+    started = time.monotonic()
+    entries = aggregator.status([node.entry() for node in nodes])
+    elapsed = time.monotonic() - started
+    assert all(entry["state"] == "ok" for entry in entries)
+    assert 0.4 <= elapsed < 0.8 # Sequential requests would take 0.9s
+    assert by_name(entries)["node2"]["latency_ms"] >= 400
+
+
+def test_a_slow_node_only_costs_its_own_timeout(stub_nodes):
+    fast, slow = stub_nodes(0, 3)
+    aggregator = FleetAggregator(timeout=0.5)
+    started = time.monotonic()
+    entries = by_name(aggregator.status([fast.entry(), slow.entry()]))
+    assert time.monotonic() - started < 1.5
+    assert entries["node0"]["state"] == "ok"
+    assert entries["node1"]["state"] == "down" and entries["node1"]["data"] is None
+    assert entries["node1"]["error"] == "No answer within 0.5s"
+
+
+def test_an_unreachable_node_is_down(stub_nodes):
+    up, = stub_nodes(0)
+    entries = by_name(FleetAggregator(timeout=1).status([up.entry(), {"name": "ghost", "url": unused_url()}]))
+    assert entries["node0"]["state"] == "ok"
+    assert entries["ghost"]["state"] == "down" and entries["ghost"]["error"]
+
+
+def test_a_node_that_goes_down_keeps_its_last_known_state(stub_nodes):
+    steady, flaky = stub_nodes(0, 0)
+    aggregator = FleetAggregator(timeout=0.5, cache_ttl=0)
+    nodes = [steady.entry(), flaky.entry()]
+    before = by_name(aggregator.status(nodes))["node1"]
+    assert before["state"] == "ok"
+
+    flaky.stop()
+    after = by_name(aggregator.status(nodes))
+    assert after["node0"]["state"] == "ok"
+    assert after["node1"]["state"] == "stale" and after["node1"]["error"]
+    assert after["node1"]["data"] == before["data"] and after["node1"]["updated_at"] == before["updated_at"]
+
+
+def test_a_node_that_hangs_keeps_its_last_known_state(stub_nodes):
+    node, = stub_nodes(0)
+    aggregator = FleetAggregator(timeout=0.3, cache_ttl=0)
+    before, = aggregator.status([node.entry()])
+    node.delay = 2
+    after, = aggregator.status([node.entry()])
+    assert after["state"] == "stale" and after["error"] == "No answer within 0.3s"
+    assert after["data"] == before["data"]
+
+
+def test_fresh_results_are_cached(stub_nodes):
+    node, = stub_nodes(0)
+    aggregator = FleetAggregator(timeout=1, cache_ttl=60)
+    first, = aggregator.status([node.entry()])
+    second, = aggregator.status([node.entry()])
+    assert node.requests == 1
+    assert second["state"] == "ok" and second["data"] == first["data"] and second["latency_ms"] is None
+
+
+def test_concurrent_views_share_one_request_per_node(stub_nodes):
+    node, = stub_nodes(0.3)
+    aggregator = FleetAggregator(timeout=2, cache_ttl=0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(aggregator.status([node.entry()]))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4 and all(entries[0]["state"] == "ok" for entries in results)
+    assert node.requests == 1
+
+
+def collect(results):
+    return {result["node"]: result for result in results}
+
+
+def test_broadcast_reports_every_node_including_the_failing_ones(stub_nodes):
+    ok, failing = stub_nodes(0, 0)
+    failing.action_statuses = [500]
+    nodes = [ok.entry(), failing.entry(), {"name": "ghost", "url": unused_url()}]
+    results = collect(FleetAggregator(timeout=1).broadcast(nodes, "lock", {}))
+    assert results["node0"]["success"] and results["node0"]["status"] == "completed" and results["node0"]["job_id"] == "j1"
+    assert not results["node1"]["success"] and results["node1"]["status"] == "http_500"
+    assert results["node1"]["message"] == "overloaded"
+    assert not results["ghost"]["success"] and results["ghost"]["status"] == "error"
+    assert ok.actions == [("/api/node/action/lock", "Bearer secret", {})]
+
+
+def test_broadcast_yields_each_result_as_it_arrives(stub_nodes):
+    fast, slow = stub_nodes(0, 0.5)
+    started = time.monotonic()
+    arrivals = []
+    for result in FleetAggregator(timeout=2).broadcast([slow.entry(), fast.entry()], "lock", {}):
+        arrivals.append((result["node"], time.monotonic() - started))
+    assert [name for name, _ in arrivals] == ["node0", "node1"]
+    assert arrivals[0][1] < 0.3 <= arrivals[1][1]
+
+
+def test_broadcast_retries_overloaded_nodes_only_when_asked(stub_nodes, monkeypatch):
+    monkeypatch.setattr(fleet, "RETRY_DELAY", 0.01)
+    once, retried = stub_nodes(0, 0)
+    once.action_statuses = [503]
+    retried.action_statuses = [503]
+    aggregator = FleetAggregator(timeout=1)
+    assert collect(aggregator.broadcast([once.entry()], "lock", {}))["node0"]["attempts"] == 1
+    result = collect(aggregator.broadcast([retried.entry()], "lock", {}, retries=2))["node1"]
+    assert result["success"] and result["attempts"] == 2
+
+
+def test_broadcast_deadline_reports_the_slow_nodes_as_timed_out(stub_nodes):
+    fast, slow = stub_nodes(0, 2)
+    results = collect(FleetAggregator(timeout=5).broadcast(
+        [fast.entry(), slow.entry()], "lock", {}, deadline=time.monotonic() + 0.5
+    ))
+    assert results["node0"]["success"]
+    assert results["node1"]["status"] == "timeout" and results["node1"]["attempts"] is None
+
+
+@pytest.fixture(scope="module")
+def aggregator_client(tmp_path_factory):
+    """The Flask app in aggregator mode, with a logged-in admin client."""
+    directory = tmp_path_factory.mktemp("aggregator")
+    database = str(directory / "syspilot.db")
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in {
+            "SECRET_KEY": "x" * 32, "DATABASE_FILENAME": database,
+            "METRICS_ARCHIVE_FILENAME": str(directory / "metrics.db"),
+            "DEFAULT_USERNAME": "admin", "DEFAULT_PASSWORD": "secret", "FLEET_MODE": "aggregator",
+        }.items():
+            patch.setenv(name, value)
+        sys.modules.pop("app", None)
+        app = importlib.import_module("app")
+    client = app.app.test_client()
+    assert client.post("/api/login", json={"username": "admin", "password": "secret"}).status_code == 200
+    yield client
+    sys.modules.pop("app", None)
+    for path in glob.glob(app.default_region_path(app.DATABASE) + "*"):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def test_ndjson_broadcast_streams_one_line_per_node_and_a_summary(aggregator_client, stub_nodes):
+    ok, failing, slow = stub_nodes(0, 0, 0.5)
+    failing.action_statuses = [500]
+    for node in (ok, failing, slow):
+        assert aggregator_client.put(f"/api/fleet/nodes/{node.name}", json={"url": node.url, "token": "secret"}).status_code == 200
+
+    started = time.monotonic()
+    response = aggregator_client.post("/api/fleet/actions/lock", json={"timeout": 2}, buffered=False)
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    lines = []
+    for chunk in response.response:
+        lines.append((json.loads(chunk), time.monotonic() - started))
+    response.close()
+
+    results = {line["node"]: (line, elapsed) for line, elapsed in lines[:-1]}
+    assert set(results) == {"node0", "node1", "node2"}
+    assert results["node0"][0]["success"] and results["node0"][1] < 0.3 # Streamed before the slow node answered
+    assert not results["node1"][0]["success"] and results["node1"][0]["status"] == "http_500"
+    assert results["node2"][0]["success"] and results["node2"][1] >= 0.5
+    assert lines[-1][0] == {"done": True, "action": "lock", "total": 3, "succeeded": 2, "failed": 1}
+
+
+def test_ndjson_broadcast_rejects_retries_of_non_idempotent_actions(aggregator_client):
+    response = aggregator_client.post("/api/fleet/actions/shutdown", json={"retries": 1})
+    assert response.status_code == 400 and "cannot be retried" in response.get_json()["message"]
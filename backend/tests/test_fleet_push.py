@@ -0,0 +1,187 @@
+import socket
+import time
+
+import pytest
+
+import fleet_push
+from fleet_push import PROTOCOL_VERSION, FrameCodec, ProtocolError, PushAgent, PushCollector, diff, flatten, unflatten
+
+WAIT = 5
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + WAIT
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def decode_frames(codec, data):
+    """Splits a byte string into frames and decodes them in order."""
+    messages = []
+    while data:
+        length = codec.frame_length(data[:4])
+        messages.append(codec.decode(data[4:4 + length]))
+        data = data[4 + length:]
+    return messages
+
+
+def test_codec_round_trip():
+    sender, receiver = FrameCodec(), FrameCodec()
+    messages = [{"type": "hello", "node": "web1"}, {"type": "updates", "updates": [{"seq": 1, "fields": {"cpu": 12.5, "name": "é"}}]}]
+    assert decode_frames(receiver, b"".join(sender.encode(message) for message in messages)) == messages
+
+
+def test_frames_share_one_zlib_stream():
+    sender, receiver = FrameCodec(), FrameCodec()
+    message = {"type": "updates", "updates": [{"seq": 1, "fields": {"metrics.cpu_usage": 1.0, "metrics.ram_usage": 2.0}}]}
+    first, second = sender.encode(message), sender.encode(message)
+    assert len(second) < len(first) # The field names are already in the compression window
+    assert decode_frames(receiver, first + second) == [message, message]
+    with pytest.raises(ProtocolError):
+        FrameCodec().decode(second[4:]) # Meaningless without the frames before it
+
+
+@pytest.mark.parametrize("payload", [b"not zlib", FrameCodec().encode([1, 2])[4:]])
+def test_invalid_messages_are_rejected(payload):
+    with pytest.raises(ProtocolError):
+        FrameCodec().decode(payload)
+
+
+def test_oversized_frames_and_messages_are_rejected(monkeypatch):
+    with pytest.raises(ProtocolError):
+        FrameCodec().frame_length((fleet_push.MAX_FRAME_BYTES + 1).to_bytes(4, "big"))
+    monkeypatch.setattr(fleet_push, "MAX_MESSAGE_BYTES", 64)
+    with pytest.raises(ProtocolError):
+        FrameCodec().decode(FrameCodec().encode({"padding": "x" * 200})[4:])
+
+
+def test_flatten_diff_and_apply():
+    previous = flatten({"name": "web1", "metrics": {"cpu": 10, "ram": 50}, "audio": {"level": 40}})
+    assert previous == {"name": "web1", "metrics.cpu": 10, "metrics.ram": 50, "audio.level": 40}
+    current = flatten({"name": "web1", "metrics": {"cpu": 15, "ram": 50}, "disks": []})
+    changed, removed = diff(previous, current)
+    assert changed == {"metrics.cpu": 15, "disks": []} and removed == ["audio.level"]
+
+    applied = dict(previous, **changed)
+    for key in removed:
+        del applied[key]
+    assert unflatten(applied) == {"name": "web1", "metrics": {"cpu": 15, "ram": 50}, "disks": []}
+
+
+class RawAgent:
+    """Speaks the agent side of the protocol by hand, to send exactly the updates a test needs."""
+
+    def __init__(self, port, node="web1", token="secret"):
+        self.codec = FrameCodec()
+        deadline = time.monotonic() + WAIT
+        while True:
+            try:
+                self.sock = socket.create_connection(("127.0.0.1", port), timeout=WAIT)
+                break
+            except ConnectionRefusedError:
+                assert time.monotonic() < deadline, "collector not listening"
+                time.sleep(0.02)
+        self.send({"type": "hello", "version": PROTOCOL_VERSION, "node": node, "token": token})
+
+    def send(self, message):
+        self.sock.sendall(self.codec.encode(message))
+
+    def updates(self, *updates):
+        self.send({"type": "updates", "updates": list(updates)})
+
+    def receive(self):
+        header = self._receive_exactly(4)
+        return self.codec.decode(self._receive_exactly(self.codec.frame_length(header)))
+
+    def _receive_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            assert chunk, "connection closed"
+            data += chunk
+        return data
+
+    def close(self):
+        self.sock.close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def collector(monkeypatch):
+    monkeypatch.setattr(fleet_push, "PUBLISH_INTERVAL", 0.01)
+    published = []
+    collector = PushCollector(free_port(), lambda node, token: token == "secret", published.append, host="127.0.0.1")
+    collector.published = published
+    collector.latest = lambda node: published[-1].get(node) if published else None
+    collector.start()
+    return collector
+
+
+def test_collector_applies_snapshots_and_deltas(collector):
+    agent = RawAgent(collector.port)
+    assert agent.receive()["type"] == "welcome"
+    agent.updates(
+        {"seq": 1, "full": True, "fields": {"name": "web1", "metrics.cpu": 10, "audio.level": 40}},
+        {"seq": 2, "fields": {"metrics.cpu": 20}},
+    )
+    agent.updates({"seq": 3, "fields": {"metrics.ram": 30}, "removed": ["audio.level"]})
+    wait_for(lambda: (collector.latest("web1") or {}).get("seq") == 3)
+    state = collector.latest("web1")
+    assert state["connected"] and state["gaps"] == 0
+    assert state["data"] == {"name": "web1", "metrics": {"cpu": 20, "ram": 30}}
+    agent.close()
+    wait_for(lambda: not collector.latest("web1")["connected"])
+
+
+def test_a_sequence_gap_triggers_a_resync(collector):
+    agent = RawAgent(collector.port)
+    agent.receive()
+    agent.updates({"seq": 1, "full": True, "fields": {"metrics.cpu": 10}})
+    agent.updates({"seq": 3, "fields": {"metrics.cpu": 30}}, {"seq": 4, "fields": {"metrics.cpu": 40}}) # 2 was lost
+    assert agent.receive() == {"type": "resync", "seq": 1} # Asked once, not once per useless delta
+    wait_for(lambda: (collector.latest("web1") or {}).get("seq") == 1)
+    assert collector.latest("web1")["data"] == {"metrics": {"cpu": 10}} # The deltas after the gap were dropped
+
+    agent.updates({"seq": 5, "full": True, "fields": {"metrics.cpu": 50}}, {"seq": 6, "fields": {"metrics.cpu": 60}})
+    wait_for(lambda: collector.latest("web1")["seq"] == 6)
+    assert collector.latest("web1")["data"] == {"metrics": {"cpu": 60}}
+    assert collector.latest("web1")["gaps"] == 1
+
+
+def test_a_reconnecting_agent_must_start_with_a_snapshot(collector):
+    first = RawAgent(collector.port)
+    first.receive()
+    first.updates({"seq": 1, "full": True, "fields": {"metrics.cpu": 10}})
+    wait_for(lambda: (collector.latest("web1") or {}).get("seq") == 1)
+
+    second = RawAgent(collector.port) # Same node: replaces the first connection
+    second.receive()
+    second.updates({"seq": 2, "fields": {"metrics.cpu": 20}})
+    assert second.receive()["type"] == "resync"
+    first.close()
+    second.close()
+
+
+def test_unknown_nodes_are_refused(collector):
+    agent = RawAgent(collector.port, token="wrong")
+    assert agent.receive()["type"] == "error"
+    agent.close()
+
+
+def test_agent_pushes_its_status_end_to_end(collector):
+    status = {"name": "web2", "metrics": {"cpu": 5.0}}
+    agent = PushAgent(f"127.0.0.1:{collector.port}", "web2", "secret", lambda: status, interval=0.05, batch_interval=0.05)
+    agent.start()
+    try:
+        wait_for(lambda: (collector.latest("web2") or {}).get("data") == {"name": "web2", "metrics": {"cpu": 5.0}})
+        status = {"name": "web2", "metrics": {"cpu": 7.5, "ram": 1.0}}
+        wait_for(lambda: collector.latest("web2")["data"] == status)
+        assert collector.latest("web2")["gaps"] == 0
+    finally:
+        agent.stop()
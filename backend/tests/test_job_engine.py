@@ -0,0 +1,195 @@
+import os
+import subprocess
+import threading
+
+import pytest
+
+from job_engine import FINAL_STATUSES, JobEngine, JobQueueFull, JobStore
+
+WAIT = 10
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return JobEngine(JobStore(str(tmp_path / "jobs")), max_workers=2, queue_limit=8)
+
+
+class Gate:
+    """A run function that blocks until released, recording the values it was called with."""
+
+    def __init__(self):
+        self.calls = []
+        self.contexts = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def run(self, value, context, on_spawn):
+        self.calls.append(value)
+        self.contexts.append(context)
+        self.started.set()
+        assert self.release.wait(WAIT)
+        return {"success": True, "message": f"applied {value}"}
+
+
+def test_submit_runs_the_job(engine):
+    job = engine.submit("lock_cmd", lambda on_spawn: {"success": True, "message": "locked"}, "alice")
+    assert job["status"] == "queued" and job["user"] == "alice"
+    record = engine.wait([job["id"]], WAIT)[job["id"]]
+    assert record["status"] == "succeeded"
+    assert record["result"] == {"success": True, "message": "locked"}
+
+
+def test_submit_latest_coalesces_to_the_newest_value(engine):
+    gate = Gate()
+    first = engine.submit_latest("set_volume_cmd", 10, gate.run, "alice")
+    assert gate.started.wait(WAIT)
+    burst = [engine.submit_latest("set_volume_cmd", level, gate.run, "alice") for level in (20, 30, 40)]
+    gate.release.set()
+
+    records = engine.wait([job["id"] for job in [first] + burst], WAIT)
+    assert gate.calls == [10, 40] # One run for the whole burst, with its newest value
+    assert records[first["id"]]["result"]["value"] == 10
+    for job in burst:
+        assert records[job["id"]]["status"] == "succeeded"
+        assert records[job["id"]]["result"] == {"success": True, "message": "applied 40", "value": 40}
+
+
+def test_submit_latest_waits_for_the_drainer_of_another_worker(engine):
+    # Another worker holds the drainer lock: the job is left for that drainer
+    other_worker = engine.store.claim_drainer("set_volume_cmd")
+    gate = Gate()
+    gate.release.set()
+    job = engine.submit_latest("set_volume_cmd", 10, gate.run, "alice")
+    assert engine.wait([job["id"]], 0.3)[job["id"]]["status"] == "queued"
+
+    # That worker died (the kernel dropped its flock): the next submission drains both
+    os.close(other_worker)
+    later = engine.submit_latest("set_volume_cmd", 20, gate.run, "alice")
+    records = engine.wait([job["id"], later["id"]], WAIT)
+    assert gate.calls == [20]
+    assert all(record["result"]["value"] == 20 for record in records.values())
+
+
+def test_drainer_lock_is_released_when_the_slot_is_empty(engine):
+    gate = Gate()
+    gate.release.set()
+    job = engine.submit_latest("set_volume_cmd", 10, gate.run, "alice")
+    engine.wait([job["id"]], WAIT)
+    for _ in range(100): # The drainer closes its lock right after the last job finished
+        fd = engine.store.claim_drainer("set_volume_cmd")
+        if fd is not None:
+            break
+        threading.Event().wait(0.01)
+    assert fd is not None
+    os.close(fd)
+
+
+def test_cancel_queued_coalesced_job(engine):
+    gate = Gate()
+    first = engine.submit_latest("set_volume_cmd", 10, gate.run, "alice")
+    assert gate.started.wait(WAIT)
+    second = engine.submit_latest("set_volume_cmd", 20, gate.run, "alice")
+    assert engine.cancel(second["id"])["status"] == "cancelled"
+    gate.release.set()
+
+    engine.wait([first["id"], second["id"]], WAIT)
+    assert gate.calls == [10] # Every pending job was cancelled: no second run
+    assert engine.store.get(second["id"])["status"] == "cancelled"
+
+
+def test_submit_latest_runs_the_newest_context(engine):
+    gate = Gate()
+    first = engine.submit_latest("set_volume_cmd", 10, gate.run, "alice", {"command": "old {}"})
+    assert gate.started.wait(WAIT)
+    # The command was edited while the drainer started by the first submission is busy
+    second = engine.submit_latest("set_volume_cmd", 20, gate.run, "alice", {"command": "new {}"})
+    gate.release.set()
+    engine.wait([first["id"], second["id"]], WAIT)
+    assert gate.contexts == [{"command": "old {}"}, {"command": "new {}"}]
+
+
+def test_cancelling_one_job_of_a_shared_run_only_detaches_it(engine):
+    gate = Gate()
+    processes = []
+
+    def run(value, context, on_spawn):
+        if value == 10:
+            return gate.run(value, context, on_spawn)
+        process = subprocess.Popen(["sleep", "30"], start_new_session=True)
+        processes.append(process)
+        on_spawn(process)
+        process.wait()
+        return {"success": process.returncode == 0, "message": f"exit {process.returncode}"}
+
+    first = engine.submit_latest("set_volume_cmd", 10, run, "alice")
+    assert gate.started.wait(WAIT)
+    shared = [engine.submit_latest("set_volume_cmd", level, run, "alice") for level in (20, 30)]
+    gate.release.set()
+    for _ in range(500): # Both jobs wait for the same process
+        if all((engine.store.get(job["id"]) or {}).get("pid") for job in shared):
+            break
+        threading.Event().wait(0.01)
+
+    detached = engine.cancel(shared[0]["id"])
+    assert detached["status"] == "cancelled"
+    assert processes[0].poll() is None # Still running for the other job
+
+    assert engine.cancel(shared[1]["id"])["cancel_requested"] # The last one: the process goes
+    records = engine.wait([first["id"]] + [job["id"] for job in shared], WAIT)
+    assert processes[0].poll() is not None
+    assert records[shared[1]["id"]]["status"] == "cancelled"
+    assert records[shared[0]["id"]]["result"] == detached["result"] # Not overwritten by the run's outcome
+
+
+def test_cancel_queued_job(tmp_path):
+    engine = JobEngine(JobStore(str(tmp_path / "jobs")), max_workers=1, queue_limit=4)
+    gate = Gate()
+    running = engine.submit("lock_cmd", lambda on_spawn: gate.run(None, None, on_spawn), "alice")
+    assert gate.started.wait(WAIT)
+    never_run = []
+    queued = engine.submit("lock_cmd", lambda on_spawn: never_run.append(True), "alice")
+
+    record = engine.cancel(queued["id"])
+    assert record["status"] == "cancelled" and record["result"]["success"] is False
+    gate.release.set()
+    engine.wait([running["id"], queued["id"]], WAIT)
+    assert engine.store.get(queued["id"])["status"] == "cancelled"
+    assert never_run == []
+
+
+def test_cancel_running_job_terminates_its_process(engine):
+    def run(on_spawn):
+        process = subprocess.Popen(["sleep", "30"], start_new_session=True)
+        on_spawn(process)
+        process.wait()
+        return {"success": process.returncode == 0, "message": f"exit {process.returncode}"}
+
+    job = engine.submit("lock_cmd", run, "alice")
+    for _ in range(500):
+        if (engine.store.get(job["id"]) or {}).get("pid"):
+            break
+        threading.Event().wait(0.01)
+    assert engine.cancel(job["id"])["cancel_requested"]
+
+    record = engine.wait([job["id"]], WAIT)[job["id"]]
+    assert record["status"] == "cancelled"
+    assert record["pid"] is None
+
+
+def test_cancel_finished_job_changes_nothing(engine):
+    job = engine.submit("lock_cmd", lambda on_spawn: {"success": True, "message": "locked"}, "alice")
+    engine.wait([job["id"]], WAIT)
+    assert engine.cancel(job["id"])["status"] == "succeeded"
+
+
+def test_queue_limit(tmp_path):
+    engine = JobEngine(JobStore(str(tmp_path / "jobs")), max_workers=1, queue_limit=0)
+    gate = Gate()
+    job = engine.submit("lock_cmd", lambda on_spawn: gate.run(None, None, on_spawn), "alice")
+    assert gate.started.wait(WAIT)
+    with pytest.raises(JobQueueFull):
+        engine.submit("lock_cmd", lambda on_spawn: None, "alice")
+    with pytest.raises(JobQueueFull):
+        engine.submit_latest("set_volume_cmd", 10, gate.run, "alice")
+    gate.release.set()
+    assert engine.wait([job["id"]], WAIT)[job["id"]]["status"] in FINAL_STATUSES
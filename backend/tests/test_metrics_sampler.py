@@ -0,0 +1,127 @@
+import functools
+
+import pytest
+
+import metrics_sampler
+from metrics_sampler import MetricsSampler
+from system_actions import linux_metrics
+
+MEMINFO = """MemTotal:        8000000 kB
+MemFree:          500000 kB
+MemAvailable:    2000000 kB
+Buffers:          100000 kB
+"""
+UPTIME = "93784.12 180000.50\n"
+
+
+def proc_stat(aggregate, *cores):
+    """/proc/stat text for (user, nice, system, idle, iowait) jiffies per line."""
+    lines = ["cpu  " + " ".join(map(str, aggregate + (0, 0, 0, 0, 0)))]
+    lines += [f"cpu{index} " + " ".join(map(str, core + (0, 0, 0, 0, 0))) for index, core in enumerate(cores)]
+    lines += ["intr 12345 0 0", "ctxt 67890", "btime 1700000000"]
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture
+def proc(tmp_path, monkeypatch):
+    """Points the sampler's /proc readers at files under tmp_path."""
+    files = {name: tmp_path / name for name in ("stat", "meminfo", "uptime", "diskstats", "net_dev")}
+    files["meminfo"].write_text(MEMINFO)
+    files["uptime"].write_text(UPTIME)
+    files["diskstats"].write_text("   8       0 sda 10 0 100 5 20 0 200 7 0 12 12\n")
+    files["net_dev"].write_text(
+        "Inter-|   Receive\n face |bytes packets\n"
+        "    lo: 500 5 0 0 0 0 0 0 500 5 0 0 0 0 0 0\n"
+        "  eth0: 1000 10 0 0 0 0 0 0 2000 20 0 0 0 0 0 0\n"
+    )
+    for name, reader in (("stat", "read_cpu_times"), ("meminfo", "read_memory_usage"), ("uptime", "read_uptime_seconds")):
+        monkeypatch.setattr(linux_metrics, reader, functools.partial(getattr(linux_metrics, reader), path=str(files[name])))
+    monkeypatch.setattr(linux_metrics, "DiskStatsReader", functools.partial(
+        linux_metrics.DiskStatsReader, path=str(files["diskstats"]), sys_block=str(tmp_path)
+    ))
+    monkeypatch.setattr(linux_metrics, "NetDevReader", functools.partial(linux_metrics.NetDevReader, path=str(files["net_dev"])))
+    return files
+
+
+def test_cpu_is_the_delta_between_two_samples_not_the_boot_average(proc):
+    # Since boot: 200 busy jiffies out of 10000 (2%)
+    proc["stat"].write_text(proc_stat((100, 0, 100, 9800, 0), (50, 0, 50, 4900, 0), (50, 0, 50, 4900, 0)))
+    sampler = MetricsSampler(interval=1.0)
+    first = sampler.sample_once()
+    assert first["cpu_usage"] is None # Nothing to compare against yet
+    assert "cpu_per_core" not in first["details"]
+
+    # Next interval: 100 busy out of 200 (50%); core 0 fully busy, core 1 idle
+    proc["stat"].write_text(proc_stat((150, 0, 150, 9900, 0), (100, 0, 100, 4900, 0), (50, 0, 50, 5000, 0)))
+    second = sampler.sample_once()
+    assert second["cpu_usage"] == 50.0
+    assert second["details"]["cpu_per_core"] == [100.0, 0.0]
+    assert sampler.latest()["cpu_usage"] == 50.0
+
+
+def test_iowait_counts_as_idle(proc):
+    proc["stat"].write_text(proc_stat((100, 0, 100, 9800, 0)))
+    sampler = MetricsSampler()
+    sampler.sample_once()
+    proc["stat"].write_text(proc_stat((125, 0, 125, 9850, 100))) # 50 busy, 50 idle, 100 iowait
+    assert sampler.sample_once()["cpu_usage"] == 25.0
+
+
+def test_memory_and_uptime(proc):
+    proc["stat"].write_text(proc_stat((1, 0, 1, 100, 0)))
+    sample = MetricsSampler().sample_once()
+    assert sample["ram_usage"] == 75.0 # (MemTotal - MemAvailable) / MemTotal, like free's 'used'
+    assert sample["uptime_seconds"] == 93784.12
+    assert sample["uptime"] == "1 day, 2 hours, 3 minutes"
+
+
+def test_network_rates_skip_loopback(proc, monkeypatch):
+    proc["stat"].write_text(proc_stat((1, 0, 1, 100, 0)))
+    clock = iter([100.0, 102.0])
+    monkeypatch.setattr(metrics_sampler.time, "monotonic", lambda: next(clock))
+    sampler = MetricsSampler()
+    assert sampler.sample_once()["net_rx_bps"] is None
+    proc["net_dev"].write_text(
+        "Inter-|   Receive\n face |bytes packets\n"
+        "    lo: 9500 95 0 0 0 0 0 0 9500 95 0 0 0 0 0 0\n"
+        "  eth0: 3000 30 0 0 0 0 0 0 6000 60 0 0 0 0 0 0\n"
+    )
+    sample = sampler.sample_once()
+    assert sample["net_rx_bps"] == 1000.0 and sample["net_tx_bps"] == 2000.0
+    assert list(sample["details"]["network"]) == ["eth0"]
+
+
+def test_unreadable_proc_files_leave_the_field_empty(proc):
+    proc["meminfo"].unlink()
+    proc["stat"].write_text("garbage\n")
+    sample = MetricsSampler().sample_once()
+    assert sample["cpu_usage"] is None and sample["ram_usage"] is None
+    assert sample["uptime_seconds"] == 93784.12
+
+
+def test_listeners_receive_every_sample(proc):
+    proc["stat"].write_text(proc_stat((1, 0, 1, 100, 0)))
+    sampler = MetricsSampler()
+    received = []
+    sampler.add_listener(received.append)
+    sampler.add_listener(lambda sample: 1 / 0) # A failing listener doesn't stop the others
+    sampler.sample_once()
+    sampler.sample_once()
+    assert len(received) == 2 and received[1]["timestamp"] >= received[0]["timestamp"]
+
+
+@pytest.mark.parametrize("previous, current, expected", [
+    (None, (10, 100), None),
+    ((10, 100), (10, 100), None), # No time elapsed
+    ((10, 100), (60, 200), 50.0),
+    ((10, 100), (300, 200), 100.0), # Clamped
+])
+def test_cpu_percent(previous, current, expected):
+    assert linux_metrics.cpu_percent(previous, current) == expected
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (59, "0 minutes"), (60, "1 minute"), (3 * 3600 + 120, "3 hours, 2 minutes"), (8 * 86400, "1 week, 1 day"),
+])
+def test_format_uptime(seconds, expected):
+    assert linux_metrics.format_uptime(seconds) == expected
@@ -0,0 +1,88 @@
+import json
+import sqlite3
+
+import pytest
+
+import migrations
+from permissions import ALL_PERMISSIONS, PERMISSION_BITS
+
+
+def legacy_database(path):
+    """A database as created before the schema was versioned: JSON permissions per user."""
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, "
+        "password_hash TEXT NOT NULL, permissions TEXT NOT NULL)"
+    )
+    conn.execute("CREATE TABLE commands (command_key TEXT PRIMARY KEY NOT NULL, command_value TEXT NOT NULL)")
+    conn.executemany("INSERT INTO users (id, username, password_hash, permissions) VALUES (?, ?, ?, ?)", [
+        (1, "admin", "hash-a", json.dumps({name: True for name in PERMISSION_BITS})),
+        (2, "viewer", "hash-v", json.dumps({"system_metrics": True, "lock": False, "legacy_flag": True})),
+        (3, "broken", "hash-b", "not json"),
+    ])
+    conn.executemany("INSERT INTO commands (command_key, command_value) VALUES (?, ?)", [
+        ("lock_cmd", "xdg-screensaver lock"), # Customized by the user
+        ("shutdown_cmd", "systemctl poweroff"), # The default of the previous release
+    ])
+    conn.commit()
+    return conn
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = legacy_database(str(tmp_path / "syspilot.db"))
+    yield conn
+    conn.close()
+
+
+def test_upgrade_converts_legacy_json_permissions_to_masks(conn, tmp_path):
+    assert migrations.upgrade(conn, str(tmp_path / "migrate.lock"), "{}", lambda conn, previous: None)
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    assert "permissions" not in columns and "permission_mask" in columns
+    users = {row[0]: row[1:] for row in conn.execute("SELECT username, id, password_hash, permission_mask FROM users")}
+    assert users["admin"] == (1, "hash-a", ALL_PERMISSIONS)
+    assert users["viewer"] == (2, "hash-v", PERMISSION_BITS["system_metrics"])
+    assert users["broken"] == (3, "hash-b", 0)
+    assert migrations.read_state(conn) == (migrations.LATEST_VERSION, "{}")
+
+
+def test_upgrade_keeps_commands_and_passes_previous_defaults_to_seed(conn, tmp_path):
+    lock_path = str(tmp_path / "migrate.lock")
+    seen = []
+    seed = lambda conn, previous: seen.append(previous)
+
+    assert migrations.upgrade(conn, lock_path, '{"v": 1}', seed)
+    assert seen == [None] # Unknown for a legacy database
+    assert dict(conn.execute("SELECT command_key, command_value FROM commands")) == {
+        "lock_cmd": "xdg-screensaver lock", "shutdown_cmd": "systemctl poweroff"
+    }
+
+    assert not migrations.upgrade(conn, lock_path, '{"v": 1}', seed) # Up to date: nothing runs
+    assert migrations.upgrade(conn, lock_path, '{"v": 2}', seed)
+    assert seen == [None, '{"v": 1}']
+
+
+def test_merge_commands_keeps_customized_commands(conn):
+    previous = {"lock_cmd": "loginctl lock-session", "shutdown_cmd": "systemctl poweroff"}
+    defaults = {"lock_cmd": "loginctl lock-sessions", "shutdown_cmd": "shutdown -h now", "restart_cmd": "reboot"}
+
+    assert migrations.merge_commands(conn, defaults, previous) == 2
+    assert dict(conn.execute("SELECT command_key, command_value FROM commands")) == {
+        "lock_cmd": "xdg-screensaver lock", # Customized: kept
+        "shutdown_cmd": "shutdown -h now", # Still the old default: follows the new one
+        "restart_cmd": "reboot", # Missing: added
+    }
+    assert migrations.merge_commands(conn, defaults, defaults) == 0
+
+
+def test_failed_migration_is_rolled_back(conn, tmp_path, monkeypatch):
+    def fail(conn):
+        conn.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:1] + ((2, "failing", fail),))
+
+    with pytest.raises(RuntimeError):
+        migrations.upgrade(conn, str(tmp_path / "migrate.lock"), "{}", lambda conn, previous: None)
+    assert migrations.read_state(conn) == (1, None)
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
@@ -0,0 +1,42 @@
+from permissions import (
+    ALL_PERMISSIONS, PERMISSION_BITS, PERMISSIONS, has_permission, mask_to_permissions, permissions_to_mask
+)
+
+
+def test_bit_positions_are_stable():
+    # Persisted in the users table and in issued JWTs: appending is the only allowed change
+    assert PERMISSIONS[:11] == (
+        "shutdown", "restart", "lock",
+        "play_pause", "media_next", "media_previous",
+        "volume", "volume_mute", "system_metrics",
+        "modify_commands", "manage_users",
+    )
+    assert PERMISSION_BITS["shutdown"] == 1
+    assert PERMISSION_BITS["manage_users"] == 1 << 10
+    assert ALL_PERMISSIONS == (1 << len(PERMISSIONS)) - 1
+
+
+def test_has_permission():
+    mask = PERMISSION_BITS["lock"] | PERMISSION_BITS["volume"]
+    assert has_permission(mask, "lock")
+    assert has_permission(mask, "volume")
+    assert not has_permission(mask, "shutdown")
+    assert not has_permission(0, "manage_users")
+    assert all(has_permission(ALL_PERMISSIONS, name) for name in PERMISSIONS)
+
+
+def test_permissions_to_mask_sets_and_clears_on_top_of_base():
+    base = PERMISSION_BITS["lock"] | PERMISSION_BITS["restart"]
+    mask = permissions_to_mask({"restart": False, "volume": True}, base)
+    assert mask == PERMISSION_BITS["lock"] | PERMISSION_BITS["volume"]
+
+
+def test_permissions_to_mask_ignores_unknown_names_and_non_booleans():
+    mask = permissions_to_mask({"lock": True, "root": True, "shutdown": 1, "restart": "true", "volume": None})
+    assert mask == PERMISSION_BITS["lock"]
+
+
+def test_mask_round_trip():
+    permissions = {name: index % 2 == 0 for index, name in enumerate(PERMISSIONS)}
+    assert mask_to_permissions(permissions_to_mask(permissions)) == permissions
+    assert mask_to_permissions(0) == {name: False for name in PERMISSIONS}
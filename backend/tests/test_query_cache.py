@@ -0,0 +1,93 @@
+import threading
+import time
+
+import query_cache
+from query_cache import QueryCache
+from system_actions.linux_actions import QUERY_COMMAND_TTLS
+from worker_counters import WorkerCounters
+
+
+def counting(result):
+    calls = []
+
+    def execute():
+        calls.append(1)
+        return result
+
+    return execute, calls
+
+
+def test_results_are_reused_until_their_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    cache = QueryCache({"get_cpu_usage_cmd": 1})
+    execute, calls = counting({"success": True, "message": "12"})
+    assert cache.get("get_cpu_usage_cmd", "top -bn1", execute)["message"] == "12"
+    cache.get("get_cpu_usage_cmd", "top -bn1", execute)
+    assert len(calls) == 1
+    now[0] += 1.5
+    cache.get("get_cpu_usage_cmd", "top -bn1", execute)
+    assert len(calls) == 2
+
+
+def test_failures_and_unknown_keys_are_never_stored():
+    cache = QueryCache({"get_cpu_usage_cmd": 60})
+    failing, failed_calls = counting({"success": False, "message": "boom"})
+    cache.get("get_cpu_usage_cmd", "top", failing)
+    cache.get("get_cpu_usage_cmd", "top", failing)
+    assert len(failed_calls) == 2
+    other, other_calls = counting({"success": True, "message": "40"})
+    cache.get("get_volume_cmd", "pactl", other)
+    cache.get("get_volume_cmd", "pactl", other)
+    assert len(other_calls) == 2
+
+
+def test_concurrent_callers_share_one_execution():
+    cache = QueryCache({"get_ram_usage_cmd": 60})
+    release = threading.Event()
+    calls = []
+
+    def execute():
+        calls.append(1)
+        release.wait(5)
+        return {"success": True, "message": "50"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("get_ram_usage_cmd", "free", execute))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1 and [result["message"] for result in results] == ["50"] * 8
+
+
+def test_an_exception_is_shared_as_a_failed_result():
+    cache = QueryCache({"get_uptime_cmd": 60})
+    result = cache.get("get_uptime_cmd", "uptime", lambda: 1 / 0)
+    assert not result["success"] and "division" in result["message"]
+
+
+def test_retain_drops_entries_of_changed_commands():
+    cache = QueryCache({"get_cpu_usage_cmd": 60})
+    execute, calls = counting({"success": True, "message": "1"})
+    cache.get("get_cpu_usage_cmd", "old", execute)
+    cache.retain(lambda key, command: command == "new")
+    cache.get("get_cpu_usage_cmd", "old", execute)
+    assert len(calls) == 2
+
+
+def test_hits_and_misses_are_counted(tmp_path):
+    counters = WorkerCounters(str(tmp_path / "queries"), 2, b"TSQ1")
+    counters.attach()
+    cache = QueryCache({"get_cpu_usage_cmd": 60}, counters)
+    execute, _ = counting({"success": True, "message": "1"})
+    for _ in range(3):
+        cache.get("get_cpu_usage_cmd", "top", execute)
+    assert cache.stats() == {"get_cpu_usage_cmd": {"hits": 2.0, "misses": 1.0}}
+
+
+def test_volume_and_mute_reads_bypass_the_cache():
+    # Only the MediaMonitor reads them, when pactl reports a change: a stored value would hide it
+    assert "get_volume_cmd" not in QUERY_COMMAND_TTLS and "get_mute_status_cmd" not in QUERY_COMMAND_TTLS
@@ -0,0 +1,110 @@
+import os
+import threading
+
+import pytest
+
+import shared_metrics
+from shared_metrics import SharedMetrics
+
+WAIT = 10
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "metrics")
+
+
+def attached(path):
+    metrics = SharedMetrics(path)
+    metrics.attach()
+    return metrics
+
+
+def elected(path):
+    leader = attached(path)
+    ready = threading.Event()
+    leader.start_leader_election(ready.set)
+    assert ready.wait(WAIT)
+    return leader
+
+
+def test_only_the_leader_writes(path):
+    follower = attached(path)
+    follower.write({"timestamp": 1.0, "cpu_usage": 5.0})
+    assert follower.read() == {} and follower.sequence() == 0
+
+    leader = elected(path)
+    leader.write({"timestamp": 2.0, "cpu_usage": 7.5})
+    assert follower.read()["cpu_usage"] == 7.5
+
+
+def test_sample_round_trip(path):
+    leader, reader = elected(path), attached(path)
+    leader.write({"timestamp": 10.0, "cpu_usage": 12.5, "ram_usage": 40.0, "details": {"cpu_per_core": [1.0, 2.0]}})
+    sample = reader.read()
+    assert sample["timestamp"] == 10.0 and sample["cpu_usage"] == 12.5 and sample["ram_usage"] == 40.0
+    assert sample["uptime_seconds"] is None # Missing fields travel as NaN
+    assert sample["seq"] == reader.sequence()
+    assert reader.read_details() == {"cpu_per_core": [1.0, 2.0]}
+    assert reader.read_details() is reader.read_details() # Decoded once per sequence number
+
+
+def test_oversized_details_are_dropped(path, monkeypatch):
+    monkeypatch.setattr(shared_metrics, "DETAILS_CAPACITY", 16)
+    leader = elected(path)
+    leader.write({"timestamp": 1.0, "details": {"processes": "x" * 64}})
+    assert leader.read_details() == {}
+    assert leader.read()["timestamp"] == 1.0
+
+
+def test_write_in_progress_is_never_returned(path, monkeypatch):
+    leader, reader = elected(path), attached(path)
+    leader.write({"timestamp": 1.0, "cpu_usage": 1.0, "details": {"a": 1}})
+    seq = leader.sequence()
+    shared_metrics._SEQ.pack_into(leader._mm, shared_metrics._SEQ_OFFSET, seq + 1) # Leader died mid-write
+    monkeypatch.setattr(shared_metrics, "READ_RETRIES", 3)
+    assert reader.read() == {}
+    assert reader.read_details() == {}
+
+
+def test_new_leader_recovers_from_an_odd_sequence(path):
+    old = elected(path)
+    old.write({"timestamp": 1.0})
+    shared_metrics._SEQ.pack_into(old._mm, shared_metrics._SEQ_OFFSET, old.sequence() + 1)
+
+    os.close(old._lock_fd) # The old leader's process died: the kernel releases its flock
+    new = elected(path)
+    assert new.sequence() % 2 == 0
+    new.write({"timestamp": 2.0})
+    assert attached(path).read()["timestamp"] == 2.0
+
+
+def test_demand_marks_are_shared(path):
+    reader, other_worker = attached(path), attached(path)
+    assert reader.last_demand("processes") == 0.0
+    other_worker.mark_demand("processes")
+    assert reader.last_demand("processes") > 0
+
+
+def test_concurrent_readers_never_see_a_torn_sample(path):
+    leader, reader = elected(path), attached(path)
+    leader.write({"timestamp": 0.0, "cpu_usage": 0.0, "details": {"n": 0}})
+    stop = threading.Event()
+
+    def write():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            leader.write({"timestamp": float(n), "cpu_usage": float(n), "ram_usage": float(n), "details": {"n": n, "pad": "x" * (n % 300)}})
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        for _ in range(20000):
+            sample = reader.read()
+            assert sample == {} or sample["timestamp"] == sample["cpu_usage"] == sample["ram_usage"]
+            details = reader.read_details()
+            assert details == {} or "n" in details
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+import shared_state
+from shared_state import SharedState
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "state")
+
+
+def attached(path, **kwargs):
+    state = SharedState(path, **kwargs)
+    state.attach()
+    return state
+
+
+def test_empty_until_published(path):
+    assert SharedState(path).read() == {} # Not attached
+    state = attached(path)
+    assert state.read() == {} and state.sequence() == 0
+
+
+def test_readers_see_the_latest_document(path):
+    writer, reader = attached(path), attached(path)
+    writer.publish({"audio": {"level": 40}})
+    first = reader.sequence()
+    assert reader.read() == {"audio": {"level": 40}}
+    writer.publish({"audio": {"level": 55}})
+    assert reader.sequence() > first
+    assert reader.read() == {"audio": {"level": 55}}
+
+
+def test_unchanged_document_is_decoded_once(path):
+    writer, reader = attached(path), attached(path)
+    writer.publish({"a": 1})
+    assert reader.read() is reader.read()
+
+
+def test_oversized_document_keeps_the_previous_one(path):
+    state = attached(path, capacity=32)
+    assert state.publish({"a": 1})
+    assert not state.publish({"a": "x" * 64})
+    assert state.read() == {"a": 1}
+
+
+def test_write_in_progress_is_never_returned(path, monkeypatch):
+    state = attached(path)
+    state.publish({"a": 1})
+    state.read() # Cached for the current sequence
+    seq = shared_state._SEQ.unpack_from(state._mm, shared_state._SEQ_OFFSET)[0]
+    shared_state._SEQ.pack_into(state._mm, shared_state._SEQ_OFFSET, seq + 1) # A writer died mid-write
+    monkeypatch.setattr(shared_state, "READ_RETRIES", 3)
+    assert attached(path).read() == {}
+
+    state.publish({"a": 2}) # The next writer makes the sequence even again
+    assert attached(path).read() == {"a": 2}
+
+
+def test_layout_mismatch_is_reinitialized(path):
+    with open(path, "wb") as f:
+        f.write(b"junk" * 10)
+    state = attached(path)
+    assert state.read() == {}
+    state.publish({"ok": True})
+    assert state.read() == {"ok": True}
+
+
+def test_concurrent_readers_never_see_a_torn_document(path):
+    writer, reader = attached(path), attached(path)
+    writer.publish({"n": 0, "copy": 0})
+    stop = threading.Event()
+
+    def write():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            writer.publish({"n": n, "copy": n, "padding": "x" * (n % 500)})
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        for _ in range(20000):
+            document = reader.read()
+            assert document == {} or document["n"] == document["copy"]
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,69 @@
+import os
+import threading
+
+import pytest
+
+from event_stream import StreamSlots
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "streams")
+
+
+def attached(path, max_slots):
+    slots = StreamSlots(path, max_slots)
+    slots.attach()
+    return slots
+
+
+def test_the_cap_is_shared_by_all_workers(path):
+    first, second = attached(path, 3), attached(path, 3)
+    assert first.acquire() and first.acquire()
+    assert second.acquire()
+    assert not second.acquire() and not first.acquire()
+    assert first.open_streams() == second.open_streams() == 3
+
+
+def test_a_released_slot_can_be_taken_again(path):
+    first, second = attached(path, 2), attached(path, 2)
+    assert first.acquire() and second.acquire()
+    assert not second.acquire()
+    first.release()
+    assert second.open_streams() == 1
+    assert second.acquire()
+    assert not first.acquire()
+
+
+def test_release_never_goes_below_zero(path):
+    slots = attached(path, 1)
+    slots.release()
+    assert slots.open_streams() == 0
+    assert slots.acquire()
+
+
+def test_streams_of_a_dead_worker_are_freed(path):
+    dead = attached(path, 2)
+    assert dead.acquire() and dead.acquire()
+    os.close(dead._slot_fd) # The worker died: the kernel releases its flock
+    replacement = attached(path, 2)
+    assert replacement.open_streams() == 0
+    assert replacement.acquire()
+
+
+def test_threads_never_exceed_the_cap(path):
+    workers = [attached(path, 5) for _ in range(2)]
+    granted = []
+    barrier = threading.Barrier(16)
+
+    def open_stream(slots):
+        barrier.wait()
+        granted.append(slots.acquire())
+
+    threads = [threading.Thread(target=open_stream, args=(workers[index % 2],)) for index in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert granted.count(True) == 5
+    assert workers[0].open_streams() == 5
@@ -0,0 +1,81 @@
+# backend/worker_counters.py
+"""
+Counters shared by all workers of an instance.
+Every worker owns one slot of an mmap'ed table (claimed with an flock, so a replacement
+worker inherits the slot and its counts keep growing); only the owner writes its slot,
+and readers sum all of them.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+MAX_WORKERS = 16
+# magic | values per slot | worker slots | padding
+_HEADER = struct.Struct("<4sII4x")
+_DOUBLE = struct.Struct("<d")
+
+
+class WorkerCounters:
+    """A fixed number of float counters per worker, addressed by index."""
+
+    def __init__(self, path, size, magic):
+        self.path = path
+        self.size = size
+        self.magic = magic
+        self._slot_size = size * _DOUBLE.size
+        self._region_size = _HEADER.size + MAX_WORKERS * self._slot_size
+        self._totals = struct.Struct("<" + "d" * size)
+        self._mm = None
+        self._slot_offset = None
+        self._slot_fd = None
+        self._lock = threading.Lock() # Threaded workers share their slot between threads
+
+    def attach(self):
+        """Maps the table and claims a free worker slot (counting is disabled if none is free)."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX) # Serializes (re)initialization between workers
+            if os.fstat(fd).st_size != self._region_size:
+                os.ftruncate(fd, self._region_size)
+            self._mm = mmap.mmap(fd, self._region_size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            if _HEADER.unpack_from(self._mm, 0) != (self.magic, self.size, MAX_WORKERS):
+                # New layout (first start, or the set of counters changed): start from zero
+                self._mm[:self._region_size] = bytes(self._region_size)
+                _HEADER.pack_into(self._mm, 0, self.magic, self.size, MAX_WORKERS)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+        for slot in range(MAX_WORKERS):
+            slot_fd = os.open(f"{self.path}.worker{slot}", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(slot_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(slot_fd)
+                continue
+            self._slot_fd = slot_fd
+            self._slot_offset = _HEADER.size + slot * self._slot_size
+            return
+        print(f"Warning: No free counter slot in {self.path}; this worker won't be counted.")
+
+    def add(self, increments):
+        """Adds each (index, amount) pair to this worker's slot."""
+        if self._slot_offset is None:
+            return
+        with self._lock:
+            for index, amount in increments:
+                offset = self._slot_offset + index * _DOUBLE.size
+                _DOUBLE.pack_into(self._mm, offset, _DOUBLE.unpack_from(self._mm, offset)[0] + amount)
+
+    def totals(self):
+        """Sums every worker slot; returns one float per counter (zeros if not attached)."""
+        totals = [0.0] * self.size
+        if self._mm is None:
+            return totals
+        for slot in range(MAX_WORKERS):
+            values = self._totals.unpack_from(self._mm, _HEADER.size + slot * self._slot_size)
+            for index, value in enumerate(values):
+                totals[index] += value
+        return totals
@@ -54,6 +54,16 @@ document.addEventListener('DOMContentLoaded', () => {
     const volumeMuteButton = document.getElementById('volume-mute-button');
     let volumeChangeTimer;
 
+    // Fleet view (aggregator mode)
+    const fleetCard = document.getElementById('fleet-card');
+    const fleetTableBody = document.querySelector('#fleet-table tbody');
+    let fleetEnabled = false;
+    let fleetRefreshTimer = null;
+
+    // Custom Actions elements (user-defined actions from the registry)
+    const customActionsCard = document.getElementById('custom-actions-card');
+    const customActionsList = document.getElementById('custom-actions-list');
+
     // Custom Commands elements
     const customCommandsCard = document.getElementById('custom-commands-card');
     const manageCustomCommandsButton = document.getElementById('manage-custom-commands-button');
@@ -137,6 +147,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 document.getElementById('cpu-usage').textContent = 'N/A';
                 document.getElementById('ram-usage').textContent = 'N/A';
                 document.getElementById('uptime').textContent = 'N/A';
+                document.getElementById('disk-io').textContent = 'N/A';
+                document.getElementById('network-io').textContent = 'N/A';
             } else {
                 metricsCard.style.opacity = '1';
                 metricsCard.style.pointerEvents = 'auto';
@@ -601,6 +613,28 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
 
+    // --- Disk and network throughput display ---
+    const ioRates = { disk_read_bps: null, disk_write_bps: null, net_rx_bps: null, net_tx_bps: null };
+
+    function formatRate(bytesPerSecond) {
+        if (bytesPerSecond === null || bytesPerSecond === undefined) {
+            return '--';
+        }
+        const units = ['B/s', 'KB/s', 'MB/s', 'GB/s'];
+        let value = bytesPerSecond;
+        let unitIndex = 0;
+        while (value >= 1024 && unitIndex < units.length - 1) {
+            value /= 1024;
+            unitIndex++;
+        }
+        return `${value.toFixed(unitIndex === 0 ? 0 : 1)} ${units[unitIndex]}`;
+    }
+
+    function renderIORates() {
+        document.getElementById('disk-io').textContent = `R ${formatRate(ioRates.disk_read_bps)} / W ${formatRate(ioRates.disk_write_bps)}`;
+        document.getElementById('network-io').textContent = `↓ ${formatRate(ioRates.net_rx_bps)} / ↑ ${formatRate(ioRates.net_tx_bps)}`;
+    }
+
     // --- Function to fetch and update Dashboard Data ---
     async function fetchDashboardData() {
         try {
@@ -631,10 +665,20 @@ document.addEventListener('DOMContentLoaded', () => {
                 document.getElementById('cpu-usage').textContent = data.cpu_usage;
                 document.getElementById('ram-usage').textContent = data.ram_usage;
                 document.getElementById('uptime').textContent = data.uptime;
+                if (data.disk_io) {
+                    ioRates.disk_read_bps = data.disk_io.read_bytes_per_sec;
+                    ioRates.disk_write_bps = data.disk_io.write_bytes_per_sec;
+                }
+                if (data.network_io) {
+                    ioRates.net_rx_bps = data.network_io.rx_bytes_per_sec;
+                    ioRates.net_tx_bps = data.network_io.tx_bytes_per_sec;
+                }
+                renderIORates();
                 document.getElementById('welcome-message').textContent = `Welcome, ${data.user}`;
                 
                 userPermissions = data.permissions; // Update global userPermissions with fresh data
                 currentOSType = data.os_type;
+                fleetEnabled = Boolean(data.fleet_enabled);
                 
                 if (currentOSType === 'Linux' && userPermissions.modify_commands) {
                     customCommandsCard.style.display = 'block';
@@ -655,6 +699,7 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- Function to fetch and update current system volume and mute status ---
+    let volumeRetryTimer;
     async function getAndUpdateVolume() {
         if ((!userPermissions.volume && !userPermissions.volume_mute) || currentOSType !== 'Linux') {
             volumePercentageSpan.textContent = 'N/A';
@@ -668,15 +713,26 @@ document.addEventListener('DOMContentLoaded', () => {
                 method: 'GET',
                 credentials: 'include'
             });
-            // Handle permission_change flag for 200 OK responses
-            if (!response.ok) {
-                 // This means a 401 Unauthorized from token_required (invalid/expired token or user not found)
+            if (response.status === 503) {
+                // Volume state not read yet (server startup, sampler leader handover): retry quietly
+                const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+                clearTimeout(volumeRetryTimer);
+                volumeRetryTimer = setTimeout(getAndUpdateVolume, (retryAfter > 0 ? retryAfter : 1) * 1000);
+                return;
+            }
+            if (response.status === 401 || response.status === 403) {
+                // Invalid/expired token, user not found or permission removed: log in again
                 console.error('Session expired or unauthorized for volume. Forcing re-login.');
                 showAlert('Session expired or unauthorized. Please log in again.');
                 window.location.href = '/';
                 return;
             }
-            
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`); // Shown as an error below, the next poll tries again
+            }
+
+            // Handle permission_change flag for 200 OK responses
+
             const data = await response.json();
 
             if (data.permission_change) { // Special case for permission changes
@@ -728,24 +784,165 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- Initial Load and Periodic Updates ---
     let dashboardDataInterval;
     let volumeRefreshTimer;
+    let eventSource = null;
+    let streamRetryTimer;
+
+    // Apply the fields pushed by /api/stream (only the ones that changed are sent)
+    function applyStreamUpdate(update) {
+        if ('cpu_usage' in update) {
+            document.getElementById('cpu-usage').textContent = update.cpu_usage ?? '--';
+        }
+        if ('ram_usage' in update) {
+            document.getElementById('ram-usage').textContent = update.ram_usage ?? '--';
+        }
+        if ('uptime' in update) {
+            document.getElementById('uptime').textContent = update.uptime ?? '--';
+        }
+        let ioChanged = false;
+        for (const field of Object.keys(ioRates)) {
+            if (field in update) {
+                ioRates[field] = update[field];
+                ioChanged = true;
+            }
+        }
+        if (ioChanged) {
+            renderIORates();
+        }
+        if ('volume' in update && update.volume !== null) {
+            volumeSlider.value = update.volume;
+            volumePercentageSpan.textContent = `${update.volume}%`;
+        }
+        if ('is_muted' in update && update.is_muted !== null) {
+            updateVolumeSliderState(update.is_muted);
+        }
+    }
+
+    function startPolling() {
+        if (!dashboardDataInterval) {
+            dashboardDataInterval = setInterval(fetchDashboardData, 5000);
+        }
+        if (!volumeRefreshTimer && currentOSType === 'Linux' && (userPermissions.volume || userPermissions.volume_mute)) {
+            volumeRefreshTimer = setInterval(getAndUpdateVolume, 5000);
+        }
+    }
+
+    function stopPolling() {
+        if (dashboardDataInterval) clearInterval(dashboardDataInterval);
+        if (volumeRefreshTimer) clearInterval(volumeRefreshTimer);
+        clearTimeout(volumeRetryTimer);
+        dashboardDataInterval = null;
+        volumeRefreshTimer = null;
+    }
+
+    // Live updates through Server-Sent Events, falling back to polling when unavailable
+    function startStream() {
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+        eventSource = new EventSource('/api/stream');
+        eventSource.addEventListener('open', () => {
+            stopPolling();
+        });
+        eventSource.addEventListener('metrics', (event) => {
+            applyStreamUpdate(JSON.parse(event.data));
+        });
+        eventSource.addEventListener('error', () => {
+            // EventSource reconnects by itself after a dropped connection. CLOSED means the
+            // server refused the stream (limit reached, permission change, expired session).
+            if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+                eventSource = null;
+                fetchDashboardData(); // Handles re-login and permission changes
+                startPolling();
+                clearTimeout(streamRetryTimer);
+                streamRetryTimer = setTimeout(startStream, 60000);
+            }
+        });
+    }
+
+    function stopStream() {
+        clearTimeout(streamRetryTimer);
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
+    }
+
+    // Refreshes the fleet table: one row per node with its last known metrics
+    async function refreshFleet() {
+        try {
+            const response = await fetch('/api/fleet', { credentials: 'include' });
+            const data = await response.json();
+            if (!data.success) {
+                return;
+            }
+            fleetTableBody.innerHTML = '';
+            data.nodes.forEach(node => {
+                const metrics = (node.data && node.data.metrics) || {};
+                const row = fleetTableBody.insertRow();
+                const state = node.state === 'ok' ? 'OK' : (node.state === 'stale' ? 'Stale' : 'Down');
+                const cells = [
+                    node.name,
+                    node.error ? `${state} (${node.error})` : state,
+                    metrics.cpu_usage != null ? `${metrics.cpu_usage}%` : '--',
+                    metrics.ram_usage != null ? `${metrics.ram_usage}%` : '--',
+                    metrics.uptime || '--',
+                ];
+                cells.forEach(text => {
+                    row.insertCell().textContent = text;
+                });
+                row.className = `node-${node.state}`;
+            });
+            fleetCard.style.display = 'block';
+        } catch (error) {
+            console.error('Error loading the fleet view:', error);
+        }
+    }
+
+    // Renders one button per user-defined action the user may run (parameterless ones only;
+    // actions with parameters are available through the API)
+    async function loadCustomActions() {
+        try {
+            const response = await fetch('/api/actions', { credentials: 'include' });
+            const data = await response.json();
+            if (!data.success) {
+                return;
+            }
+            const actions = data.actions.filter(action => !action.builtin && Object.keys(action.params).length === 0 && userPermissions[action.permission]);
+            customActionsList.innerHTML = '';
+            actions.forEach(action => {
+                const button = document.createElement('button');
+                button.className = 'action-button';
+                button.textContent = action.label;
+                button.addEventListener('click', () => executeAction(action.permission, `/api/action/${encodeURIComponent(action.name)}`));
+                customActionsList.appendChild(button);
+            });
+            customActionsCard.style.display = actions.length > 0 ? 'block' : 'none';
+        } catch (error) {
+            console.error('Error loading custom actions:', error);
+        }
+    }
 
     // Initial load sequence (similar to previous, but now includes permission_change check)
     fetchDashboardData()
     .then(() => {
-        // Start periodic updates after initial data load is successful
-        if (dashboardDataInterval) clearInterval(dashboardDataInterval);
-        dashboardDataInterval = setInterval(fetchDashboardData, 5000);
-
-        if (volumeRefreshTimer) clearInterval(volumeRefreshTimer);
         // Start volume and mute status check only if permissions allow
         if (currentOSType === 'Linux' && (userPermissions.volume || userPermissions.volume_mute)) {
             getAndUpdateVolume(); // Initial call for volume and mute status
-            volumeRefreshTimer = setInterval(getAndUpdateVolume, 5000);
         } else {
             volumePercentageSpan.textContent = 'N/A';
             volumeSlider.disabled = true;
             volumeMuteButton.disabled = true;
         }
+        if (currentOSType === 'Linux') {
+            loadCustomActions();
+        }
+        if (fleetEnabled && userPermissions.system_metrics) {
+            refreshFleet();
+            fleetRefreshTimer = setInterval(refreshFleet, 5000);
+        }
+        // Start live updates after initial data load is successful
+        startStream();
     })
     .catch(error => {
         // This catch handles critical errors during the initial fetchDashboardData itself
@@ -768,9 +965,9 @@ document.addEventListener('DOMContentLoaded', () => {
             } catch (error) {
                 console.error('Error logging out:', error);
             } finally {
-                // Clear all intervals on logout
-                if (dashboardDataInterval) clearInterval(dashboardDataInterval);
-                if (volumeRefreshTimer) clearInterval(volumeRefreshTimer);
+                // Clear all intervals and the live stream on logout
+                stopPolling();
+                stopStream();
                 window.location.href = '/'; // Go back to login
             }
             customAlertOkButton.onclick = null; // Reset click handler to default
@@ -798,6 +995,35 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Actions run as server-side jobs: poll /api/jobs/<id> until the job reaches a final state
+    const JOB_POLL_INTERVAL_MS = 250;
+    const JOB_POLL_TIMEOUT_MS = 60000;
+    const FINAL_JOB_STATUSES = ['succeeded', 'failed', 'timeout', 'cancelled'];
+
+    async function waitForJob(jobId) {
+        const deadline = Date.now() + JOB_POLL_TIMEOUT_MS;
+        while (Date.now() < deadline) {
+            const response = await fetch(`/api/jobs/${jobId}`, { credentials: 'include' });
+            const data = await response.json();
+            if (!data.success) {
+                return { success: false, message: data.message || 'Could not get the action status.' };
+            }
+            if (FINAL_JOB_STATUSES.includes(data.job.status)) {
+                return data.job.result;
+            }
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        }
+        return { success: false, message: 'The action is still running.' };
+    }
+
+    // Resolves an action response to its final result (waiting for the job if one was queued)
+    async function actionResult(data) {
+        if (data.success && data.job_id) {
+            return waitForJob(data.job_id);
+        }
+        return data;
+    }
+
     async function executeAction(permissionKey, endpoint, body = null) {
         try {
             const fetchOptions = {
@@ -817,7 +1043,8 @@ document.addEventListener('DOMContentLoaded', () => {
                 return; // Stop execution, new state will be reflected
             }
 
-            showNotification(data.message, data.success ? 'success' : 'error'); // Changed to in-page notification, add type
+            const result = await actionResult(data);
+            showNotification(result.message, result.success ? 'success' : 'error'); // Changed to in-page notification, add type
             if (permissionKey === 'volume_mute' || permissionKey === 'volume') {
                 getAndUpdateVolume(); // Immediate update after volume actions
             }
@@ -860,10 +1087,12 @@ document.addEventListener('DOMContentLoaded', () => {
                             await fetchDashboardData();
                             return;
                         }
-                        if (data.success) {
-                            showNotification(`Volume changed to: ${volumeSlider.value}%`, 'success'); // Show success message
+                        const result = await actionResult(data);
+                        if (result.success) {
+                            // A newer request from any client may have superseded this one: report what was applied
+                            showNotification(`Volume changed to: ${result.value ?? volumeSlider.value}%`, 'success'); // Show success message
                         } else {
-                            showNotification(`Failed to set volume: ${data.message}`, 'error');
+                            showNotification(`Failed to set volume: ${result.message}`, 'error');
                         }
                         getAndUpdateVolume(); // Call for instant feedback on mute status
                     } catch (error) {
@@ -37,6 +37,28 @@ if [ -z "$SYSTEM_USER" ]; then
 fi
 echo "The SysPilot service will be configured to run as user: $SYSTEM_USER"
 
+# --- 2b. Choose the serving mode ---
+# sync:  4 gunicorn workers with 8 threads each (default). Each open live-update stream occupies
+#        a thread; the threads keep the worker heartbeat going while a stream is open.
+# async: 4 gunicorn workers running the ASGI entry point (backend/asgi.py) under uvicorn.
+#        Streams and long waits run on an event loop, so idle connections only cost memory.
+# Set SYSPILOT_SERVE_MODE=sync|async before running the script to skip the question.
+SERVE_MODE="${SYSPILOT_SERVE_MODE:-}"
+if [ -z "$SERVE_MODE" ]; then
+    echo ""
+    read -p "Serving mode: 'sync' (default) or 'async' (recommended for many live dashboards or fleet use): " SERVE_MODE
+    SERVE_MODE="${SERVE_MODE:-sync}"
+fi
+case "$SERVE_MODE" in
+    sync) GUNICORN_ARGS="-w 4 -k gthread --threads 8 --timeout 60 app:app" ;;
+    async) GUNICORN_ARGS="-w 4 -k uvicorn_worker.UvicornWorker asgi:app" ;;
+    *)
+        echo "Error: Unknown serving mode '$SERVE_MODE' (expected 'sync' or 'async'). Exiting."
+        exit 1
+        ;;
+esac
+echo "The SysPilot service will use the '$SERVE_MODE' serving mode."
+
 # --- 3. Capture graphical session environment variables ---
 echo ""
 echo "--- Capturing graphical session environment variables ---"
@@ -137,6 +159,12 @@ else
     echo "Gunicorn is already installed in the virtual environment."
 fi
 
+if [ "$SERVE_MODE" = "async" ]; then
+    echo "Installing the ASGI worker for the async serving mode..."
+    pip install uvicorn uvicorn-worker
+    echo "ASGI worker installed."
+fi
+
 # --- 5. Sudoers Configuration (using /etc/sudoers.d/) ---
 echo ""
 echo "--- Configuring Sudoers permissions for SysPilot ---"
@@ -254,7 +282,7 @@ After=network.target
 [Service]
 User=$SYSTEM_USER
 WorkingDirectory=$BACKEND_DIR
-${ENV_VARS_BLOCK}ExecStart=$GUNICORN_BIN -w 4 app:app -b 0.0.0.0:5000
+${ENV_VARS_BLOCK}ExecStart=$GUNICORN_BIN $GUNICORN_ARGS -b 0.0.0.0:5000
 Restart=on-failure
 StandardOutput=journal
 StandardError=journal